@@ -0,0 +1,322 @@
+"""
+Hindcast/backtest of the stream temperature forecasts. Each past day is replayed through the
+daily forecast itself (water_forecasts.forecast_stream_temperature) with its clock set to that
+morning and its gauge and weather data read from the local store instead of the webservices: the
+last day of gauge observations up to the forecast time, and the Openweathermap forecast logged
+by that morning's run. Gauge history missing from the store is downloaded from USGS first
+(usgs_calls.backfill_iv). Past weather forecasts can't be downloaded, so days before forecasts were
+logged fall back to the high air temperature in the zone forecast log, and days with neither are skipped.
+Each zone runs in its own worker process. The predicted highs are scored against the observed
+daily highs: mean absolute error, bias, and how often the predicted risk class matched the observed one.
+The morning's tw_min and q_mean inputs are also compared with the day's observed minimum water
+temperature and mean flow, and the errors are saved to water_forecasts.INPUT_ERRORS_FILE for the
+forecast ensemble.
+
+Run from the program folder:
+    python backtest.py START_DATE END_DATE [FORECAST_HOUR]
+    e.g. python backtest.py 2022-06-15 2022-09-30 8
+"""
+
+###############################################################################
+# REQUIREMENTS
+###############################################################################
+
+import io
+import os
+import sys
+import json
+import time
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+import local_store
+import risk_levels
+import site_registry
+import usgs_calls
+import water_forecasts
+
+###############################################################################
+# CONFIG
+###############################################################################
+
+# Local hour the morning forecast is made (the deployed alert goes out at 08)
+FORECAST_HOUR = 8
+
+# Worker processes, one per zone by default
+MAX_WORKERS = None
+
+# Download gauge history missing from the local store before replaying
+BACKFILL = True
+
+# Fewest replayed days needed to estimate a zone's input errors for the ensemble
+MIN_ERROR_DAYS = 30
+
+# Weather description used for days replayed from the logged high air temperature alone
+UNLOGGED_WEATHER = "forecast not logged"
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+
+
+def read_air_highs(zone, start, end):
+    """
+    Return a dictionary of {date: forecast high air temperature (F)} for a zone from the zone forecast
+    log, using the first logged forecast of each local day.
+    """
+    logged = local_store.read_zone_forecasts(zone, start, end).dropna(subset=["ta_max"])
+    return first_of_each_day(logged, "ta_max")
+
+
+def first_of_each_day(logged, column):
+    """
+    Return a dictionary of {local date: value} from a run log dataframe (run_time column in epoch
+    seconds), keeping the first run of each local day.
+    """
+    local_dates = pd.to_datetime(logged["run_time"], unit="s", utc=True).dt.tz_convert(usgs_calls.LOCAL_TZ).dt.date
+    first_runs = logged.assign(local_date=local_dates).drop_duplicates(subset=["local_date"], keep="first")
+    return dict(zip(first_runs["local_date"], first_runs[column]))
+
+
+def backfill_zones(zones, start, end):
+    """
+    Make sure the local store holds the flow and water temperature observations of every zone's gauges
+    between two timezone-aware datetimes, downloading anything missing from USGS.
+    """
+    for param, key in (("00060", "flow_gauge"), ("00010", "temp_gauge")):
+        sites = list(dict.fromkeys(zone_info[key] for zone_info in zones))
+        usgs_calls.backfill_iv(sites, (param,), start, end)
+
+
+def store_gauge_source(sites_params, start, end):
+    """
+    Build a gauge data source for forecast_stream_temperature that reads the local store instead of
+    the webservice. The observations for each (site, parameter) pair between two datetimes are read
+    once; the source then returns the day up to the forecast time as a USGS json response, or None if
+    the pair wasn't read.
+    """
+    series = {}
+    for site, param in sites_params:
+        observations = local_store.read_observations(site, param, int(start.timestamp()), int(end.timestamp()))
+        epochs = np.array([local_store.to_epoch(obs["dateTime"]) for obs in observations], dtype=np.int64)
+        series[(site, param)] = (epochs, observations)
+
+    def gauge_source(site, param, now):
+        if (site, param) not in series:
+            return None
+        epochs, observations = series[(site, param)]
+        now_epoch = int(now.timestamp())
+        first, last = np.searchsorted(epochs, [now_epoch - 24 * 60 * 60, now_epoch], side="right")
+        timeseries = []
+        if last > first:
+            timeseries.append({"sourceInfo": {"siteCode": [{"value": site}]},
+                               "variable": {"variableCode": [{"value": param}]},
+                               "values": [{"value": observations[first:last]}]})
+        return {"value": {"timeSeries": timeseries}}
+
+    return gauge_source
+
+
+def store_weather_source(zone, start, end):
+    """
+    Build a weather source for forecast_stream_temperature from the local store: the first weather
+    forecast logged for the zone on the forecast day, or for days before forecasts were logged, a
+    single afternoon hour at the high air temperature from the zone forecast log. Returns None for
+    days with neither.
+    """
+    logged = first_of_each_day(local_store.read_weather_forecasts(zone, start, end), "forecast")
+    air_highs = read_air_highs(zone, start, end)
+
+    def weather_source(zone_info, now):
+        if now.date() in logged:
+            return logged[now.date()]
+        if now.date() not in air_highs:
+            return None
+        afternoon = now.normalize() + pd.Timedelta(hours=15)
+        return {"timezone_offset": int(now.utcoffset().total_seconds()),
+                "hourly": [{"dt": int(afternoon.timestamp()), "temp": air_highs[now.date()],
+                            "weather": [{"description": UNLOGGED_WEATHER}]}]}
+
+    return weather_source
+
+
+def replay_zone_forecasts(zone_info, start_date, end_date, forecast_hour=FORECAST_HOUR):
+    """
+    Replay a zone's morning forecast on each day between two dates from the local store and pair it
+    with that day's observed high water temperature. Returns a dataframe with one row per day that
+    has both (date, the model inputs ta_max, tw_min, q_mean, doy, the predicted high and risk level,
+    and observed) and the number of days skipped.
+    """
+    start = pd.Timestamp(start_date).tz_localize(usgs_calls.LOCAL_TZ)
+    end = pd.Timestamp(end_date).tz_localize(usgs_calls.LOCAL_TZ) + pd.Timedelta(days=1)
+    # the forecast reads the last day of gauge data, so read one extra day before the start
+    gauge_source = store_gauge_source([(zone_info["flow_gauge"], "00060"), (zone_info["temp_gauge"], "00010")],
+                                      start - pd.Timedelta(days=1), end)
+    weather_source = store_weather_source(zone_info["zone"], start, end)
+    temp = local_store.read_iv(zone_info["temp_gauge"], "00010", start, end)
+    flow = local_store.read_iv(zone_info["flow_gauge"], "00060", start, end)
+
+    rows = []
+    skipped = 0
+    for date in pd.date_range(start_date, end_date, freq="D"):
+        day = date.tz_localize(usgs_calls.LOCAL_TZ)  # local midnight, whether or not it's daylight time
+        now = day + pd.Timedelta(hours=forecast_hour)
+        with contextlib.redirect_stdout(io.StringIO()):  # the forecast steps print for every call
+            forecasts = water_forecasts.forecast_stream_temperature(
+                clock=lambda: now, gauge_source=gauge_source, weather_source=weather_source, zones=[zone_info])
+        day_temps = temp["value"][(temp["dateTime"] >= day) & (temp["dateTime"] < day + pd.Timedelta(days=1))]
+        day_flows = flow["value"][(flow["dateTime"] >= day) & (flow["dateTime"] < day + pd.Timedelta(days=1))]
+        if len(forecasts) == 0 or day_temps.count() == 0:
+            skipped += 1
+            continue
+        forecast = forecasts[0]
+        rows.append({"date": day.date(), "ta_max": forecast["ta_max"], "tw_min": forecast["tw_min"],
+                     "q_mean": forecast["q_mean"], "doy": forecast["doy"], "predicted": forecast["max_temp"],
+                     "pm_risk": forecast["pm_risk"], "observed": usgs_calls.c_to_f(day_temps.max()),
+                     "observed_tw_min": usgs_calls.c_to_f(day_temps.min()),
+                     "observed_q_mean": day_flows.mean() if day_flows.count() > 0 else np.nan,
+                     "tw_noise": gauge_noise(day_temps.to_numpy() * 9 / 5),
+                     "q_noise": gauge_noise(np.log(day_flows[day_flows > 0].to_numpy()))})
+    columns = ["date", "ta_max", "tw_min", "q_mean", "doy", "predicted", "pm_risk", "observed",
+               "observed_tw_min", "observed_q_mean", "tw_noise", "q_noise"]
+    return pd.DataFrame(rows, columns=columns), skipped
+
+
+def gauge_noise(values):
+    """
+    Estimate the measurement noise (standard deviation) of a day of 15 minute gauge values from their
+    second differences, which cancel the smooth daily cycle and leave 6x the noise variance. Returns
+    NaN for fewer than 3 values.
+    """
+    values = values[~np.isnan(values)]
+    if len(values) < 3:
+        return np.nan
+    return float(np.sqrt(np.mean(np.diff(values, n=2) ** 2) / 6))
+
+
+def estimate_input_errors(days):
+    """
+    Estimate a zone's ensemble input errors from its replayed forecasts (see replay_zone_forecasts). Each
+    combines the root mean square difference between the morning forecast's input and the day's observed
+    value with the gauge's measurement noise: tw_min against the day's minimum water temperature (F) and
+    q_mean against the day's mean flow (as a log ratio, i.e. a fraction of the flow). Inputs with fewer
+    than MIN_ERROR_DAYS days are left out.
+    """
+    errors = {}
+    tw_min = days[["tw_min", "observed_tw_min", "tw_noise"]].dropna()
+    if len(tw_min) >= MIN_ERROR_DAYS:
+        variance = np.mean((tw_min["tw_min"] - tw_min["observed_tw_min"]) ** 2) + np.mean(tw_min["tw_noise"] ** 2)
+        errors["tw_min"] = round(float(np.sqrt(variance)), 3)
+    q_mean = days[["q_mean", "observed_q_mean", "q_noise"]][(days["q_mean"] > 0) & (days["observed_q_mean"] > 0)].dropna()
+    if len(q_mean) >= MIN_ERROR_DAYS:
+        variance = np.mean(np.log(q_mean["q_mean"] / q_mean["observed_q_mean"]) ** 2) + np.mean(q_mean["q_noise"] ** 2)
+        errors["q_mean"] = round(float(np.sqrt(variance)), 4)
+    return errors
+
+
+def write_input_errors(results, file_name=None):
+    """
+    Save the input errors estimated for each zone in a backtest to the fitted input error file read by
+    the ensemble (water_forecasts.INPUT_ERRORS_FILE), keeping the saved errors of zones not in the backtest
+    or without enough days.
+    """
+    file_name = water_forecasts.INPUT_ERRORS_FILE if file_name is None else file_name
+    saved = {}
+    if os.path.exists(file_name):
+        with open(file_name) as json_file:
+            saved = json.load(json_file)
+    for result in results:
+        if len(result["input_errors"]) > 0:
+            saved[result["zone"]] = dict(result["input_errors"], days=result["scores"]["days"])
+    with open(file_name, "w") as json_file:
+        json.dump(saved, json_file, indent=2)
+
+
+def score_forecasts(predicted, observed, reach=None):
+    """
+    Score predicted against observed daily high water temperatures (F). Returns a dictionary of the
+    number of days, mean absolute error, bias (mean of predicted - observed), the share of days whose
+    predicted risk class matched the observed one, and that hit rate for each observed risk class.
+    """
+    predicted = np.asarray(predicted, dtype=float)
+    observed = np.asarray(observed, dtype=float)
+    table = risk_levels.get_temp_table(reach=reach)
+    scores = {"days": len(observed), "mae": np.nan, "bias": np.nan, "hit_rate": np.nan}
+    scores.update({f"hit_rate_{label.lower()}": np.nan for label in table["labels"]})
+    if len(observed) == 0:
+        return scores
+    errors = predicted - observed
+    predicted_class = risk_levels.level_index(predicted, table)
+    observed_class = risk_levels.level_index(observed, table)
+    scores["mae"] = float(np.mean(np.abs(errors)))
+    scores["bias"] = float(np.mean(errors))
+    scores["hit_rate"] = float(np.mean(predicted_class == observed_class))
+    for level, label in enumerate(table["labels"]):
+        in_class = observed_class == level
+        if in_class.any():
+            scores[f"hit_rate_{label.lower()}"] = float(np.mean(predicted_class[in_class] == level))
+    return scores
+
+
+def backtest_zone(zone_info, start_date, end_date, forecast_hour=FORECAST_HOUR):
+    """
+    Replay a zone's morning forecasts between two dates and score them. Runs in a worker process.
+    Returns a dictionary with the zone name, the number of days skipped for missing data, the scores
+    (see score_forecasts), the estimated input errors (see estimate_input_errors), and the daily
+    results dataframe (see replay_zone_forecasts).
+    """
+    start = time.perf_counter()
+    days, skipped = replay_zone_forecasts(zone_info, start_date, end_date, forecast_hour=forecast_hour)
+    return {"zone": zone_info["zone"], "skipped": skipped,
+            "scores": score_forecasts(days["predicted"], days["observed"], reach=zone_info["zone"]),
+            "input_errors": estimate_input_errors(days), "days": days, "seconds": time.perf_counter() - start}
+
+
+def run_backtest(start_date, end_date, zones=None, forecast_hour=FORECAST_HOUR, max_workers=MAX_WORKERS,
+                 backfill=BACKFILL):
+    """
+    Backtest every forecast zone in the site registry (or a given list of registry zones) between two
+    dates, one zone per worker process, downloading any gauge history missing from the local store
+    first. Returns the list of backtest_zone results in zone order.
+    """
+    if zones is None:
+        zones = site_registry.forecast_zones()
+    if len(zones) == 0:
+        return []
+    if backfill:
+        backfill_zones(zones, pd.Timestamp(start_date).tz_localize(usgs_calls.LOCAL_TZ) - pd.Timedelta(days=1),
+                       pd.Timestamp(end_date).tz_localize(usgs_calls.LOCAL_TZ) + pd.Timedelta(days=1))
+    with ProcessPoolExecutor(max_workers=max_workers or len(zones)) as executor:
+        jobs = [executor.submit(backtest_zone, zone_info, start_date, end_date, forecast_hour) for zone_info in zones]
+        return [job.result() for job in jobs]
+
+
+def report_backtest(results):
+    """
+    Print a table of the backtest scores for each zone.
+    """
+    print(f"{'Zone':<40}{'Days':>6}{'Skipped':>9}{'MAE F':>8}{'Bias F':>8}{'Hit rate':>10}  Hit rate by observed class")
+    for result in results:
+        scores = result["scores"]
+        class_rates = ", ".join(f"{key.replace('hit_rate_', '')} {value:.0%}" for key, value in scores.items()
+                                if key.startswith("hit_rate_") and not np.isnan(value))
+        print(f"{result['zone']:<40}{scores['days']:>6}{result['skipped']:>9}{scores['mae']:>8.2f}"
+              f"{scores['bias']:>8.2f}{scores['hit_rate']:>10.0%}  {class_rates}")
+    print("Input errors for the ensemble (tw_min F, q_mean fraction of flow):")
+    for result in results:
+        errors = ", ".join(f"{key} {value:g}" for key, value in result["input_errors"].items())
+        print(f"{result['zone']:<40}{errors or f'fewer than {MIN_ERROR_DAYS} days, not estimated'}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        print(__doc__)
+        sys.exit(1)
+    run_start = time.perf_counter()
+    backtest_results = run_backtest(sys.argv[1], sys.argv[2],
+                                    forecast_hour=int(sys.argv[3]) if len(sys.argv) == 4 else FORECAST_HOUR)
+    report_backtest(backtest_results)
+    write_input_errors(backtest_results)
+    print(f"Backtest finished in {time.perf_counter() - run_start:.1f} s.")
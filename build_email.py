@@ -20,6 +20,13 @@ risk_colors = {
     "red": "red"
 }
 
+# Risk Level colors by the risk level labels in risk_levels.TEMP_RISK_TABLES
+risk_level_colors = {
+    "Low": risk_colors["green"],
+    "Concern": risk_colors["yellow"],
+    "High": risk_colors["red"]
+}
+
 # discharge colors based on USGS coloring scheme
 q_colors = {
     "orange": "#f3a711",
@@ -34,15 +41,42 @@ q_colors = {
 # Mailing functions
 ###############################################################################
 
-# Testing dictionary with example key/value pairs
-# {'site': '09064600', 'yesterday_mean_q': 57, 'yesterday_max_t': nan, 'alias': 'Upper Eagle River, Minturn Area', 'risk': '<no rating>', 'percent_of_median': 76}
+# Testing record with example values
+# SiteConditions(site='09064600', alias='Upper Eagle River @ Minturn', yesterday_mean_q=57, yesterday_max_t=nan, percent_of_median=76, t_risk=None, q_rating='Below Normal')
+
+
+def format_value(value):
+    """
+    Format a numeric table value for display, with '---' for missing data.
+    """
+    if value is None or value != value:  # NaN
+        return '---'
+    return f"{int(value)}"
+
+
+def format_time(value):
+    """
+    Format a forecast time of day for display (e.g. '2 PM'), with '---' when the time is missing.
+    """
+    if value is None:
+        return '---'
+    return f"{value:%I %p}".lstrip('0')
+
+
+def format_percent(value):
+    """
+    Format a probability (0-1) as a whole percent for display, with '---' for missing data.
+    """
+    if value is None or value != value:  # NaN
+        return '---'
+    return f"{value:.0%}"
 
 
 def build_yesterday_conditions_table(site_data_list):
 
     """
     Create a color-coded html table element of temperatures, flows, and fish risk rating from
-    the previous afternoon gauge site readings. Accepts a list of dictionaries that have
+    the previous afternoon gauge site readings. Accepts a list of SiteConditions records that have
     site information (name, risk level, etc.).  Loops through the list and uses them
     to build an html table that is inserted into a longer html that forms the email body.
     Return this string of html to use in the update email.
@@ -61,17 +95,16 @@ def build_yesterday_conditions_table(site_data_list):
     for site_info in site_data_list:
         print(f"site_info: {site_info}")
         # assign css cell colors for temperature risk
-        if site_info['t_risk'] == "LOW":
-            risk_col = risk_colors["green"]
-        elif site_info['t_risk'] == "CONCERN":
-            risk_col = risk_colors["yellow"]
-        elif site_info['t_risk'] == "HIGH":
-            risk_col = risk_colors["red"]
+        risk_col = risk_level_colors.get(site_info.t_risk, "white")
+        t_risk = site_info.t_risk.upper() if site_info.t_risk is not None else "<em>no rating</em>"
+
+        # assign css colors for flow conditions, flow isn't shown for sites without a seasonal rating
+        q_rating = site_info.q_rating
+        if q_rating is not None:
+            mean_q = format_value(site_info.yesterday_mean_q)
+            percent_of_median = format_value(site_info.percent_of_median)
         else:
-            risk_col = "white"
-
-        # assign css colors for flow conditions
-        q_rating = site_info['q_rating']
+            mean_q = percent_of_median = q_rating = '---'
 
         if q_rating == "Low":
             q_col = q_colors["orange"]
@@ -87,12 +120,12 @@ def build_yesterday_conditions_table(site_data_list):
             q_col = "white"
 
         row_str = f"<tr>" \
-                  f"<td style='font-size:0.9rem; '>{site_info['alias']}</td>" \
-                  f"<td style='text-align:center; border-left: 1px solid; background-color:{risk_col};'>{site_info['yesterday_max_t']}</td>" \
-                  f"<td style='text-align:center; font-weight: bold; background-color:{risk_col};'>{site_info['t_risk']}</td>" \
-                  f"<td style='text-align:center; color:DarkBlue; border-left: 1px solid; '>{site_info['yesterday_mean_q']}</td>" \
-                  f"<td style='text-align:center; color:DarkBlue;'>{site_info['percent_of_median']} %</td>" \
-                  f"<td style='text-align:center; background-color:{q_col}'><strong>{site_info['q_rating'].upper()}</strong></td>" \
+                  f"<td style='font-size:0.9rem; '>{site_info.alias}</td>" \
+                  f"<td style='text-align:center; border-left: 1px solid; background-color:{risk_col};'>{format_value(site_info.yesterday_max_t)}</td>" \
+                  f"<td style='text-align:center; font-weight: bold; background-color:{risk_col};'>{t_risk}</td>" \
+                  f"<td style='text-align:center; color:DarkBlue; border-left: 1px solid; '>{mean_q}</td>" \
+                  f"<td style='text-align:center; color:DarkBlue;'>{percent_of_median} %</td>" \
+                  f"<td style='text-align:center; background-color:{q_col}'><strong>{q_rating.upper()}</strong></td>" \
                   f"</tr>"
         all_rows_str = all_rows_str + row_str
 
@@ -114,8 +147,10 @@ def build_forecast_table(zone_list):
     table_header_str = "<tr>" \
                        "<th style='text-align:center; border-bottom: solid 1px; '><strong>River Zone</strong></th>" \
                        "<th style='text-align:center; word-wrap:break-word; max-width:120px; border-bottom: solid 1px; border-left: 1px solid;'><strong>Current Morning Water Temp &#176;F</strong></th>" \
-                       "<th style='text-align:center; word-wrap:break-word; max-width:150px; word-wrap: break-word; max-width: 150px; border-bottom: solid 1px; border-left: 1px solid;'><strong>Afternoon Predicted High Water Temp &#176;F</strong></th>" \
+                       "<th style='text-align:center; word-wrap:break-word; max-width:150px; word-wrap: break-word; max-width: 150px; border-bottom: solid 1px; border-left: 1px solid;'><strong>Afternoon Predicted High Water Temp &#176;F</strong><br><span style='font-size:80%;'>(95% range)</span></th>" \
                        "<th style='text-align:center; word-wrap:break-word; max-width:150px; border-bottom: solid 1px;'><strong>Afternoon Predicted Fishing Risk</strong></th>" \
+                       "<th style='text-align:center; word-wrap:break-word; max-width:120px; border-bottom: solid 1px; border-left: 1px solid;'><strong>Predicted Time Reaching Concern / High</strong></th>" \
+                       "<th style='text-align:center; word-wrap:break-word; max-width:120px; border-bottom: solid 1px; border-left: 1px solid;'><strong>Chance of Reaching Concern / High</strong></th>" \
                        "<th style='text-align:center; word-wrap:break-word; max-width:130px; border-bottom: solid 1px; border-left: 1px solid; '><strong>Predicted High Air Temp &#176;F</strong></th>" \
                        "<th style='text-align:center; border-bottom: solid 1px;  word-wrap:break-word; '><strong>PM Weather</strong></th>" \
                        "</tr>"
@@ -123,20 +158,16 @@ def build_forecast_table(zone_list):
     if len(zone_list) > 0:
         for item in zone_list:
             print(item)
-            if item['pm_risk'] == "Low":
-                pm_risk_col = risk_colors["green"]
-            elif item['pm_risk'] == "Concern":
-                pm_risk_col = risk_colors["yellow"]
-            elif item['pm_risk'] == "High":
-                pm_risk_col = risk_colors["red"]
-            else:
-                pm_risk_col = "white"
+            pm_risk_col = risk_level_colors.get(item['pm_risk'], "white")
 
             row_str = f"<tr>" \
                       f"<td style='font-size:0.9rem; '>{item['zone']}</td>" \
                       f"<td style='text-align:center; border-left: 1px solid; '>{item['current_temp']}</td>" \
-                      f"<td style='text-align:center; border-left: 1px solid; background-color:{pm_risk_col} '>{item['max_temp']}</td>" \
+                      f"<td style='text-align:center; border-left: 1px solid; background-color:{pm_risk_col} '>{item['max_temp']}" \
+                      f"<br><span style='font-size:80%;'>({format_value(item.get('max_temp_lower'))} - {format_value(item.get('max_temp_upper'))})</span></td>" \
                       f"<td style='text-align:center; font-weight: bold; background-color:{pm_risk_col}'>{item['pm_risk'].upper()}</td>" \
+                      f"<td style='text-align:center; border-left: 1px solid; '>{format_time(item.get('concern_time'))} / {format_time(item.get('high_time'))}</td>" \
+                      f"<td style='text-align:center; border-left: 1px solid; '>{format_percent(item.get('p_concern'))} / {format_percent(item.get('p_high'))}</td>" \
                       f"<td style='text-align:center; border-left: 1px solid'>{item['pm_air_temp']}</td>" \
                       f"<td><em>{item['pm_weather'].title()}</em></td>" \
                       f"</tr>"
@@ -157,7 +188,48 @@ def build_forecast_table(zone_list):
         return None
 
 
-def build_html_email_message(conditions, forecast):
+def build_outlook_table(zone_list):
+
+    """
+    Create a color-coded html table of each forecast zone's predicted high water temperature for the
+    next few days. Return None if no zone has an outlook.
+    """
+
+    outlook_zones = [item for item in zone_list if len(item.get('outlook', [])) > 0]
+    if len(outlook_zones) == 0:
+        return None
+    # zones can have different outlook days, so the columns cover every date and each zone's cells follow them
+    dates = sorted({day['date'] for item in outlook_zones for day in item['outlook']})
+    table_header_str = "<tr><th style='text-align:center; border-bottom: solid 1px; '><strong>River Zone</strong></th>"
+    for date in dates:
+        table_header_str += f"<th style='text-align:center; border-bottom: solid 1px; border-left: 1px solid;'>" \
+                            f"<strong>{date:%a %m/%d}</strong></th>"
+    table_header_str += "</tr>"
+
+    all_rows_str = ""
+    for item in outlook_zones:
+        row_str = f"<tr><td style='font-size:0.9rem; '>{item['zone']}</td>"
+        days_by_date = {day['date']: day for day in item['outlook']}
+        for date in dates:
+            day = days_by_date.get(date)
+            if day is None:
+                row_str += "<td style='text-align:center; border-left: 1px solid;'>---</td>"
+                continue
+            risk_col = risk_level_colors.get(day['risk'], "white")
+            row_str += f"<td style='text-align:center; border-left: 1px solid; background-color:{risk_col}'>" \
+                       f"{day['max_temp']}<br><span style='font-size:80%;'>air {format_value(day['ta_max'])}</span></td>"
+        all_rows_str += row_str + "</tr>"
+
+    full_table_str = f"<div><h3>Water Temperature <em>OUTLOOK</em> (Predicted Highs &#176;F)</h3>" \
+                     f"<table cellspacing='0' cellpadding='3' style='border: 1px solid black;'>" \
+                     f"{table_header_str}{all_rows_str}</table></div>" \
+                     f"<p style='text-align:center; font-size:90%;'>" \
+                     f"Outlook predictions use the daily weather forecast and today's streamflow and become " \
+                     f"less certain each day out; check back for updated forecasts before your trip.</p><br>"
+    return full_table_str
+
+
+def build_html_email_message(conditions, forecast, outlook=""):
 
     """  Create an html email body with the risk ratings for each site, tips on warm water fishing, and information
     about the Eagle River Watershed Council. Return the message body as a long string"""
@@ -176,8 +248,8 @@ def build_html_email_message(conditions, forecast):
 
     # make the table of current conditions
     yesterday_table_html = conditions
-    # make the afternoon forecast table
-    fx_table_html = forecast
+    # make the afternoon forecast table, followed by the multi-day outlook
+    fx_table_html = forecast + outlook
 
     # read in the rest of the email body... the risk key and the footer
     with open("email_templates/risk_key_and_footer.html") as template:
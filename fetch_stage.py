@@ -0,0 +1,57 @@
+"""
+Concurrent fetch stage run at the start of the program. Every upstream call the run will need
+(USGS instantaneous values for all gauges, USGS flow percentile tables, and Openweathermap
+forecasts for each forecast zone) is sent at once on a thread pool. The responses land in the
+USGS run cache and the local http cache, so the existing processing functions in main.py and
+water_forecasts.py then find everything in memory or on disk instead of waiting on each call in turn.
+"""
+
+###############################################################################
+# REQUIREMENTS
+###############################################################################
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import hourly_weather
+import usgs_calls
+
+###############################################################################
+# CONFIG
+###############################################################################
+
+# Maximum number of upstream calls in flight at once (the http session separately limits connections per host)
+MAX_WORKERS = 8
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+
+
+def prefetch(gauge_sites, zone_sites, max_workers=MAX_WORKERS):
+    """
+    Send all of the run's USGS and weather requests concurrently and wait for them to finish.
+    gauge_sites is the list of gauges reported in the conditions table; zone_sites is the list of
+    forecast zones from the site registry (flow_gauge, temp_gauge, lat, lon keys).
+    Failures are printed and left for the processing functions to handle as before.
+    """
+    start = time.perf_counter()
+    all_gauges = list(gauge_sites)
+    for zone in zone_sites:
+        for gauge in (zone["flow_gauge"], zone["temp_gauge"]):
+            if gauge not in all_gauges:
+                all_gauges.append(gauge)
+    zone_coords = list(dict.fromkeys((zone["lat"], zone["lon"]) for zone in zone_sites))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        jobs = [executor.submit(usgs_calls.get_multi_site_data, all_gauges, ("00060", "00010"), "P1D")]
+        jobs += [executor.submit(usgs_calls.load_percentile_table, list(gauge_sites))]
+        jobs += [executor.submit(hourly_weather.get_ow_fx, lat, lon) for lat, lon in zone_coords]
+        for job in jobs:
+            try:
+                job.result()
+            except Exception as err:
+                print(f"Prefetch call failed: {err}")
+
+    print(f"Prefetched {len(jobs)} upstream calls in {time.perf_counter() - start:.1f} s "
+          f"with up to {max_workers} at once.")
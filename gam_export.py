@@ -0,0 +1,292 @@
+"""
+Export the pickled pygam stream temperature models to plain NumPy array files, and evaluate them
+without pygam. A fitted LinearGAM is a sum of B-spline terms (one per model feature) and an
+intercept, so its prediction only needs each term's edge knots, spline count and order, the fitted
+coefficients, and the link function, and its confidence intervals a factor of the coefficient
+covariance matrix, computed once at export. Those are written to ./gam_models/<model>.npz, next to
+the pickle, and read back by water_forecasts, so forecasts don't need pygam, scipy, or an unpickle
+of version-sensitive pygam objects. pygam is only imported here when exporting or checking parity.
+
+Run this file to (re)export every model and check the exported arrays against gam.predict:
+    python gam_export.py [model_name.obj ...]
+"""
+
+###############################################################################
+# REQUIREMENTS
+###############################################################################
+
+import os
+import sys
+import glob
+import pickle
+import numpy as np
+
+###############################################################################
+# CONFIG
+###############################################################################
+
+MODEL_FOLDER = "./gam_models/"
+
+# Largest difference (F) allowed between the exported model and gam.predict / gam.confidence_intervals
+PARITY_TOLERANCE = 1e-9
+
+# Confidence interval widths whose critical values are stored with each exported model
+INTERVAL_WIDTHS = (0.8, 0.9, 0.95, 0.99)
+
+# Inverse link functions, mapping the linear predictor to the prediction
+INVERSE_LINKS = {
+    'identity': lambda eta: eta,
+    'log': np.exp,
+    'logit': lambda eta: 1 / (1 + np.exp(-eta)),
+    'inverse': lambda eta: 1 / eta,
+    'inv_squared': lambda eta: 1 / np.sqrt(eta),
+}
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+
+
+def array_file_name(model_name, folder=MODEL_FOLDER):
+    """
+    Return the path of the exported array file for a model (e.g. 'gam_kremmling.obj' -> './gam_models/gam_kremmling.npz').
+    """
+    return os.path.join(folder, f"{os.path.splitext(model_name)[0]}.npz")
+
+
+def export_model(model_name, folder=MODEL_FOLDER):
+    """
+    Unpickle a pygam model and write its term layout, knots, coefficients, link, and covariance factor
+    to an .npz file.
+    Only spline and intercept terms are supported (all of the stream temperature models use
+    s(0) + s(1) + s(2) + s(3) + intercept). Returns the path of the array file.
+    """
+    with open(os.path.join(folder, model_name), 'rb') as model_file:
+        gam = pickle.load(model_file)
+
+    term_types, features, by_features, n_splines, spline_orders, periodic, edge_knots = [], [], [], [], [], [], []
+    for term in gam.terms:
+        if term.isintercept:
+            term_types.append('intercept')
+            features.append(-1)
+            by_features.append(-1)
+            n_splines.append(1)
+            spline_orders.append(0)
+            periodic.append(False)
+            edge_knots.append([np.nan, np.nan])
+        elif type(term).__name__ == 'SplineTerm':
+            term_types.append('spline')
+            features.append(term.feature)
+            by_features.append(-1 if term.by is None else term.by)
+            n_splines.append(term.n_splines)
+            spline_orders.append(term.spline_order)
+            periodic.append(term.basis == 'cp')
+            edge_knots.append(list(term.edge_knots_))
+        else:
+            raise ValueError(f"{model_name}: {type(term).__name__} terms can't be exported")
+
+    # Factor the coefficient covariance matrix (cov = F F^T) so interval variances are a row-wise sum
+    # of squares. An eigen decomposition is used rather than Cholesky because the fitted covariance is
+    # only positive semi-definite (its smallest eigenvalues round to just below zero).
+    eigenvalues, eigenvectors = np.linalg.eigh(gam.statistics_['cov'])
+    cov_factor = eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))
+    interval_critical_values = [critical_value(gam, width) for width in INTERVAL_WIDTHS]
+
+    file_name = array_file_name(model_name, folder)
+    np.savez(file_name,
+             term_types=np.array(term_types), features=np.array(features), by_features=np.array(by_features),
+             n_splines=np.array(n_splines), spline_orders=np.array(spline_orders), periodic=np.array(periodic),
+             edge_knots=np.array(edge_knots, dtype=float), coef=np.asarray(gam.coef_, dtype=float),
+             link=np.array(gam.link.__class__.__name__.replace('Link', '').lower()),
+             cov_factor=cov_factor, interval_widths=np.array(INTERVAL_WIDTHS),
+             interval_critical_values=np.array(interval_critical_values))
+    print(f"Exported {model_name} to {file_name}")
+    return file_name
+
+
+def critical_value(gam, width):
+    """
+    Return the critical value pygam uses for a two-sided confidence interval of the given width: a
+    t quantile on the model's residual degrees of freedom when the scale is estimated (LinearGAM),
+    otherwise a normal quantile. scipy is imported here because it is only needed at export.
+    """
+    from scipy import stats
+    quantile = 1 - (1 - width) / 2
+    if gam.distribution._known_scale:
+        return float(stats.norm.ppf(quantile))
+    return float(stats.t.ppf(quantile, df=gam.statistics_['n_samples'] - gam.statistics_['edof']))
+
+
+def b_spline_basis(x, edge_knots, n_splines, spline_order, periodic=False):
+    """
+    Return the B-spline basis (len(x) rows, n_splines columns) of a spline term, built with the same
+    vectorized De Boor recursion as pygam.utils.b_spline_basis. Values past the edge knots are
+    extrapolated linearly.
+    """
+    n_splines += spline_order * periodic
+
+    # rescale the edge knots to [0, 1] and build evenly spaced boundary knots
+    edge_knots = np.sort(edge_knots)
+    offset = edge_knots[0]
+    scale = edge_knots[-1] - edge_knots[0]
+    if scale == 0:
+        scale = 1
+    boundary_knots = np.linspace(0, 1, 1 + n_splines - spline_order)
+    diff = boundary_knots[1] - boundary_knots[0]
+
+    x = (np.ravel(x).astype(float) - offset) / scale
+    if periodic:
+        x = x % (1 + 1e-9)
+
+    # append 0 and 1 to get the basis gradients at the ends for extrapolation
+    x = np.r_[x, 0.0, 1.0]
+    extrapolate_left = x < 0
+    extrapolate_right = x > 1
+    interpolate = ~(extrapolate_left | extrapolate_right)
+    x = x[:, np.newaxis]
+
+    aug = np.arange(1, spline_order + 1) * diff
+    aug_knots = np.r_[-aug[::-1], boundary_knots, 1 + aug]
+    aug_knots[-1] += 1e-9  # last knot inclusive
+
+    # Haar basis, then the recursion up to the spline order
+    bases = ((x >= aug_knots[:-1]) & (x < aug_knots[1:])).astype(float)
+    bases[-1] = bases[-2][::-1]  # symmetric bases at 0 and 1
+    prev_bases = bases[-2:]
+    maxi = len(aug_knots) - 1
+    for m in range(2, spline_order + 2):
+        maxi -= 1
+        left = (x - aug_knots[:maxi]) * bases[:, :maxi] / (aug_knots[m - 1:maxi + m - 1] - aug_knots[:maxi])
+        right = (aug_knots[m:maxi + m] - x) * bases[:, 1:maxi + 1] / (aug_knots[m:maxi + m] - aug_knots[1:maxi + 1])
+        prev_bases = bases[-2:]
+        bases = left + right
+
+    if periodic and spline_order > 0:
+        bases[:, :spline_order] = np.maximum(bases[:, :spline_order], bases[:, -spline_order:])
+        bases = bases[:, :-spline_order]
+
+    # linear extrapolation from the end knots
+    if spline_order > 0 and not interpolate.all():
+        bases[~interpolate] = 0.0
+        left = prev_bases[:, :-1] / (aug_knots[spline_order:-1] - aug_knots[:-spline_order - 1])
+        right = prev_bases[:, 1:] / (aug_knots[spline_order + 1:] - aug_knots[1:-spline_order])
+        grads = spline_order * (left - right)
+        if extrapolate_left.any():
+            bases[extrapolate_left] = grads[0] * x[extrapolate_left] + bases[-2]
+        if extrapolate_right.any():
+            bases[extrapolate_right] = grads[1] * (x[extrapolate_right] - 1) + bases[-1]
+
+    return bases[:-2]
+
+
+class ArrayGAM:
+    """
+    A GAM loaded from an exported .npz file. predict() gives the same result as the pygam model's
+    predict() using only NumPy.
+    """
+
+    def __init__(self, file_name):
+        with np.load(file_name) as arrays:
+            self.term_types = [str(term_type) for term_type in arrays['term_types']]
+            self.features = arrays['features']
+            self.by_features = arrays['by_features']
+            self.n_splines = arrays['n_splines']
+            self.spline_orders = arrays['spline_orders']
+            self.periodic = arrays['periodic']
+            self.edge_knots = arrays['edge_knots']
+            self.coef_ = arrays['coef']
+            self.link = str(arrays['link'])
+            # models exported before intervals were added don't have these
+            self.cov_factor = arrays['cov_factor'] if 'cov_factor' in arrays else None
+            self.interval_critical_values = dict(zip(arrays['interval_widths'], arrays['interval_critical_values'])) \
+                if 'interval_widths' in arrays else {}
+        if self.link not in INVERSE_LINKS:
+            raise ValueError(f"{file_name}: unsupported link function '{self.link}'")
+
+    def model_matrix(self, x_data):
+        """
+        Return the model matrix (one column per coefficient) for an array of model inputs.
+        """
+        x_data = np.atleast_2d(np.asarray(x_data, dtype=float))
+        columns = []
+        for i, term_type in enumerate(self.term_types):
+            if term_type == 'intercept':
+                columns.append(np.ones((len(x_data), 1)))
+                continue
+            splines = b_spline_basis(x_data[:, self.features[i]], self.edge_knots[i], int(self.n_splines[i]),
+                                     int(self.spline_orders[i]), periodic=bool(self.periodic[i]))
+            if self.by_features[i] >= 0:
+                splines = splines * x_data[:, [self.by_features[i]]]
+            columns.append(splines)
+        return np.hstack(columns)
+
+    def predict(self, x_data):
+        """
+        Return the model prediction for each row of an array of model inputs.
+        """
+        return INVERSE_LINKS[self.link](self.model_matrix(x_data) @ self.coef_)
+
+    def confidence_intervals(self, x_data, width=0.95):
+        """
+        Return the lower and upper confidence interval bounds (one row per input row, like
+        gam.confidence_intervals) for one of the exported INTERVAL_WIDTHS. The covariance factor is
+        computed at export, so each row only costs a matrix product.
+        """
+        if self.cov_factor is None or width not in self.interval_critical_values:
+            raise ValueError(f"No exported {width:.0%} interval for this model, re-run gam_export.py")
+        model_matrix = self.model_matrix(x_data)
+        linear_predictor = model_matrix @ self.coef_
+        std_error = np.sqrt(np.sum((model_matrix @ self.cov_factor) ** 2, axis=1))
+        margin = self.interval_critical_values[width] * std_error
+        return INVERSE_LINKS[self.link](np.column_stack([linear_predictor - margin, linear_predictor + margin]))
+
+
+def check_parity(model_name, folder=MODEL_FOLDER, n_points=2000, seed=0):
+    """
+    Compare an exported model's predictions with the pickled pygam model's on random inputs spread
+    across (and 25% beyond) each feature's knot range. Returns the largest absolute difference in
+    either the predictions or the 95% confidence interval bounds.
+    """
+    with open(os.path.join(folder, model_name), 'rb') as model_file:
+        gam = pickle.load(model_file)
+    array_gam = ArrayGAM(array_file_name(model_name, folder))
+
+    rng = np.random.default_rng(seed)
+    n_features = max(term.feature for term in gam.terms if not term.isintercept) + 1
+    x_data = np.empty((n_points, n_features))
+    for term in gam.terms:
+        if not term.isintercept:
+            low, high = term.edge_knots_
+            pad = 0.25 * (high - low)
+            x_data[:, term.feature] = rng.uniform(low - pad, high + pad, n_points)
+    prediction_diff = np.max(np.abs(gam.predict(x_data) - array_gam.predict(x_data)))
+    interval_diff = np.max(np.abs(gam.confidence_intervals(x_data, width=0.95)
+                                  - array_gam.confidence_intervals(x_data, width=0.95)))
+    return float(max(prediction_diff, interval_diff))
+
+
+def export_all(model_names=None, folder=MODEL_FOLDER):
+    """
+    Export each model (all .obj files in the model folder by default) and check it against gam.predict.
+    Returns True if every model exported and matched within PARITY_TOLERANCE.
+    """
+    if model_names is None:
+        model_names = sorted(os.path.basename(path) for path in glob.glob(os.path.join(folder, "*.obj")))
+    all_passed = True
+    for model_name in model_names:
+        try:
+            export_model(model_name, folder)
+            max_diff = check_parity(model_name, folder)
+        except Exception as error:
+            print(f"Exporting {model_name} was unsuccessful")
+            print(error)
+            all_passed = False
+            continue
+        passed = max_diff <= PARITY_TOLERANCE
+        all_passed = all_passed and passed
+        print(f"{model_name}: max difference from pygam {max_diff:.2e} F, {'ok' if passed else 'FAILED'}")
+    return all_passed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if export_all(sys.argv[1:] or None) else 1)
@@ -3,19 +3,31 @@ Get an hourly temperature forecast from Openweathermap.org and return it as an
 list to be used in the stream temperature prediction model
 """
 import os
+import json
 import requests
 from datetime import datetime as dt
-from datetime import timedelta
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 
+import http_cache
+
 load_dotenv()
 OW_API_KEY = os.getenv('OW_API_KEY')
 
 
-LOWER_EAGLE_COORDS = ["39.651101", "-106.943897"]  # gypsum ponds/gypsum
-SB_UPPER_C_COORDS = ["39.856671", "-106.650389"]
-BASALT_RF_COORDS = ["39.413287", "-107.215794"]
+# Hours of the hourly forecast used for a zone's forecast (from the current hour)
+HOURLY_FX_HOURS = 12
+
+# Other hourly forecast fields kept as dataframe columns: {column: Openweather key}
+HOURLY_FIELDS = {
+    "feels_like": "feels_like",
+    "humidity": "humidity",      # %
+    "clouds": "clouds",          # cloud cover, %
+    "wind_speed": "wind_speed",  # mph
+    "wind_gust": "wind_gust",    # mph
+    "pop": "pop",                # chance of precipitation, 0-1
+}
 
 #------------------------------------------------------------------------------
 
@@ -27,70 +39,58 @@ def get_ow_fx(lat, lon, api_key=OW_API_KEY ):
         ow_api_url = f"https://api.openweathermap.org/data/2.5/onecall?lat={lat}&lon={lon}&units=imperial&exclude=minutely&appid={api_key}"
         print(f"Querying Openweathermap at forecast url:\n{ow_api_url}")
         try:
-            response = requests.get(ow_api_url, timeout=30)
-            print(f"Response status:  {response.status_code}")
-            print(response.raise_for_status())
-            # print(response.json())
-            return response.json()
-        except requests.exceptions.RequestException as err:
+            fx = json.loads(http_cache.cached_get(ow_api_url, source='openweather', timeout=30))
+            # print(fx)
+            return fx
+        except (requests.exceptions.RequestException, ValueError) as err:
             print("Query unsuccessful, returning None")
             print(err)
 
 
-def unpack_fx_data(forecast):
+def unpack_fx_data(forecast, hours=HOURLY_FX_HOURS):
     """
-    Unpack the json object returned from Openweather API, reformat and return the next 24 hours
-    of temperatures and weather descriptions as a timeseries dataframe.
+    Unpack the hourly block of the json object returned from Openweather API and return the next
+    hours of forecast as a timeseries dataframe: local time (dateTime, hour), temperature (temps, F),
+    weather description, and the other hourly fields (see HOURLY_FIELDS) as float columns, with NaN
+    where the response leaves a field out (e.g. rain chance).
     """
     print("Unpacking forecast data")
-    if forecast is not None:
-        times = []
-        temps = []
-        weather = []
-        for hourly_dict in forecast["hourly"][:12]:
-            print(hourly_dict)
-            # make a correction on the UTC datetime of 6 hours for Mountain Daylight Time
-            fx_datetime = dt.utcfromtimestamp(int(hourly_dict["dt"])) - timedelta(hours=6)
-            # times.append(fx_datetime.hour)
-            times.append(fx_datetime)
-            temps.append(round(hourly_dict["temp"], 1))
-            weather.append(hourly_dict["weather"][0]["description"])
-            fx_dataframe = pd.DataFrame({"dateTime": times, "temps": temps, "weather": weather})
-            # fx_dataframe["hour"] = fx_dataframe["dateTime"].dt.strftime("%I:%M %p")
-            fx_dataframe["hour"] = fx_dataframe["dateTime"].dt.hour
+    if forecast is not None and len(forecast.get("hourly", [])) > 0:
+        hourly = forecast["hourly"][:hours]
+        # the response's timezone offset (seconds from UTC) turns the UTC timestamps into local times
+        offset = int(forecast.get("timezone_offset", -6 * 3600))
+        timestamps = np.array([hourly_dict["dt"] for hourly_dict in hourly], dtype=np.int64) + offset
+        fx_dataframe = pd.DataFrame({"dateTime": pd.to_datetime(timestamps, unit="s")})
+        fx_dataframe["temps"] = np.array([hourly_dict["temp"] for hourly_dict in hourly], dtype=float).round(1)
+        fx_dataframe["weather"] = [hourly_dict["weather"][0]["description"] for hourly_dict in hourly]
+        for column, key in HOURLY_FIELDS.items():
+            fx_dataframe[column] = np.array([hourly_dict.get(key, np.nan) for hourly_dict in hourly], dtype=float)
+        fx_dataframe["hour"] = fx_dataframe["dateTime"].dt.hour
         print("Unpacking weather data was successful")
-        # print(fx_dataframe.head(n=12))
         return fx_dataframe
     else:
         print("Unpacking weather fx unsuccessful, returning 'None'")
         return None
 
 
-def get_hourly_fx(lat=LOWER_EAGLE_COORDS[0], lon=LOWER_EAGLE_COORDS[1]):
-
-    '''
-    Get an hourly weather forecast from Open Weather using lat/lon pairs.
-    Return the forecast as a dataframe.
-    '''
-
-    print("Collecting hourly forecast for zone")
-    try:
-        fx = get_ow_fx(lat=lat, lon=lon, api_key=OW_API_KEY)
-        weather_fx_df = unpack_fx_data(fx)
-        # print(weather_fx_df.head())
-        return weather_fx_df
-    except:
-        print("Unsuccessful weather forecast call")
-        raise
-
-# Testing...
-# air_data = get_hourly_fx()
-# print(air_data.head(n=12))
-#
-# print(air_data["temps"][air_data["dateTime"].dt.hour.isin([0,12])])
-# print(air_data["temps"][(air_data["dateTime"].dt.hour == 0)])
-
-#
-# print(air_data[(air_data["dateTime"].dt.hour == 26)])
-# print(noon_temp)
-# print(air_data)
+def unpack_daily_fx(forecast):
+    """
+    Unpack the daily block of the json object returned from Openweather API (today plus up to 7 days)
+    and return each day's local date, forecast high air temperature, and weather description
+    as a dataframe.
+    """
+    print("Unpacking daily forecast data")
+    if forecast is not None and len(forecast.get("daily", [])) > 0:
+        # the response's timezone offset (seconds from UTC) turns each day's UTC timestamp into a local date
+        offset = int(forecast.get("timezone_offset", -6 * 3600))
+        daily = forecast["daily"]
+        fx_dataframe = pd.DataFrame({
+            "date": [dt.utcfromtimestamp(int(daily_dict["dt"]) + offset).date() for daily_dict in daily],
+            "temp_max": [round(daily_dict["temp"]["max"], 1) for daily_dict in daily],
+            "weather": [daily_dict["weather"][0]["description"] for daily_dict in daily],
+        })
+        print("Unpacking daily weather data was successful")
+        return fx_dataframe
+    else:
+        print("Unpacking daily weather fx unsuccessful, returning 'None'")
+        return None
@@ -0,0 +1,143 @@
+"""
+File-backed cache for upstream webservice responses (USGS IV, USGS statistics, Openweathermap).
+The scheduler starts a fresh program run every hour, so responses are kept in a small SQLite
+database between runs. Each source has its own time-to-live; once an entry is stale it is
+revalidated with ETag/Last-Modified headers when the server provided them, otherwise re-fetched.
+The database is bounded in size by evicting the least recently used responses.
+"""
+
+###############################################################################
+# REQUIREMENTS
+###############################################################################
+
+import os
+import sqlite3
+import zlib
+import hashlib
+import time
+
+import http_session
+
+###############################################################################
+# CONFIG
+###############################################################################
+
+CACHE_DB = "./local_data/http_cache.sqlite"
+
+# Maximum total size of the (compressed) response bodies held in the cache
+MAX_CACHE_BYTES = 50 * 1024 * 1024
+
+# Time-to-live in seconds for each upstream source
+SOURCE_TTLS = {
+    'usgs_iv': 10 * 60,  # gauges report every 15 minutes
+    'usgs_stats': 7 * 24 * 60 * 60,  # period of record statistics change about once a year
+    'openweather': 30 * 60,  # forecast model runs update a few times a day
+}
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+
+
+def _connect():
+    """
+    Open the cache database, creating the folder and table on first use.
+    """
+    os.makedirs(os.path.dirname(CACHE_DB), exist_ok=True)
+    conn = sqlite3.connect(CACHE_DB, timeout=30)
+    conn.execute("CREATE TABLE IF NOT EXISTS responses ("
+                 "key TEXT PRIMARY KEY, source TEXT, body BLOB, size INTEGER, "
+                 "etag TEXT, last_modified TEXT, fetched_at REAL, accessed_at REAL)")
+    return conn
+
+
+def make_key(url):
+    """
+    Hash the request url into a cache key (urls can contain api keys, which shouldn't be written to disk).
+    """
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+def lookup(key, source):
+    """
+    Return a tuple of (body, is_fresh, etag, last_modified) for a cached response,
+    or None if nothing is cached for the key.
+    """
+    with _connect() as conn:
+        row = conn.execute("SELECT body, fetched_at, etag, last_modified FROM responses WHERE key = ?",
+                           (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+    body, fetched_at, etag, last_modified = row
+    is_fresh = (time.time() - fetched_at) < SOURCE_TTLS[source]
+    return zlib.decompress(body).decode('utf-8'), is_fresh, etag, last_modified
+
+
+def store(key, source, body, etag=None, last_modified=None):
+    """
+    Compress and write a response body to the cache, then evict old entries if the cache is over its size limit.
+    """
+    blob = zlib.compress(body.encode('utf-8'))
+    now = time.time()
+    with _connect() as conn:
+        conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     (key, source, blob, len(blob), etag, last_modified, now, now))
+        evict(conn)
+
+
+def touch(key):
+    """
+    Mark a cached response as freshly fetched (after the server confirms it has not changed).
+    """
+    now = time.time()
+    with _connect() as conn:
+        conn.execute("UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE key = ?", (now, now, key))
+
+
+def evict(conn, max_bytes=MAX_CACHE_BYTES):
+    """
+    Delete the least recently used responses until the cache fits in max_bytes.
+    """
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    if total <= max_bytes:
+        return
+    rows = conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+    for key, size in rows:
+        if total <= max_bytes:
+            break
+        conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+        total -= size
+    print(f"HTTP cache evicted entries, size is now {total} bytes")
+
+
+def cached_get(url, source, timeout=30):
+    """
+    Return the body of a GET request as text, using the cache when possible:
+    fresh entries are returned without a network call, stale entries are revalidated
+    with If-None-Match/If-Modified-Since if the server supplied validators, and
+    anything else is fetched and stored. Request errors are raised to the caller.
+    """
+    key = make_key(url)
+    cached = lookup(key, source)
+    if cached is not None and cached[1]:
+        print(f"Serving {source} response from the local cache")
+        return cached[0]
+
+    headers = {}
+    if cached is not None:
+        if cached[2]:
+            headers['If-None-Match'] = cached[2]
+        if cached[3]:
+            headers['If-Modified-Since'] = cached[3]
+
+    response = http_session.get(url, headers=headers, timeout=timeout)
+    if response.status_code == 304 and cached is not None:
+        print(f"Cached {source} response is unchanged on the server")
+        touch(key)
+        return cached[0]
+    response.raise_for_status()
+
+    store(key, source, response.text,
+          etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'))
+    return response.text
@@ -0,0 +1,152 @@
+"""
+Shared HTTP transport for the upstream webservice calls (USGS, Openweathermap).
+A single requests Session keeps connections alive between calls, asks for compressed
+responses, limits the number of connections held open per host, and retries transient
+failures (connection errors, 429/5xx responses) with exponential backoff and jitter.
+Request, connection, and byte counts are kept for the program run.
+"""
+
+###############################################################################
+# REQUIREMENTS
+###############################################################################
+
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+###############################################################################
+# CONFIG
+###############################################################################
+
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 1  # seconds, doubled on each retry
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_CONNECTIONS_PER_HOST = 4
+MAX_HOST_POOLS = 10
+
+# Totals for the program run
+transport_stats = {'requests': 0, 'connections': 0, 'wire_bytes': 0, 'content_bytes': 0}
+_stats_lock = threading.Lock()  # requests may be made from the fetch stage's worker threads
+
+###############################################################################
+# SESSION
+###############################################################################
+
+
+class JitteredRetry(Retry):
+    """
+    urllib3 Retry policy that spreads each exponential backoff sleep randomly between
+    zero and the full backoff time, so simultaneous failures don't retry in lockstep.
+    """
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff)
+
+
+class CountingHTTPConnection(HTTPConnection):
+    """
+    HTTP connection that counts every time it (re)connects to the server.
+    """
+
+    def connect(self):
+        with _stats_lock:
+            transport_stats['connections'] += 1
+        super().connect()
+
+
+class CountingHTTPSConnection(HTTPSConnection):
+    """
+    HTTPS connection that counts every time it (re)connects to the server, i.e. every TLS handshake.
+    """
+
+    def connect(self):
+        with _stats_lock:
+            transport_stats['connections'] += 1
+        super().connect()
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = CountingHTTPConnection
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CountingHTTPSConnection
+
+
+class CountingAdapter(HTTPAdapter):
+    """
+    requests transport adapter whose connection pools count the connections they open.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+
+def _build_session():
+    """
+    Create the shared session with connection pooling, compression, and the retry policy mounted for http and https.
+    """
+    retries = JitteredRetry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=["GET"],
+        raise_on_status=False,  # hand the final response back so raise_for_status() reports it
+    )
+    adapter = CountingAdapter(pool_connections=MAX_HOST_POOLS, pool_maxsize=MAX_CONNECTIONS_PER_HOST,
+                          pool_block=True, max_retries=retries)
+    new_session = requests.Session()
+    new_session.mount("https://", adapter)
+    new_session.mount("http://", adapter)
+    new_session.headers.update({"Accept-Encoding": "gzip, deflate"})
+    return new_session
+
+
+session = _build_session()
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+
+
+def get(url, **kwargs):
+    """
+    Make a GET request on the shared session and record its transfer size.
+    Accepts the same keyword arguments as requests.get and returns the response.
+    """
+    response = session.get(url, **kwargs)
+    with _stats_lock:
+        transport_stats['requests'] += 1
+    if not kwargs.get('stream', False):
+        record_transfer(response)
+    return response
+
+
+def record_transfer(response, content_size=None):
+    """
+    Add the bytes read off the wire (compressed) and the decoded content size of a fully read response to the run totals.
+    Streamed responses have already been consumed, so their decoded size is passed in by the caller.
+    """
+    if content_size is None:
+        content_size = len(response.content)
+    with _stats_lock:
+        transport_stats['wire_bytes'] += response.raw.tell()
+        transport_stats['content_bytes'] += content_size
+
+
+def report_transport():
+    """
+    Print the request, connection, and transfer totals for the program run.
+    """
+    print(f"HTTP transport: {transport_stats['requests']} requests over {transport_stats['connections']} connections, "
+          f"{transport_stats['wire_bytes']} bytes transferred "
+          f"({transport_stats['content_bytes']} bytes decompressed).")
@@ -0,0 +1,322 @@
+"""
+Local SQLite store of USGS gauge observations. Each program run appends the newly reported
+instantaneous values for each site and parameter, so later runs only need to ask USGS for the
+values reported since the last stored observation (the site's 'high-water mark') and can rebuild
+the rest of the window from disk. The store also keeps each site's day-of-year flow percentile
+table, which only changes about once a year, and a log of each run's derived conditions (site
+conditions, zone forecasts, and the weather forecasts they were made from) for end-of-season
+analytics and replays. All tables are indexed by site (or zone) and time for quick range reads.
+"""
+
+###############################################################################
+# REQUIREMENTS
+###############################################################################
+
+import os
+import json
+import sqlite3
+import time
+import zlib
+from datetime import datetime as dt
+import pandas as pd
+
+###############################################################################
+# CONFIG
+###############################################################################
+
+STORE_DB = "./local_data/observations.sqlite"
+
+# Days of instantaneous values kept in the store. Covers this season and the two before it for
+# backtests and model retraining; older observations are dropped as new ones come in.
+IV_RETENTION_DAYS = 3 * 365
+
+# Days of run logs (daily conditions, zone forecasts, weather forecasts) kept, matching the observations
+# so past seasons can still be replayed
+LOG_RETENTION_DAYS = IV_RETENTION_DAYS
+
+# Flow percentiles kept for each site and day of year
+PERCENTILES = ('p10', 'p25', 'p50', 'p75', 'p90')
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+
+
+def _connect():
+    """
+    Open the observation store, creating the folder and tables on first use.
+    """
+    os.makedirs(os.path.dirname(STORE_DB), exist_ok=True)
+    conn = sqlite3.connect(STORE_DB, timeout=30)
+    conn.execute("CREATE TABLE IF NOT EXISTS iv_observations ("
+                 "site TEXT, param TEXT, epoch INTEGER, date_time TEXT, value REAL, qualifiers TEXT, "
+                 "PRIMARY KEY (site, param, epoch))")
+    conn.execute("CREATE TABLE IF NOT EXISTS iv_backfills ("
+                 "site TEXT, param TEXT, start_epoch INTEGER, end_epoch INTEGER, fetched_at REAL)")
+    conn.execute(f"CREATE TABLE IF NOT EXISTS flow_percentiles ("
+                 f"site TEXT, month INTEGER, day INTEGER, {', '.join(f'{p} REAL' for p in PERCENTILES)}, "
+                 f"fetched_at REAL, PRIMARY KEY (site, month, day))")
+    conn.execute("CREATE TABLE IF NOT EXISTS daily_conditions ("
+                 "run_time INTEGER, run_date TEXT, site TEXT, max_temp REAL, mean_flow REAL, "
+                 "percent_of_median REAL, t_risk TEXT, q_rating TEXT)")
+    conn.execute("CREATE INDEX IF NOT EXISTS daily_conditions_site_time ON daily_conditions (site, run_time)")
+    conn.execute("CREATE TABLE IF NOT EXISTS zone_forecasts ("
+                 "run_time INTEGER, run_date TEXT, zone TEXT, ta_max REAL, tw_min REAL, q_mean REAL, doy INTEGER, "
+                 "current_temp REAL, max_temp REAL, pm_risk TEXT)")
+    conn.execute("CREATE INDEX IF NOT EXISTS zone_forecasts_zone_time ON zone_forecasts (zone, run_time)")
+    conn.execute("CREATE TABLE IF NOT EXISTS weather_forecasts ("
+                 "run_time INTEGER, run_date TEXT, zone TEXT, forecast BLOB, PRIMARY KEY (zone, run_date))")
+    conn.execute("CREATE INDEX IF NOT EXISTS weather_forecasts_zone_time ON weather_forecasts (zone, run_time)")
+    return conn
+
+
+def to_epoch(date_time):
+    """
+    Convert a USGS timestamp string (e.g. '2022-06-25T08:15:00.000-06:00') to integer seconds since 1970 UTC.
+    """
+    return int(dt.strptime(date_time, '%Y-%m-%dT%H:%M:%S.%f%z').timestamp())
+
+
+def get_high_water_mark(site, param):
+    """
+    Return the time (epoch seconds) of the most recent stored observation for a site and parameter,
+    or None if nothing has been stored yet.
+    """
+    with _connect() as conn:
+        row = conn.execute("SELECT MAX(epoch) FROM iv_observations WHERE site = ? AND param = ?",
+                           (site, param)).fetchone()
+    return row[0]
+
+
+def append_observations(site, param, observations):
+    """
+    Add a list of USGS value dictionaries ({'value', 'qualifiers', 'dateTime'}) to the store.
+    Observations already stored (same site, parameter, and time) are ignored.
+    """
+    rows = [(site, param, to_epoch(obs["dateTime"]), obs["dateTime"], float(obs["value"]),
+             json.dumps(obs.get("qualifiers", []))) for obs in observations]
+    with _connect() as conn:
+        conn.executemany("INSERT OR IGNORE INTO iv_observations VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+
+def append_series_frame(frame):
+    """
+    Add the observations in a tidy series dataframe (site, param, dateTime, value, qualifiers columns,
+    see usgs_calls.extract_series_frame) to the store. Observations already stored are ignored.
+    """
+    epochs = (frame["dateTime"] - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)
+    rows = [(site, param, int(epoch), date_time.isoformat(timespec='milliseconds'), float(value),
+             json.dumps(qualifiers.split(",") if qualifiers else []))
+            for site, param, epoch, date_time, value, qualifiers
+            in zip(frame["site"], frame["param"], epochs, frame["dateTime"], frame["value"], frame["qualifiers"])]
+    with _connect() as conn:
+        conn.executemany("INSERT OR IGNORE INTO iv_observations VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+
+def record_backfill(sites, params, start_epoch, end_epoch):
+    """
+    Record that the observations for each site and parameter between two times have been backfilled.
+    """
+    with _connect() as conn:
+        conn.executemany("INSERT INTO iv_backfills VALUES (?, ?, ?, ?, ?)",
+                         [(site, param, start_epoch, end_epoch, time.time()) for site in sites for param in params])
+
+
+def is_backfilled(sites, params, start_epoch, end_epoch):
+    """
+    Return True if every site and parameter has a recorded backfill covering the window between two times.
+    """
+    with _connect() as conn:
+        for site in sites:
+            for param in params:
+                row = conn.execute("SELECT 1 FROM iv_backfills WHERE site = ? AND param = ? "
+                                   "AND start_epoch <= ? AND end_epoch >= ? LIMIT 1",
+                                   (site, param, start_epoch, end_epoch)).fetchone()
+                if row is None:
+                    return False
+    return True
+
+
+def prune_observations(sites, params, retention_days=IV_RETENTION_DAYS):
+    """
+    Delete the stored observations older than the retention period for each site and parameter,
+    along with the records of backfills that reach back past it.
+    """
+    cutoff = int(time.time()) - retention_days * 24 * 60 * 60
+    pairs = [(site, param, cutoff) for site in sites for param in params]
+    with _connect() as conn:
+        conn.executemany("DELETE FROM iv_observations WHERE site = ? AND param = ? AND epoch < ?", pairs)
+        conn.executemany("DELETE FROM iv_backfills WHERE site = ? AND param = ? AND start_epoch < ?", pairs)
+
+
+def read_observations(site, param, start_epoch, end_epoch=None):
+    """
+    Return the stored observations for a site and parameter since start_epoch (and up to end_epoch
+    if given), oldest first, as USGS value dictionaries ({'value', 'qualifiers', 'dateTime'}).
+    """
+    end_epoch = 2 ** 62 if end_epoch is None else end_epoch
+    with _connect() as conn:
+        rows = conn.execute("SELECT value, qualifiers, date_time FROM iv_observations "
+                            "WHERE site = ? AND param = ? AND epoch >= ? AND epoch <= ? ORDER BY epoch",
+                            (site, param, start_epoch, end_epoch)).fetchall()
+    return [{"value": str(value), "qualifiers": json.loads(qualifiers), "dateTime": date_time}
+            for value, qualifiers, date_time in rows]
+
+
+def read_iv(site, param, start=None, end=None):
+    """
+    Return the stored observations for a site and parameter between two datetimes (either may be
+    None for an open range) as a dataframe with 'dateTime' (UTC) and 'value' columns, oldest first.
+    """
+    start_epoch = -2 ** 62 if start is None else int(start.timestamp())
+    end_epoch = 2 ** 62 if end is None else int(end.timestamp())
+    with _connect() as conn:
+        data = pd.read_sql_query("SELECT epoch, value FROM iv_observations "
+                                 "WHERE site = ? AND param = ? AND epoch >= ? AND epoch <= ? ORDER BY epoch",
+                                 conn, params=(site, param, start_epoch, end_epoch))
+    data.insert(0, "dateTime", pd.to_datetime(data.pop("epoch"), unit="s", utc=True))
+    return data
+
+
+def get_percentile_fetch_times(sites):
+    """
+    Return a dictionary of the time (epoch seconds) each site's flow percentile table was stored.
+    Sites without a stored table are left out.
+    """
+    with _connect() as conn:
+        rows = conn.execute(f"SELECT site, MIN(fetched_at) FROM flow_percentiles "
+                            f"WHERE site IN ({', '.join('?' * len(sites))}) GROUP BY site", list(sites)).fetchall()
+    return dict(rows)
+
+
+def store_flow_percentiles(stats, fetched_at, sites=()):
+    """
+    Replace the stored flow percentile tables for the sites in a USGS daily statistics dataframe
+    (site_no, month_nu, day_nu and a '<percentile>_va' column for each of PERCENTILES, or None for no
+    rows). Requested sites (sites) without rows in it are stored as an empty table, a single row for
+    month 0, day 0 without percentiles, so their fetch time is kept until the next refresh.
+    """
+    rows = []
+    if stats is not None:
+        stats = stats.drop_duplicates(subset=["site_no", "month_nu", "day_nu"])
+        rows = [(row.site_no, int(row.month_nu), int(row.day_nu))
+                + tuple(float(getattr(row, f"{p}_va")) for p in PERCENTILES) + (fetched_at,)
+                for row in stats.itertuples()]
+    stored_sites = {row[0] for row in rows}
+    rows.extend((site, 0, 0) + (None,) * len(PERCENTILES) + (fetched_at,) for site in sites if site not in stored_sites)
+    with _connect() as conn:
+        conn.executemany("DELETE FROM flow_percentiles WHERE site = ?", [(site,) for site in {row[0] for row in rows}])
+        conn.executemany(f"INSERT INTO flow_percentiles VALUES ({', '.join('?' * (len(PERCENTILES) + 4))})", rows)
+
+
+def read_flow_percentiles(sites):
+    """
+    Return the stored flow percentile rows for a list of sites as tuples of
+    (site, month, day, p10, p25, p50, p75, p90), leaving out the empty table markers.
+    """
+    with _connect() as conn:
+        return conn.execute(f"SELECT site, month, day, {', '.join(PERCENTILES)} FROM flow_percentiles "
+                            f"WHERE site IN ({', '.join('?' * len(sites))}) AND month > 0", list(sites)).fetchall()
+
+
+def _as_number(value):
+    """
+    Return a value as a float for storage, or None for missing values (NaN or None).
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if value != value else value
+
+
+def append_daily_conditions(site_data_list, run_time=None):
+    """
+    Append one row per site (SiteConditions records) of this run's conditions (yesterday's max temp,
+    mean flow, percent of median flow, and the temperature and flow ratings) to the daily conditions log.
+    """
+    run_time = int(time.time()) if run_time is None else int(run_time)
+    run_date = dt.fromtimestamp(run_time).strftime('%Y-%m-%d')
+    rows = [(run_time, run_date, site_info.site, _as_number(site_info.yesterday_max_t),
+             _as_number(site_info.yesterday_mean_q), _as_number(site_info.percent_of_median),
+             site_info.t_risk, site_info.q_rating)
+            for site_info in site_data_list]
+    with _connect() as conn:
+        conn.executemany("INSERT INTO daily_conditions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def append_zone_forecasts(zone_forecasts, run_time=None):
+    """
+    Append one row per forecast zone of this run's model inputs and predicted high water temperature
+    to the zone forecast log.
+    """
+    run_time = int(time.time()) if run_time is None else int(run_time)
+    run_date = dt.fromtimestamp(run_time).strftime('%Y-%m-%d')
+    rows = [(run_time, run_date, zone_info['zone'], _as_number(zone_info.get('ta_max')),
+             _as_number(zone_info.get('tw_min')), _as_number(zone_info.get('q_mean')), zone_info.get('doy'),
+             _as_number(zone_info.get('current_temp')), _as_number(zone_info.get('max_temp')),
+             zone_info.get('pm_risk'))
+            for zone_info in zone_forecasts]
+    with _connect() as conn:
+        conn.executemany("INSERT INTO zone_forecasts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def append_weather_forecasts(zone_weather, run_time=None):
+    """
+    Log the Openweathermap forecast (the json response as a dictionary) each zone's forecast was made
+    from, given as a dictionary of {zone: forecast}, so the day's forecast can be replayed later (see
+    backtest.py). Forecasts are stored compressed, and only the first run of each day is kept for a zone.
+    """
+    run_time = int(time.time()) if run_time is None else int(run_time)
+    run_date = dt.fromtimestamp(run_time).strftime('%Y-%m-%d')
+    rows = [(run_time, run_date, zone, zlib.compress(json.dumps(forecast).encode()))
+            for zone, forecast in zone_weather.items()]
+    with _connect() as conn:
+        conn.executemany("INSERT OR IGNORE INTO weather_forecasts VALUES (?, ?, ?, ?)", rows)
+
+
+def prune_logs(retention_days=LOG_RETENTION_DAYS):
+    """
+    Delete the run log rows (daily conditions, zone forecasts, weather forecasts) older than the retention period.
+    """
+    cutoff = int(time.time()) - retention_days * 24 * 60 * 60
+    with _connect() as conn:
+        for table in ("daily_conditions", "zone_forecasts", "weather_forecasts"):
+            conn.execute(f"DELETE FROM {table} WHERE run_time < ?", (cutoff,))
+
+
+def _read_log(table, key_column, key, start, end):
+    """
+    Read rows from one of the run logs, optionally filtered to one site/zone and a datetime range.
+    """
+    query = f"SELECT * FROM {table} WHERE run_time >= ? AND run_time <= ?"
+    params = [-2 ** 62 if start is None else int(start.timestamp()), 2 ** 62 if end is None else int(end.timestamp())]
+    if key is not None:
+        query += f" AND {key_column} = ?"
+        params.append(key)
+    with _connect() as conn:
+        return pd.read_sql_query(f"{query} ORDER BY run_time", conn, params=params)
+
+
+def read_daily_conditions(site=None, start=None, end=None):
+    """
+    Return the logged site conditions as a dataframe, optionally for one site and between two datetimes.
+    """
+    return _read_log("daily_conditions", "site", site, start, end)
+
+
+def read_zone_forecasts(zone=None, start=None, end=None):
+    """
+    Return the logged zone forecasts as a dataframe, optionally for one zone and between two datetimes.
+    """
+    return _read_log("zone_forecasts", "zone", zone, start, end)
+
+
+def read_weather_forecasts(zone=None, start=None, end=None):
+    """
+    Return the logged weather forecasts as a dataframe (forecast column holds the json response as a
+    dictionary), optionally for one zone and between two datetimes.
+    """
+    logged = _read_log("weather_forecasts", "zone", zone, start, end)
+    logged["forecast"] = [json.loads(zlib.decompress(forecast)) for forecast in logged["forecast"]]
+    return logged
@@ -20,19 +20,16 @@ issue alerts for area anglers.
 # REQUIREMENTS
 ###############################################################################
 
-# python system modules and packages
+# python system modules and packages. Only the light modules needed for the hour gate are imported
+# here; numpy, pandas, dotenv, and the program's local modules are imported by main() and by the
+# functions that use them, so invocations outside the alert hours exit without loading them.
 import os
 import sys
-import numpy as np
-from dotenv import load_dotenv
-from time import sleep
+import time
+import importlib
 from datetime import datetime
 
-# local modules
-import build_email
-import mail_chimp_functions as mc
-import usgs_calls
-import water_forecasts
+START_TIME = time.perf_counter()
 
 # Active during testing only, comment out otherwise
 # Note; may need re-enable 'Allow less secure apps' in Google account security if testing has not been used in awhile
@@ -45,14 +42,35 @@ import water_forecasts
 # TODO: How to hide environmental variables in Python Anywhere scripts, dotenv...
 # https://towardsdatascience.com/using-dotenv-to-hide-sensitive-information-in-python-77ab9dfdaac8
 
-load_dotenv()
-MC_API_KEY = os.getenv('MAILCHIMP_API_KEY')
-MC_SERVER_PREFIX = os.getenv('MAILCHIMP_SERVER_PREFIX')
-ERWC_LIST = os.getenv('MAILCHIMP_ERWC_LIST')
-ALERT_TAG = os.getenv('MAILCHIMP_ALERT_TAG')
-ALERT_SEGMENT_ID = os.getenv('MAILCHIMP_ALERT_SEGMENT_ID')
-ALERT_TEST_SEGMENT_ID = os.getenv('MAILCHIMP_ALERT_TEST_SEGMENT_ID')
-REPLY_TO_EMAIL = os.getenv('REPLY_TO_EMAIL')
+# Set IMPORT_TIME_REPORT=1 in the environment to print how long startup and each module import took
+IMPORT_TIME_REPORT = os.getenv('IMPORT_TIME_REPORT') == '1'
+
+# Modules imported (and timed) once the hour gate has passed, in the order they are loaded
+PROGRAM_MODULES = (
+    'numpy', 'pandas', 'dotenv', 'site_registry', 'http_session', 'http_cache', 'local_store', 'usgs_calls',
+    'hourly_weather', 'fetch_stage', 'risk_levels', 'site_conditions', 'gam_export', 'water_forecasts',
+    'build_email',
+)
+
+# Seconds spent importing each module, for the import time report
+import_times = {}
+
+
+def load_mailchimp_settings():
+
+    """Load the .env file and return the MailChimp account settings used to send the alerts"""
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    return {
+        'api_key': os.getenv('MAILCHIMP_API_KEY'),
+        'server_prefix': os.getenv('MAILCHIMP_SERVER_PREFIX'),
+        'erwc_list': os.getenv('MAILCHIMP_ERWC_LIST'),
+        'alert_tag': os.getenv('MAILCHIMP_ALERT_TAG'),
+        'alert_segment_id': os.getenv('MAILCHIMP_ALERT_SEGMENT_ID'),
+        'alert_test_segment_id': os.getenv('MAILCHIMP_ALERT_TEST_SEGMENT_ID'),
+        'reply_to_email': os.getenv('REPLY_TO_EMAIL'),
+    }
 
 
 ###############################################################################
@@ -63,132 +81,98 @@ REPLY_TO_EMAIL = os.getenv('REPLY_TO_EMAIL')
 def gather_site_data(sites):
 
     """ Aggregate the available flow and temp data for all the gauge sites.
-    Return a list containing a data dictionary for each of the sites"""
+    Return a list containing a SiteConditions record for each of the sites"""
+
+    import numpy as np
+    import usgs_calls
+    from site_conditions import SiteConditions
+
+    # Make a single call to the USGS webservice for the last 24 hours of instantaneous (15 min) flow and temp
+    # values at every site. If the combined call fails (e.g. one malformed site code), fall back to asking
+    # for each site on its own so one bad gauge doesn't drop the rest.
+    print(f"\nGathering data for sites {sites} ----------------->\n")
+    iv_data = usgs_calls.get_multi_site_data(sites, params=("00060", "00010"), period="P1D")
+    if iv_data is not None:
+        site_series = usgs_calls.split_timeseries(iv_data)
+        fetched_sites = sites
+    else:
+        site_series = {}
+        fetched_sites = []
+        for site in sites:
+            site_data = usgs_calls.get_multi_site_data([site], params=("00060", "00010"), period="P1D")
+            if site_data is not None:
+                site_series.update(usgs_calls.split_timeseries(site_data))
+                fetched_sites.append(site)
 
     site_data_list = []
-    for site in sites:
-        print(f"\nGathering data for site {site} ----------------->\n")
-        # Make calls to USGS webservice to get last 24 hours of instantaneous (15 min) values)
-        flow_data = usgs_calls.get_site_data(site, param="00060", period="P1D")
-        temp_data = usgs_calls.get_site_data(site, param="00010", period="P1D")
-
-        # If data is returned for both calls, unpack it and get yesterday's flow and max temp
-        if flow_data is None and temp_data is None:
-            continue
-        else:
-            # Get the mean flow from yesterday
-            if flow_data is not None:
-                timeseries = flow_data["value"]["timeSeries"]
-                if len(timeseries) > 0:
-                    flow_ts = usgs_calls.extract_hourly_data(timeseries)
-                    if flow_ts is not None:
-                        # print(flow_ts.head())
-                        mean_flow_yesterday = int(np.nanmean(flow_ts['q']))
-                    else:
-                        mean_flow_yesterday = np.nan
-                else:
-                    mean_flow_yesterday = np.nan
-            # Get the maximum water temperature from yesterday
-            if temp_data is not None:
-                timeseries = temp_data["value"]["timeSeries"]
-                if len(timeseries) > 0:
-                    temp_ts = usgs_calls.extract_hourly_data(timeseries)
-                    if temp_ts is not None:
-                        # print(temp_ts.head())
-                        max_temp_yesterday = int(np.nanmax(temp_ts['temp_c']) * (9/5) + 32)
-                    else:
-                        max_temp_yesterday = np.nan
-                else:
-                    max_temp_yesterday = np.nan
-            # Pack everything into a dictionary and append to the site data list
-            site_data = {'site': site, 'yesterday_mean_q': mean_flow_yesterday, 'yesterday_max_t': max_temp_yesterday}
-            print(f"Site data:\n{site_data}")
-            site_data_list.append(site_data)
+    for site in fetched_sites:
+        print(f"\nUnpacking data for site {site} ----------------->\n")
+        # Get the mean flow from yesterday
+        timeseries = site_series.get((site, "00060"), [])
+        mean_flow_yesterday = np.nan
+        if len(timeseries) > 0:
+            flow_ts = usgs_calls.extract_hourly_data(timeseries)
+            if flow_ts is not None:
+                flow_summary = usgs_calls.summarize_day(flow_ts)
+                if flow_summary['count'] > 0:
+                    mean_flow_yesterday = int(flow_summary['mean'])
+        # Get the maximum water temperature from yesterday
+        timeseries = site_series.get((site, "00010"), [])
+        max_temp_yesterday = np.nan
+        if len(timeseries) > 0:
+            temp_ts = usgs_calls.extract_hourly_data(timeseries)
+            if temp_ts is not None:
+                temp_summary = usgs_calls.summarize_day(temp_ts)
+                if temp_summary['count'] > 0:
+                    max_temp_yesterday = int(temp_summary['max'] * (9/5) + 32)
+        # Pack everything into a site conditions record and append to the site data list
+        site_data = SiteConditions(site, yesterday_mean_q=mean_flow_yesterday, yesterday_max_t=max_temp_yesterday)
+        print(f"Site data:\n{site_data}")
+        site_data_list.append(site_data)
     return site_data_list
 
 
 def assign_river_reach(site_data_list):
 
-    """Append the local nicknames for stream reaches associated with different temperature monitoring sites
-    to the site's information list"""
+    """Set the local nicknames for stream reaches associated with different temperature monitoring sites
+    on each site's record, from the site registry"""
+
+    import site_registry
 
     for site_info in site_data_list:
-        site_id = site_info['site']
-        if site_id == "09060799":
-            alias = 'Colorado River @ Catamount'
-        elif site_id == "09058000":
-            alias = 'Colorado River @ Gore Canyon'
-        elif site_id == "09070000":
-            alias = 'Lower Eagle River @ Gypsum'
-        elif site_id == "394220106431500":
-            alias = 'Middle Eagle River @ Red Canyon'
-        elif site_id == "09066510":
-            alias = 'Lower Gore Creek @ Mouth'
-        elif site_id == "09071750":
-            alias = 'Colorado River @ No Name'
-        elif site_id == "09070500":
-            alias = 'Colorado River @ Dotsero'
-        elif site_id == "09085000":
-            alias = 'Lower Roaring Fork River @ GWS'
-        elif site_id == "09064600":
-            alias = 'Upper Eagle River @ Minturn'
-        else:
-            alias = site_id  # just assign the gauge name if no reach nickname is found
-        site_info["alias"] = alias
-    # Function returns nothing, dictionaries are mutable and are updated in the global scope
+        site_info.alias = site_registry.get_alias(site_info.site)
+    # Function returns nothing, the records are mutable and are updated in the global scope
 
 
 def evaluate_temp_risk(site_data_list):
 
-    """ Using the max temperature, assign a narrative ordinal rating for fishing risk at the site. Append the
-     rating to that site's information dictionary"""
+    """ Using the max temperature, assign a narrative ordinal rating for fishing risk at the site. Set the
+     rating on that site's record (None if the gauge has no temperature data)"""
 
-    for site_info in site_data_list:
-        # if there is no data in this slot (gauge has discharge only), replace it with a blank string, skip to next site
-        if np.isnan(site_info['yesterday_max_t']):
-            site_info["t_risk"] = "<em>no rating</em>"
-            site_info['yesterday_max_t'] = '---'
-        else:
-            temp = float(site_info['yesterday_max_t'])
-            risk = '<em>no rating</em>'
-            if temp < 65:
-                risk = "LOW"
-            elif 65 <= temp < 71:
-                risk = "CONCERN"
-            elif temp >= 71:
-                risk = "HIGH"
-            print(f"Evaluating temperature for fishing risk level at {site_info['site']}, current temp is {temp}, "
-                  f"risk is {risk}.")
-            site_info["t_risk"] = risk
+    import risk_levels
+    from site_conditions import field_array
+
+    risks = risk_levels.classify_temperature(field_array(site_data_list, 'yesterday_max_t'))
+    for site_info, risk in zip(site_data_list, risks):
+        if risk is not None:
+            print(f"Evaluating temperature for fishing risk level at {site_info.site}, current temp is "
+                  f"{site_info.yesterday_max_t}, risk is {risk}.")
+        site_info.t_risk = risk
 
 
 def evaluate_flow_conditions(site_data_list):
     """ Using the Percent of Median Flow value, assign a narrative ordinal rating for fishing risk at the site.
-    Append the rating to that site's information dictionary.
+    Set the rating on that site's record (None if the gauge has no discharge or no median statistic).
     """
-    for site_info in site_data_list:
-        # if there is no data in this slot (gauge has discharge only), skip to next site
-        print(f"Perc of Med: {site_info['percent_of_median']}")
-        # if np.isnan(site_info['percent_of_median']):
-        if site_info['percent_of_median'] == '---':
-            site_info["q_rating"] = "---"
-            site_info['yesterday_mean_q'] = "---"
-        else:
-            q_percent = float(site_info['percent_of_median'])
-            q_rating = '<em>no rating</em>'
-            if q_percent < 50:
-                q_rating = "Low"
-            elif 50 <= q_percent < 80:
-                q_rating = "Below Normal"
-            elif 80 <= q_percent <= 120:
-                q_rating = "Normal"
-            elif 120 < q_percent <= 150:
-                q_rating = "Above Normal"
-            elif 150 < q_percent:
-                q_rating = "High"
-            print(f"Evaluating flow risk level at {site_info['site']}, percent of median flow is {q_percent}, "
-                  f"rating is {q_rating}.")
-            site_info["q_rating"] = q_rating
+    import risk_levels
+    from site_conditions import field_array
+
+    q_ratings = risk_levels.classify_flow(field_array(site_data_list, 'percent_of_median'))
+    for site_info, q_rating in zip(site_data_list, q_ratings):
+        if q_rating is not None:
+            print(f"Evaluating flow risk level at {site_info.site}, percent of median flow is "
+                  f"{site_info.percent_of_median}, rating is {q_rating}.")
+        site_info.q_rating = q_rating
 
 
 def add_risk_message(info_lists):
@@ -239,33 +223,72 @@ def check_time(alert_times):
         return False
 
 
-def log_daily_conditions(sites_data_list):
-    pass
+def log_daily_conditions(sites_data_list, zone_forecasts):
+
+    """Append today's site conditions and zone forecasts, and the weather forecasts the zone forecasts
+    were made from, to the local store for end-of-season analytics/tallies and for later runs (model
+    refits, backtests) to read from disk, then drop log rows past the store's retention period."""
+
+    import sqlite3
+    import hourly_weather
+    import local_store
+    import site_registry
+
+    # the weather forecasts are served from the http cache filled by the fetch stage
+    forecast_zones = {zone_info["zone"] for zone_info in zone_forecasts}
+    zone_weather = {}
+    for zone_info in site_registry.forecast_zones():
+        if zone_info["zone"] in forecast_zones:
+            forecast = hourly_weather.get_ow_fx(lat=zone_info["lat"], lon=zone_info["lon"])
+            if forecast is not None:
+                zone_weather[zone_info["zone"]] = forecast
+
+    try:
+        local_store.append_daily_conditions(sites_data_list)
+        local_store.append_zone_forecasts(zone_forecasts)
+        local_store.append_weather_forecasts(zone_weather)
+        local_store.prune_logs()
+        print(f"Logged conditions for {len(sites_data_list)} sites and {len(zone_forecasts)} zones.")
+    except sqlite3.Error as error:
+        print("Logging daily conditions was unsuccessful")
+        print(error)
+
+
+def timed_import(module_name):
+
+    """Import a module and record how long it took (including any of its own imports that weren't
+    already loaded) for the import time report. Returns the module."""
+
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    import_times.setdefault(module_name, time.perf_counter() - start)
+    return module
+
+
+def report_import_times(stage):
+
+    """Print the time since the program started and the time spent importing each module so far,
+    slowest first, when IMPORT_TIME_REPORT is set."""
+
+    if not IMPORT_TIME_REPORT:
+        return
+    print(f"Import time report ({stage}): {(time.perf_counter() - START_TIME) * 1000:.1f} ms since start, "
+          f"{sum(import_times.values()) * 1000:.1f} ms importing {len(import_times)} modules")
+    for module_name, seconds in sorted(import_times.items(), key=lambda item: item[1], reverse=True):
+        print(f"    {module_name:<25} {seconds * 1000:8.1f} ms")
 
 
 ##############################################################################
 # PROGRAM DATA
 ##############################################################################
 
-# Stream gauge sites that also have temperature relevant to Eagle County
-site_list = [
-    '09066510',  # Gore Creek at Mouth (below Vail)
-    '09064600',  # Eagle River near Minturn (NO TEMPERATURE DATA AVAILABLE, JUST HERE FOR API ERROR TESTING)
-    '394220106431500',  # Eagle River blw Milk Creek at Wolcott (Lower Eagle)
-    '09070000',  # Eagle River at Gypsum
-    '09058000',  # Colorado River at Kremmling (Gore Canyon)
-    '09060799',  # Colorado River at Catamount (Downstream of State Bridge)
-    '09070500',  # Colorado River at Dotsero (Below Eagle River confluence)
-    '09071750',  # Colorado River above Glenwood Springs (No Name exit)
-    '09085000',  # Roaring Fork River in Glenwood Springs (Lower Roaring Fork... applicable to Emma/El Jebel/Basalt?)
-    # '123xyzas',  # Bad site name FOR API ERROR TESTING
-    # '',  # Empty site name FOR API ERROR TESTING
-]
+# Stream gauge sites relevant to Eagle County and the forecast zones are listed in the site registry
+# (./program_files/site_registry.json), add or remove gauges there.
 
 # Set the hours that alerts will go out here, using a string format 'HH' (single digits preceded by '0')
 
 #testing
-notification_hours = ['00','01','07','06','08', '09','10','11','12','13','14', '15', '16','17','18','19', '20','21' '22', '23']
+notification_hours = ['00','01','07','06','08', '09','10','11','12','13','14', '15', '16','17','18','19', '20','21', '22', '23']
 
 # deployment
 # notification_hours = ['08']
@@ -275,139 +298,182 @@ notification_hours = ['00','01','07','06','08', '09','10','11','12','13','14', '
 # MAIN PROGRAM
 ##############################################################################
 
-# PythonAnywhere.com runs this script every hour but will only send emails at specified AM and PM times
-# if not check_time(notification_hours):
-#     sys.exit()
-
-# call the USGS api for each site and get current temperature and some site metadata
-print("Assessing yesterday afternoon's conditions.")
-sites_data = gather_site_data(site_list)
-
-# If the site_data object was successfully created, analyze it and send the email alerts
-if (sites_data is not None) and (len(sites_data) > 0):
-    assign_river_reach(sites_data)  # (dictionaries are mutable, so the function does not need to return anything)
-    evaluate_temp_risk(sites_data)
-    usgs_calls.calc_historical_flow_stat(sites_data)
-    evaluate_flow_conditions(sites_data)
-
-    ## TODO: write each day's condition to an ongoing .csv or database table to allow for end-of-season analytics/tallies
-    ##log daily conditions(sites_data)
-
-    print("Building zone forecasts.")
-    zone_forecasts = water_forecasts.forecast_stream_temperature()
-    print(f"\n{zone_forecasts}\n")
-
-    # create the Yesterdays Conditions table for the email alert
-    conditions_html = build_email.build_yesterday_conditions_table(sites_data)
-    if not conditions_html:
-        conditions_html = "<div><em>Yesterday's conditions report not available.</em></div>"
-
-    # create the Today's Forecast table for the email alert
-    forecast_html = build_email.build_forecast_table(zone_forecasts)
-    if not forecast_html:
-        forecast_html = "<div><hr><em>The water temp forecast application is experiencing temporary errors, no stream temperature forecast currently available for today.</em></div>"
-
-    # Build the combined html email content
-    html_content = build_email.build_html_email_message(conditions_html, forecast_html)
-
-    # Create the fallback plain text email (need to revamp these functions)
-    text_content = "Text email testing placeholder"
-
-    print("\nInitiating MailChimp API calls to build campaign and send new alert email.\n")
-
-    ### DEPLOYMENT MAILCHIMP FUNCTIONS
-    # Activate MailChimp code during deployment, deactivate during testing:
-    # # Send email via MailChimp by creating a Campaign, populating an email, then sending it.
-    # current_campaign_id = mc.create_new_daily_campaign(
-    #     api_key=MC_API_KEY,
-    #     server_prefix=MC_SERVER_PREFIX,
-    #     audience_list=ERWC_LIST,
-    #     segment_id=int(ALERT_SEGMENT_ID),
-    #     reply_to=REPLY_TO_EMAIL
-    # )
-    #
-    # if current_campaign_id is not None:
-    #
-    #     mc.upload_email_contents(
-    #         api_key=MC_API_KEY,
-    #         server_prefix=MC_SERVER_PREFIX,
-    #         campaign_id_str=current_campaign_id,
-    #         html_msg=html_content,
-    #         text_msg=text_content
-    #     )
-    #
-    #     mc.send_email_campaign(
-    #         api_key=MC_API_KEY,
-    #         server_prefix=MC_SERVER_PREFIX,
-    #         campaign_id_str=current_campaign_id
-    #     )
-    #
-    #     # campaign sending may take several seconds, pause execution until sending is finished, otherwise
-    #     # the delete function call may return an error.
-    #     sleep(10)
-    #
-    #     mc.delete_campaign(
-    #         api_key=MC_API_KEY,
-    #         server_prefix=MC_SERVER_PREFIX,
-    #         campaign_id_str=current_campaign_id
-    #     )
-    #
-    # else:
-    #     print('Email Campaign was not successfully created, stopping program.')
-
-    ## TESTING MAILCHIMP FUNCTIONS
-    # Activate MailChimp code during TESTING, deactivate during deployment; will
-    # only send to the segment of email addresses tagged for 'Bills Test Emails':
-    # Send email via MailChimp by creating a Campaign, populating an email, then sending it.
-    current_campaign_id = mc.create_new_daily_campaign(
-        api_key=MC_API_KEY,
-        server_prefix=MC_SERVER_PREFIX,
-        audience_list=ERWC_LIST,
-        segment_id=int(ALERT_TEST_SEGMENT_ID),
-        reply_to=REPLY_TO_EMAIL
-    )
-
-    if current_campaign_id is not None:
-
-        mc.upload_email_contents(
-            api_key=MC_API_KEY,
-            server_prefix=MC_SERVER_PREFIX,
-            campaign_id_str=current_campaign_id,
-            html_msg=html_content,
-            text_msg=text_content
-        )
 
-        mc.send_email_campaign(
-            api_key=MC_API_KEY,
-            server_prefix=MC_SERVER_PREFIX,
-            campaign_id_str=current_campaign_id
+def main():
+
+    """Run the alert program: check the hour, gather yesterday's conditions and today's forecasts,
+    and send the alert email."""
+
+    # PythonAnywhere.com runs this script every hour but will only send emails at specified AM and PM times.
+    # Decide this before any of the heavy modules are imported so off-hour runs exit right away.
+    if not check_time(notification_hours):
+        report_import_times("off-hour exit")
+        sys.exit()
+
+    # import the program's modules now that there is work to do
+    for module_name in PROGRAM_MODULES:
+        timed_import(module_name)
+    report_import_times("after imports")
+    import fetch_stage
+    import http_session
+    import site_registry
+    import usgs_calls
+    import water_forecasts
+    import build_email
+    mc_settings = load_mailchimp_settings()
+    site_list = site_registry.conditions_sites()
+
+    # start the run with an empty USGS run cache, in case the module was kept loaded from an earlier run
+    usgs_calls.clear_run_cache()
+
+    # start loading the forecast models in the background while the web requests are made
+    water_forecasts.preload_models()
+
+    # send every USGS and weather request the run needs at once, the processing below reads the cached results
+    print("Fetching gauge, statistics, and weather data.")
+    fetch_stage.prefetch(site_list, site_registry.forecast_zones())
+
+    # call the USGS api for each site and get current temperature and some site metadata
+    print("Assessing yesterday afternoon's conditions.")
+    sites_data = gather_site_data(site_list)
+
+    # If the site_data object was successfully created, analyze it and send the email alerts
+    if (sites_data is not None) and (len(sites_data) > 0):
+        assign_river_reach(sites_data)  # (records are mutable, so the function does not need to return anything)
+        evaluate_temp_risk(sites_data)
+        usgs_calls.calc_historical_flow_stat(sites_data)
+        evaluate_flow_conditions(sites_data)
+
+        print("Building zone forecasts.")
+        zone_forecasts = water_forecasts.forecast_stream_temperature()
+        print(f"\n{zone_forecasts}\n")
+
+        # write each day's conditions to the local store to allow for end-of-season analytics/tallies
+        log_daily_conditions(sites_data, zone_forecasts)
+
+        # create the Yesterdays Conditions table for the email alert
+        conditions_html = build_email.build_yesterday_conditions_table(sites_data)
+        if not conditions_html:
+            conditions_html = "<div><em>Yesterday's conditions report not available.</em></div>"
+
+        # create the Today's Forecast table for the email alert
+        forecast_html = build_email.build_forecast_table(zone_forecasts)
+        if not forecast_html:
+            forecast_html = "<div><hr><em>The water temp forecast application is experiencing temporary errors, no stream temperature forecast currently available for today.</em></div>"
+
+        # create the multi-day outlook table for the email alert
+        outlook_html = build_email.build_outlook_table(zone_forecasts) or ""
+
+        # Build the combined html email content
+        html_content = build_email.build_html_email_message(conditions_html, forecast_html, outlook_html)
+
+        # Create the fallback plain text email (need to revamp these functions)
+        text_content = "Text email testing placeholder"
+
+        print("\nInitiating MailChimp API calls to build campaign and send new alert email.\n")
+        mc = timed_import('mail_chimp_functions')
+
+        ### DEPLOYMENT MAILCHIMP FUNCTIONS
+        # Activate MailChimp code during deployment, deactivate during testing:
+        # # Send email via MailChimp by creating a Campaign, populating an email, then sending it.
+        # current_campaign_id = mc.create_new_daily_campaign(
+        #     api_key=mc_settings['api_key'],
+        #     server_prefix=mc_settings['server_prefix'],
+        #     audience_list=mc_settings['erwc_list'],
+        #     segment_id=int(mc_settings['alert_segment_id']),
+        #     reply_to=mc_settings['reply_to_email']
+        # )
+        #
+        # if current_campaign_id is not None:
+        #
+        #     mc.upload_email_contents(
+        #         api_key=mc_settings['api_key'],
+        #         server_prefix=mc_settings['server_prefix'],
+        #         campaign_id_str=current_campaign_id,
+        #         html_msg=html_content,
+        #         text_msg=text_content
+        #     )
+        #
+        #     mc.send_email_campaign(
+        #         api_key=mc_settings['api_key'],
+        #         server_prefix=mc_settings['server_prefix'],
+        #         campaign_id_str=current_campaign_id
+        #     )
+        #
+        #     # campaign sending may take several seconds, pause execution until sending is finished, otherwise
+        #     # the delete function call may return an error.
+        #     time.sleep(10)
+        #
+        #     mc.delete_campaign(
+        #         api_key=mc_settings['api_key'],
+        #         server_prefix=mc_settings['server_prefix'],
+        #         campaign_id_str=current_campaign_id
+        #     )
+        #
+        # else:
+        #     print('Email Campaign was not successfully created, stopping program.')
+
+        ## TESTING MAILCHIMP FUNCTIONS
+        # Activate MailChimp code during TESTING, deactivate during deployment; will
+        # only send to the segment of email addresses tagged for 'Bills Test Emails':
+        # Send email via MailChimp by creating a Campaign, populating an email, then sending it.
+        current_campaign_id = mc.create_new_daily_campaign(
+            api_key=mc_settings['api_key'],
+            server_prefix=mc_settings['server_prefix'],
+            audience_list=mc_settings['erwc_list'],
+            segment_id=int(mc_settings['alert_test_segment_id']),
+            reply_to=mc_settings['reply_to_email']
         )
 
-        # Campaign sending may take several seconds, pause execution until sending is finished, if it is
-        # unfinished before the delete command is sent, the delete function call may return an error.
-        # if it does, its non-fatal, you'll just end up with extra campaigns filling up
-        sleep(30)
-
-        # Delete the campaign once it is sent, daily campaign frequencies will quickly fill the MC history
-        # on the organization's website user interface for Campaigns
-        mc.delete_campaign(
-            api_key=MC_API_KEY,
-            server_prefix=MC_SERVER_PREFIX,
-            campaign_id_str=current_campaign_id
-        )
+        if current_campaign_id is not None:
+
+            mc.upload_email_contents(
+                api_key=mc_settings['api_key'],
+                server_prefix=mc_settings['server_prefix'],
+                campaign_id_str=current_campaign_id,
+                html_msg=html_content,
+                text_msg=text_content
+            )
+
+            mc.send_email_campaign(
+                api_key=mc_settings['api_key'],
+                server_prefix=mc_settings['server_prefix'],
+                campaign_id_str=current_campaign_id
+            )
+
+            # Campaign sending may take several seconds, pause execution until sending is finished, if it is
+            # unfinished before the delete command is sent, the delete function call may return an error.
+            # if it does, its non-fatal, you'll just end up with extra campaigns filling up
+            time.sleep(30)
+
+            # Delete the campaign once it is sent, daily campaign frequencies will quickly fill the MC history
+            # on the organization's website user interface for Campaigns
+            mc.delete_campaign(
+                api_key=mc_settings['api_key'],
+                server_prefix=mc_settings['server_prefix'],
+                campaign_id_str=current_campaign_id
+            )
 
-    else:
-        print('Email Campaign was not successfully created, stopping program.')
+        else:
+            print('Email Campaign was not successfully created, stopping program.')
+
+        # Activate during testing if you want to work on email formats without using the Mail Chimp
+        # API every single time. Send single email with smtplib to personal addresses for feature testing
+        # email_tests.send_smtp_email(text_content, html_content)
 
-    # Activate during testing if you want to work on email formats without using the Mail Chimp
-    # API every single time. Send single email with smtplib to personal addresses for feature testing
-    # email_tests.send_smtp_email(text_content, html_content)
+        usgs_calls.report_run_cache()
+        water_forecasts.report_model_cache()
+        http_session.report_transport()
+        report_import_times("end of run")
+        print("Program finished.")
+
+    else:
+        print("No viable data objects returned from USGS webservice, exiting program, no alerts sent.")
+        sys.exit()
 
-    print("Program finished.")
 
-else:
-    print("No viable data objects returned from USGS webservice, exiting program, no alerts sent.")
-    sys.exit()
+if __name__ == "__main__":
+    main()
 
 
 # TODO: Call a weather API that gets a high temperature prediction for Avon, Eagle/Gypsum, and Bond and include in the email message
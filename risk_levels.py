@@ -0,0 +1,89 @@
+"""
+Risk and condition ratings used throughout the alert program. Ratings are driven by threshold
+tables rather than if/elif chains so that thresholds can vary by river reach or fish species,
+and whole arrays (sites, forecast hours, ensemble scenarios) are classified in one numpy call.
+"""
+
+###############################################################################
+# REQUIREMENTS
+###############################################################################
+
+import numpy as np
+
+###############################################################################
+# THRESHOLD TABLES
+###############################################################################
+
+# Each table lists its class boundaries in increasing order as (threshold, inclusive) pairs, where an
+# inclusive boundary belongs to the class above it (value >= threshold) and an exclusive one to the
+# class below it (value > threshold moves up), plus one label per class.
+
+# Water temperature (F) risk levels for fishing, by species
+TEMP_RISK_TABLES = {
+    'trout': {
+        'edges': [(65, True), (71, True)],  # Low < 65 <= Concern < 71 <= High
+        'labels': ['Low', 'Concern', 'High'],
+    },
+}
+DEFAULT_SPECIES = 'trout'
+
+# Reaches/zones that use a different species table than the default, e.g. {'Lower Roaring Fork (Carbondale-GWS)': 'trout'}
+REACH_SPECIES = {}
+
+# Seasonal flow condition ratings by percent of the median flow for the date
+FLOW_RATING_TABLE = {
+    'edges': [(50, True), (80, True), (120, False), (150, False)],  # Normal is 80-120 inclusive
+    'labels': ['Low', 'Below Normal', 'Normal', 'Above Normal', 'High'],
+}
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+
+
+def level_index(values, table):
+    """
+    Return the class number (0 = lowest) of each value in a threshold table as an integer array
+    the same shape as values, with -1 for missing (NaN) values.
+    """
+    values = np.asarray(values, dtype=float)
+    levels = np.zeros(values.shape, dtype=int)
+    for threshold, inclusive in table['edges']:
+        levels += (values >= threshold) if inclusive else (values > threshold)
+    return np.where(np.isnan(values), -1, levels)
+
+
+def classify(values, table):
+    """
+    Return the label of each value in a threshold table. A scalar input returns a single label,
+    an array returns an array of labels of the same shape. Missing (NaN) values are labelled None.
+    """
+    levels = level_index(values, table)
+    labels = np.array(list(table['labels']) + [None], dtype=object)  # index -1 picks None
+    if levels.ndim == 0:
+        return labels[int(levels)]
+    return labels[levels]
+
+
+def get_temp_table(reach=None, species=None):
+    """
+    Return the water temperature risk table for a species, or for the species assigned to a reach.
+    """
+    if species is None:
+        species = REACH_SPECIES.get(reach, DEFAULT_SPECIES)
+    return TEMP_RISK_TABLES[species]
+
+
+def classify_temperature(temps, reach=None, species=None):
+    """
+    Return the fishing risk level ('Low', 'Concern', 'High') for one or many water temperatures (F).
+    """
+    return classify(temps, get_temp_table(reach=reach, species=species))
+
+
+def classify_flow(percent_of_median):
+    """
+    Return the seasonal flow condition rating for one or many percent-of-median flow values.
+    """
+    return classify(percent_of_median, FLOW_RATING_TABLE)
+
@@ -0,0 +1,51 @@
+"""
+Record type for a gauge site's observed conditions as they move through the main program
+(gather -> reach alias -> temperature risk -> flow statistics -> flow rating -> email table / log).
+Numeric fields hold real numbers with NaN for missing data and ratings hold None when a site
+can't be rated; turning those into '---' or 'no rating' text is left to the email builder.
+"""
+
+###############################################################################
+# REQUIREMENTS
+###############################################################################
+
+import numpy as np
+
+###############################################################################
+# RECORDS
+###############################################################################
+
+
+class SiteConditions:
+    """
+    Observed conditions for one gauge site. Uses __slots__ so each record is a compact
+    fixed set of attributes rather than a per-site dictionary.
+    """
+
+    __slots__ = ('site', 'alias', 'yesterday_mean_q', 'yesterday_max_t', 'percent_of_median', 't_risk', 'q_rating')
+
+    def __init__(self, site, yesterday_mean_q=np.nan, yesterday_max_t=np.nan, alias=None,
+                 percent_of_median=np.nan, t_risk=None, q_rating=None):
+        self.site = site
+        self.alias = alias if alias is not None else site
+        self.yesterday_mean_q = yesterday_mean_q  # cfs
+        self.yesterday_max_t = yesterday_max_t  # F
+        self.percent_of_median = percent_of_median  # percent of the median flow for the date
+        self.t_risk = t_risk  # risk_levels temperature label
+        self.q_rating = q_rating  # risk_levels flow label
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"SiteConditions({fields})"
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+
+
+def field_array(site_conditions_list, field):
+    """
+    Return one field of every record as a numpy array, for classifying or summarizing all sites at once.
+    """
+    return np.array([getattr(site_conditions, field) for site_conditions in site_conditions_list])
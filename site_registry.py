@@ -0,0 +1,154 @@
+"""
+Registry of the USGS gauge sites and stream temperature forecast zones used by the alert program.
+Everything about a site (gauge id, reach alias, reported parameters, forecast zone coordinates,
+gauges and model) lives in one file, ./program_files/site_registry.json. The file is validated
+and compiled once per run into dictionaries keyed by gauge id and zone name, so adding gauges
+means editing the file rather than the code, and lookups stay constant time as the list grows.
+"""
+
+###############################################################################
+# REQUIREMENTS
+###############################################################################
+
+import os
+import re
+import json
+
+###############################################################################
+# CONFIG
+###############################################################################
+
+REGISTRY_FILE = "./program_files/site_registry.json"
+MODEL_FOLDER = "./gam_models/"
+
+# USGS parameter codes a gauge can list as available
+USGS_PARAMS = {
+    "00060": "discharge (cfs)",
+    "00010": "water temperature (C)",
+}
+
+# Model inputs a zone can give its own forecast error standard deviation for (see water_forecasts.DEFAULT_INPUT_ERRORS)
+INPUT_ERROR_KEYS = ("ta_max", "tw_min", "q_mean")
+
+# USGS site numbers are 8 to 15 digits and kept as strings so the leading '0' is never lost
+SITE_ID_PATTERN = re.compile(r"^\d{8,15}$")
+
+# Compiled registry, loaded on first use
+_registry = None
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+
+
+def validate_registry(raw):
+    """
+    Check a registry loaded from file and return a list of problems (an empty list if it is valid).
+    """
+    problems = []
+    gauge_params = {}
+    for index, gauge in enumerate(raw.get("gauges", [])):
+        site_id = gauge.get("id")
+        if not isinstance(site_id, str) or not SITE_ID_PATTERN.match(site_id):
+            problems.append(f"gauge {index}: id {site_id!r} is not a USGS site number string")
+            continue
+        if site_id in gauge_params:
+            problems.append(f"gauge {site_id}: listed more than once")
+        if not gauge.get("alias"):
+            problems.append(f"gauge {site_id}: missing alias")
+        params = gauge.get("params", [])
+        unknown = [param for param in params if param not in USGS_PARAMS]
+        if not params or unknown:
+            problems.append(f"gauge {site_id}: params {params} must be one or more of {list(USGS_PARAMS)}")
+        gauge_params[site_id] = set(params)
+
+    zone_names = set()
+    for index, zone in enumerate(raw.get("zones", [])):
+        name = zone.get("zone")
+        if not name:
+            problems.append(f"zone {index}: missing zone name")
+            continue
+        if name in zone_names:
+            problems.append(f"zone {name}: listed more than once")
+        zone_names.add(name)
+        lat, lon = zone.get("lat"), zone.get("lon")
+        if not isinstance(lat, (int, float)) or not -90 <= lat <= 90 \
+                or not isinstance(lon, (int, float)) or not -180 <= lon <= 180:
+            problems.append(f"zone {name}: lat/lon ({lat}, {lon}) is not a valid coordinate")
+        for key, param in (("flow_gauge", "00060"), ("temp_gauge", "00010")):
+            site_id = zone.get(key)
+            if site_id not in gauge_params:
+                problems.append(f"zone {name}: {key} {site_id!r} is not a registered gauge")
+            elif param not in gauge_params[site_id]:
+                problems.append(f"zone {name}: {key} {site_id} does not report {USGS_PARAMS[param]}")
+        for key, error in zone.get("input_errors", {}).items():
+            if key not in INPUT_ERROR_KEYS or not isinstance(error, (int, float)) or error < 0:
+                problems.append(f"zone {name}: input error {key}={error!r} must be one of {list(INPUT_ERROR_KEYS)} "
+                                f"with a non-negative standard deviation")
+        model_name = zone.get("model_name")
+        model_files = [model_name, f"{os.path.splitext(model_name)[0]}.npz"] if model_name else []
+        if not any(os.path.exists(os.path.join(MODEL_FOLDER, file_name)) for file_name in model_files):
+            problems.append(f"zone {name}: model {model_name!r} not found in {MODEL_FOLDER}")
+    return problems
+
+
+def compile_registry(raw):
+    """
+    Build the in-memory registry from a validated registry file: gauges and zones indexed by
+    gauge id and zone name (in file order).
+    """
+    gauges = {gauge["id"]: gauge for gauge in raw["gauges"]}
+    zones = {zone["zone"]: zone for zone in raw["zones"]}
+    return {"gauges": gauges, "zones": zones}
+
+
+def load_registry(file_name=REGISTRY_FILE):
+    """
+    Read, validate, and compile a registry file. Raises ValueError listing every problem found.
+    """
+    with open(file_name) as registry_file:
+        raw = json.load(registry_file)
+    problems = validate_registry(raw)
+    if problems:
+        raise ValueError(f"Invalid site registry {file_name}:\n  " + "\n  ".join(problems))
+    return compile_registry(raw)
+
+
+def get_registry():
+    """
+    Return the compiled registry, loading it from file the first time it is needed.
+    """
+    global _registry
+    if _registry is None:
+        _registry = load_registry()
+    return _registry
+
+
+def get_gauge(site_id):
+    """
+    Return the registry entry for a gauge, or None if the gauge isn't registered.
+    """
+    return get_registry()["gauges"].get(site_id)
+
+
+def get_alias(site_id):
+    """
+    Return the local reach nickname for a gauge, or the gauge id itself if it has none.
+    """
+    gauge = get_gauge(site_id)
+    return gauge["alias"] if gauge is not None else site_id
+
+
+def conditions_sites():
+    """
+    Return the ids of the gauges reported in the yesterday's conditions table, in registry order.
+    """
+    return [site_id for site_id, gauge in get_registry()["gauges"].items() if gauge.get("conditions_table", True)]
+
+
+def forecast_zones():
+    """
+    Return the stream temperature forecast zones (zone, lat, lon, flow_gauge, temp_gauge, model_name, and
+    optionally input_errors), in registry order.
+    """
+    return list(get_registry()["zones"].values())
@@ -0,0 +1,52 @@
+"""
+Shared test setup. The program's modules live in the repository root and read their files
+(./gam_models/, ./program_files/, ...) relative to it, so the tests import from and run in it.
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import local_store  # noqa: E402
+import site_registry  # noqa: E402
+
+LOCAL_TZ = "America/Denver"
+
+
+@pytest.fixture(autouse=True)
+def run_from_repo_root(monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+
+
+@pytest.fixture
+def zone(tmp_path, monkeypatch):
+    """
+    A registry zone with three days (July 1-3, 2022) of 15 minute flow and water temperature in a
+    temporary store, the forecast high air temperature logged on July 2, and a full weather forecast
+    logged on July 3.
+    """
+    monkeypatch.setattr(local_store, "STORE_DB", str(tmp_path / "observations.sqlite"))
+    zone_info = site_registry.forecast_zones()[0]
+    times = pd.date_range("2022-07-01", "2022-07-04", freq="15min", tz=LOCAL_TZ, inclusive="left")
+    hours = times.hour + times.minute / 60
+    temps = 16 + 3 * np.sin((hours - 9) / 24 * 2 * np.pi)
+    for site, param, values in ((zone_info["flow_gauge"], "00060", np.full(len(times), 500.0)),
+                                (zone_info["temp_gauge"], "00010", temps)):
+        local_store.append_observations(site, param, [
+            {"value": f"{value:.2f}", "qualifiers": ["P"], "dateTime": time.isoformat(timespec="milliseconds")}
+            for time, value in zip(times, values)])
+
+    run_time = int(pd.Timestamp("2022-07-02 08:00", tz=LOCAL_TZ).timestamp())
+    local_store.append_zone_forecasts([{"zone": zone_info["zone"], "ta_max": 84.0}], run_time=run_time)
+    run_time += 24 * 60 * 60
+    local_store.append_weather_forecasts({zone_info["zone"]: {
+        "timezone_offset": -6 * 60 * 60,
+        "hourly": [{"dt": run_time + 3600 * hour, "temp": 70.0 + hour, "weather": [{"description": "clear sky"}]}
+                   for hour in range(24)],
+    }}, run_time=run_time)
+    return zone_info
@@ -0,0 +1,28 @@
+import pandas as pd
+
+import backtest
+
+LOCAL_TZ = "America/Denver"
+
+
+def test_store_gauge_source_returns_the_day_before_the_forecast_time(zone):
+    start = pd.Timestamp("2022-07-01", tz=LOCAL_TZ)
+    source = backtest.store_gauge_source([(zone["temp_gauge"], "00010")], start, start + pd.Timedelta(days=3))
+    response = source(zone["temp_gauge"], "00010", start + pd.Timedelta(days=1, hours=8))
+    observations = response["value"]["timeSeries"][0]["values"][0]["value"]
+    assert len(observations) == 96
+    assert observations[-1]["dateTime"].startswith("2022-07-02T08:00")
+    assert source(zone["temp_gauge"], "00060", start) is None  # pair not read
+
+
+def test_replay_uses_logged_weather_and_falls_back_to_logged_air_high(zone):
+    days, skipped = backtest.replay_zone_forecasts(zone, "2022-07-01", "2022-07-03")
+    assert skipped == 1  # nothing logged for July 1
+    assert list(days["date"].astype(str)) == ["2022-07-02", "2022-07-03"]
+    assert list(days["ta_max"]) == [84.0, 81.0]  # logged high, then the first 12 hours of the logged forecast
+    assert list(days["q_mean"]) == [500, 500]
+    assert (days["observed"] == round(19 * 9 / 5 + 32)).all()
+
+
+def test_backtest_without_zones_returns_nothing():
+    assert backtest.run_backtest("2022-07-01", "2022-07-03", zones=[], backfill=False) == []
@@ -0,0 +1,24 @@
+from datetime import date
+
+import build_email
+
+
+def outlook_day(day, max_temp):
+    return {"date": date(2022, 7, day), "max_temp": max_temp, "ta_max": 85, "risk": "Low"}
+
+
+def test_outlook_table_aligns_zones_with_different_dates():
+    zones = [
+        {"zone": "Zone A", "outlook": [outlook_day(21, 61), outlook_day(22, 62)]},
+        {"zone": "Zone B", "outlook": [outlook_day(22, 58), outlook_day(23, 59)]},
+    ]
+    html = build_email.build_outlook_table(zones)
+    header, zone_a, zone_b = html.split("<tr>")[1:4]
+    assert [label in header for label in ("07/21", "07/22", "07/23")] == [True, True, True]
+    # each zone's cells sit under their own dates, with a placeholder for the missing day
+    assert zone_a.index("61") < zone_a.index("62") < zone_a.index("---")
+    assert zone_b.index("---") < zone_b.index("58") < zone_b.index("59")
+
+
+def test_outlook_table_skipped_without_outlooks():
+    assert build_email.build_outlook_table([{"zone": "Zone A", "outlook": []}]) is None
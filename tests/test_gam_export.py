@@ -0,0 +1,24 @@
+import json
+import os
+
+import pytest
+
+import gam_export
+
+pytest.importorskip("pygam")  # the parity check unpickles the original pygam models
+
+REGISTRY_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "program_files", "site_registry.json")
+with open(REGISTRY_FILE) as registry_file:
+    MODEL_NAMES = list(dict.fromkeys(zone["model_name"] for zone in json.load(registry_file)["zones"]))
+
+
+@pytest.mark.parametrize("model_name", MODEL_NAMES)
+def test_exported_model_matches_pygam(model_name):
+    assert gam_export.check_parity(model_name) <= gam_export.PARITY_TOLERANCE
+
+
+@pytest.mark.parametrize("model_name", MODEL_NAMES)
+def test_exported_model_has_every_interval_width(model_name):
+    array_gam = gam_export.ArrayGAM(gam_export.array_file_name(model_name))
+    assert set(array_gam.interval_critical_values) == set(gam_export.INTERVAL_WIDTHS)
@@ -0,0 +1,31 @@
+import time
+
+import pytest
+
+import local_store
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_store, "STORE_DB", str(tmp_path / "observations.sqlite"))
+
+
+def test_weather_forecasts_keep_the_first_run_of_each_day():
+    run_time = int(time.time())
+    local_store.append_weather_forecasts({"Zone A": {"hourly": [{"temp": 80.0}]}, "Zone B": {"hourly": []}},
+                                         run_time=run_time)
+    local_store.append_weather_forecasts({"Zone A": {"hourly": [{"temp": 90.0}]}}, run_time=run_time + 1)
+    logged = local_store.read_weather_forecasts()
+    assert list(logged["zone"]) == ["Zone A", "Zone B"]
+    assert logged["forecast"][0] == {"hourly": [{"temp": 80.0}]}
+
+
+def test_prune_logs_drops_rows_past_retention():
+    now = int(time.time())
+    old = now - (local_store.LOG_RETENTION_DAYS + 1) * 24 * 60 * 60
+    for run_time in (old, now):
+        local_store.append_zone_forecasts([{"zone": "Zone A", "ta_max": 84.0}], run_time=run_time)
+        local_store.append_weather_forecasts({"Zone A": {"hourly": []}}, run_time=run_time)
+    local_store.prune_logs()
+    assert list(local_store.read_zone_forecasts()["run_time"]) == [now]
+    assert list(local_store.read_weather_forecasts()["run_time"]) == [now]
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+import backtest
+import train_models
+
+pytest.importorskip("pygam")
+
+
+@pytest.fixture(scope="module")
+def training_data():
+    rng = np.random.default_rng(1)
+    n_days = 120
+    x_data = np.column_stack([rng.uniform(60, 95, n_days), rng.uniform(48, 62, n_days),
+                              rng.uniform(200, 1500, n_days), rng.uniform(150, 270, n_days)])
+    y_data = 20 + 0.3 * x_data[:, 0] + 0.5 * x_data[:, 1] - 0.002 * x_data[:, 2] + rng.normal(0, 0.8, n_days)
+    return x_data, y_data
+
+
+@pytest.mark.parametrize("start_lam", [0.02, 5000.0])
+def test_lambda_search_settles_instead_of_flip_flopping(training_data, start_lam):
+    x_data, y_data = training_data
+    first = train_models.search_near(x_data, y_data, start_lam).terms[0].lam[0]
+    second = train_models.search_near(x_data, y_data, first).terms[0].lam[0]
+    assert second == pytest.approx(first)
+
+
+def test_training_set_matches_the_replayed_forecast_inputs(zone):
+    training_set = train_models.build_training_set(zone, "2022-07-01", "2022-07-03")
+    replayed, _ = backtest.replay_zone_forecasts(zone, "2022-07-01", "2022-07-03")
+    assert list(training_set["date"]) == list(replayed["date"])
+    for column in train_models.FEATURES:
+        assert list(training_set[column]) == list(replayed[column])
+    assert list(training_set["tw_max"]) == list(replayed["observed"])
@@ -0,0 +1,91 @@
+import json
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import http_cache
+import local_store
+import usgs_calls
+
+SITE = "09070000"
+
+# The same two hours of flow and water temperature at one site in the IV service's two formats. The
+# flow at 08:00 is ice affected, and the temperature has no 08:15 observation.
+OBSERVATIONS = {
+    "00060": [("2022-01-25T08:00:00.000-07:00", "-999999", ["P"]),
+              ("2022-01-25T08:15:00.000-07:00", "1230", ["P", "e"]),
+              ("2022-01-25T08:30:00.000-07:00", "1240", ["P"])],
+    "00010": [("2022-01-25T08:00:00.000-07:00", "0.1", ["P"]),
+              ("2022-01-25T08:30:00.000-07:00", "0.2", ["P"])],
+}
+
+JSON_BODY = json.dumps({"value": {"timeSeries": [
+    {"sourceInfo": {"siteCode": [{"value": SITE}]},
+     "variable": {"variableCode": [{"value": param}], "noDataValue": usgs_calls.NO_DATA_VALUE},
+     "values": [{"value": [{"value": value, "qualifiers": qualifiers, "dateTime": date_time}
+                           for date_time, value, qualifiers in observations]}]}
+    for param, observations in OBSERVATIONS.items()]}})
+
+RDB_BODY = "\n".join([
+    "# Data provided for site 09070000",
+    "#            TS   parameter     Description",
+    "#         12345       00060     Discharge, cubic feet per second",
+    "#         12346       00010     Temperature, water, degrees Celsius",
+    "#",
+    "agency_cd\tsite_no\tdatetime\ttz_cd\t12345_00060\t12345_00060_cd\t12346_00010\t12346_00010_cd",
+    "5s\t15s\t20d\t6s\t14n\t10s\t14n\t10s",
+    "USGS\t09070000\t2022-01-25 08:00\tMST\tIce\tP\t0.1\tP",
+    "USGS\t09070000\t2022-01-25 08:15\tMST\t1230\tP:e\t\t",
+    "USGS\t09070000\t2022-01-25 08:30\tMST\t1240\tP\t0.2\tP",
+])
+
+
+def sorted_frame(frame):
+    return frame.sort_values(["site", "param", "dateTime"]).reset_index(drop=True)
+
+
+def test_rdb_parser_matches_the_json_frame():
+    json_frame = usgs_calls.extract_series_frame(json.loads(JSON_BODY)["value"]["timeSeries"])
+    pd.testing.assert_frame_equal(sorted_frame(usgs_calls.parse_iv_rdb(RDB_BODY)), sorted_frame(json_frame))
+
+
+def test_both_formats_give_the_same_series(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_store, "STORE_DB", str(tmp_path / "observations.sqlite"))
+    monkeypatch.setattr(http_cache, "cached_get",
+                        lambda url, **kwargs: RDB_BODY if "format=rdb" in url else JSON_BODY)
+    frames = {}
+    for fmt in ("json", "rdb"):
+        usgs_calls.clear_run_cache()
+        iv_data = usgs_calls.get_multi_site_data([SITE], period="P1D", incremental=False, fmt=fmt)
+        frames[fmt] = sorted_frame(usgs_calls.extract_series_frame(iv_data["value"]["timeSeries"]))
+    assert len(frames["json"]) == 5
+    pd.testing.assert_frame_equal(frames["rdb"], frames["json"])
+
+
+def test_c_to_f_passes_missing_temperatures_through():
+    assert usgs_calls.c_to_f(20.0) == 68
+    assert np.isnan(usgs_calls.c_to_f(np.nan))
+    summary = usgs_calls.summarize_day(usgs_calls.empty_series_frame()[["dateTime", "value"]])  # gauge is down
+    assert np.isnan(usgs_calls.c_to_f(summary["morning_min"]))
+
+
+def test_sites_without_statistics_are_not_requested_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_store, "STORE_DB", str(tmp_path / "observations.sqlite"))
+    monkeypatch.setattr(usgs_calls, "_percentile_table", {})
+    monkeypatch.setattr(usgs_calls, "_percentile_sites", set())
+    stats_body = "\n".join([
+        "# USGS statistics",
+        "agency_cd\tsite_no\tparameter_cd\tts_id\tmonth_nu\tday_nu\tp10_va\tp25_va\tp50_va\tp75_va\tp90_va",
+        "5s\t15s\t5s\t10n\t3n\t3n\t12s\t12s\t12s\t12s\t12s",
+        "USGS\t09070000\t00060\t12345\t7\t20\t300\t400\t500\t600\t700",
+    ])
+    urls = []
+    monkeypatch.setattr(http_cache, "cached_get", lambda url, **kwargs: urls.append(url) or stats_body)
+
+    for _ in range(2):
+        usgs_calls._percentile_sites.clear()
+        usgs_calls.load_percentile_table([SITE, "09070500"])
+    assert len(urls) == 1  # 09070500 has no statistics, and is stored as such
+    assert usgs_calls.get_flow_percentiles(SITE, date(2022, 7, 20))["p50"] == 500
+    assert usgs_calls.get_flow_percentiles("09070500", date(2022, 7, 20)) is None
@@ -0,0 +1,81 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import site_registry
+import usgs_calls
+import water_forecasts
+
+TIMES = pd.date_range("2022-07-20 08:00", periods=4, freq="h")
+
+
+@pytest.mark.parametrize("peak, high_temp, pm_risk, has_concern_time", [
+    (64.4, 64, "Low", False),
+    (64.5, 64, "Low", False),  # rounds half to even, like the predicted high always has
+    (64.6, 65, "Concern", True),
+    (64.96, 65, "Concern", True),
+    (65.0, 65, "Concern", True),
+])
+def test_hourly_curve_risk_matches_concern_time_at_concern_boundary(peak, high_temp, pm_risk, has_concern_time):
+    assessment = water_forecasts.assess_hourly_curve(TIMES, np.array([60.0, 62.5, peak, 63.0]),
+                                                     reach="Lower Eagle (Eagle/Gypsum Area)")
+    assert assessment["high_temp"] == high_temp
+    assert assessment["pm_risk"] == pm_risk
+    assert (assessment["concern_time"] is not None) == has_concern_time
+    assert assessment["high_time"] is None
+    if has_concern_time:
+        assert assessment["concern_time"] == TIMES[2]
+
+
+def test_hourly_curve_high_is_the_curve_peak():
+    assessment = water_forecasts.assess_hourly_curve(TIMES, np.array([66.0, 70.6, 71.8, 69.0]))
+    assert assessment["hottest_hour"] == 2
+    assert assessment["high_temp"] == 72
+    assert assessment["pm_risk"] == "High"
+    assert assessment["concern_time"] == TIMES[0]
+    assert assessment["high_time"] == TIMES[1]
+
+
+def test_manifest_is_read_once_until_it_changes(tmp_path, monkeypatch):
+    manifest_file = tmp_path / "manifest.json"
+    monkeypatch.setattr(water_forecasts, "MODEL_MANIFEST", str(manifest_file))
+    monkeypatch.setattr(water_forecasts, "_json_cache", {})
+    reads = []
+    real_load = water_forecasts.json.load
+    monkeypatch.setattr(water_forecasts.json, "load", lambda file: reads.append(file.name) or real_load(file))
+
+    assert water_forecasts.resolve_model_file("gam_kremmling.obj") == "gam_kremmling.obj"  # no manifest yet
+    manifest_file.write_text('{"gam_kremmling.obj": {"file": "gam_catamount.obj"}}')
+    for _ in range(3):
+        assert water_forecasts.resolve_model_file("gam_kremmling.obj") == "gam_catamount.obj"
+    assert len(reads) == 1
+
+    manifest_file.write_text('{"gam_kremmling.obj": {"file": "versions/not_there.obj"}}')
+    assert water_forecasts.resolve_model_file("gam_kremmling.obj") == "gam_kremmling.obj"  # missing version
+    assert len(reads) == 2
+
+
+def test_outlook_starts_after_today_and_carries_the_water_minimum_forward():
+    zone = site_registry.forecast_zones()[0]
+    daily_air_fx = pd.DataFrame({
+        "date": [date(2022, 7, day) for day in range(19, 26)],  # fetched before midnight, starts yesterday
+        "temp_max": [84.0, 85.0, 88.0, 90.0, 91.0, 87.0, 83.0],
+        "weather": ["clear sky"] * 7,
+    })
+    params = {"tw_min": 58, "q_mean": 450, "doy": 201}
+    outlook = water_forecasts.forecast_outlook(params, 66, daily_air_fx, zone["model_name"], date(2022, 7, 20),
+                                               reach=zone["zone"], days=3)
+    assert [day["date"] for day in outlook] == [date(2022, 7, 21), date(2022, 7, 22), date(2022, 7, 23)]
+    assert [day["doy"] for day in outlook] == [202, 203, 204]
+    # each morning minimum is the day before's high less today's 8 F daily range
+    assert outlook[0]["tw_min"] == 58
+    assert [day["tw_min"] for day in outlook[1:]] == [day["max_temp"] - 8 for day in outlook[:-1]]
+
+
+def test_replayed_forecast_starts_with_an_empty_run_cache(monkeypatch):
+    monkeypatch.setattr(usgs_calls, "_run_cache", {("09070000", "00010", "P1D"): []})
+    now = pd.Timestamp("2022-07-20 08:00", tz=usgs_calls.LOCAL_TZ)
+    assert water_forecasts.forecast_stream_temperature(clock=lambda: now, zones=[]) == []
+    assert usgs_calls._run_cache == {}
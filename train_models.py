@@ -0,0 +1,271 @@
+"""
+Refit the stream temperature GAM models from the locally stored gauge and weather history. Each
+reach's training set pairs the morning forecast inputs (ta_max, tw_min, q_mean, doy), read from
+the local store the same way the backtest replays them (backtest.py) but without running the
+forecast, with that day's observed high water temperature (tw_max). Reaches are fit in parallel
+worker processes. The smoothing (lambda) search result and a fingerprint of each training set
+are cached between runs in ./local_data/training_cache.json, so a reach whose data haven't
+changed is skipped and the next search starts around the last chosen lambda.
+
+Each fit is saved as a new version in ./gam_models/versions/ (the pygam pickle plus its exported
+NumPy arrays, see gam_export.py) and recorded in ./gam_models/manifest.json, which water_forecasts
+reads to load the current version of each zone's model in place of the original pickle.
+
+Run from the program folder (pygam is needed here, but not for forecasting):
+    python train_models.py START_DATE END_DATE
+    e.g. python train_models.py 2021-06-01 2022-09-30
+"""
+
+###############################################################################
+# REQUIREMENTS
+###############################################################################
+
+import os
+import sys
+import json
+import time
+import pickle
+import hashlib
+import io
+import contextlib
+from datetime import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+import backtest
+import gam_export
+import hourly_weather
+import local_store
+import site_registry
+import usgs_calls
+import water_forecasts
+
+###############################################################################
+# CONFIG
+###############################################################################
+
+MODEL_FOLDER = "./gam_models/"
+VERSION_FOLDER = "versions"  # inside MODEL_FOLDER
+MANIFEST_FILE = "./gam_models/manifest.json"
+TRAINING_CACHE_FILE = "./local_data/training_cache.json"
+
+# Model inputs, in the column order the models are fit and predicted with
+FEATURES = ["ta_max", "tw_min", "q_mean", "doy"]
+N_SPLINES = 20
+
+# Fewest days with complete data needed to refit a reach
+MIN_TRAINING_DAYS = 30
+
+# Smoothing (lambda, shared by all terms) candidates for a reach's first fit, and the multiples of the
+# cached lambda searched on later fits. If the best lambda lands on the edge of the narrow search, the
+# search is recentred on it, within the full grid's range, so it settles on a lambda with no better
+# neighbour on either side rather than jumping back to the coarse grid. Each recentring moves the
+# search by up to 4x, so MAX_LAM_SHIFTS is enough to cross the full grid's range.
+LAM_GRID = np.logspace(-2, 4, 13)
+LAM_NEIGHBORHOOD = (0.25, 0.5, 1, 2, 4)
+MAX_LAM_SHIFTS = 10
+
+# Worker processes, one per reach by default
+MAX_WORKERS = None
+
+# Download gauge history missing from the local store before refitting
+BACKFILL = True
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+
+
+def read_json(file_name):
+    """
+    Read a json file, returning an empty dictionary if it doesn't exist yet.
+    """
+    if not os.path.exists(file_name):
+        return {}
+    with open(file_name) as json_file:
+        return json.load(json_file)
+
+
+def write_json(file_name, data):
+    """
+    Write a json file, replacing the old one only once the new one is complete.
+    """
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    with open(f"{file_name}.tmp", "w") as json_file:
+        json.dump(data, json_file, indent=2, default=str)
+    os.replace(f"{file_name}.tmp", file_name)
+
+
+def build_training_set(zone_info, start_date, end_date, forecast_hour=backtest.FORECAST_HOUR):
+    """
+    Return a reach's training set between two dates as a dataframe with one row per day: the model
+    inputs (FEATURES) the morning forecast had and the observed high water temperature (F) in 'tw_max'.
+    Only the inputs are replayed, not the forecast: the gauge inputs are read off the last day of stored
+    observations up to forecast_hour (as in backtest.store_gauge_source) and the air temperature off the
+    weather the forecast had (see backtest.store_weather_source).
+    """
+    start = pd.Timestamp(start_date).tz_localize(usgs_calls.LOCAL_TZ)
+    end = pd.Timestamp(end_date).tz_localize(usgs_calls.LOCAL_TZ) + pd.Timedelta(days=1)
+    # the forecast reads the last day of gauge data, so read one extra day before the start
+    flow = local_store.read_iv(zone_info["flow_gauge"], "00060", start - pd.Timedelta(days=1), end)
+    temp = local_store.read_iv(zone_info["temp_gauge"], "00010", start - pd.Timedelta(days=1), end)
+    weather_source = backtest.store_weather_source(zone_info["zone"], start, end)
+
+    rows = []
+    skipped = 0
+    for date in pd.date_range(start_date, end_date, freq="D"):
+        day = date.tz_localize(usgs_calls.LOCAL_TZ)
+        now = day + pd.Timedelta(hours=forecast_hour)
+        flow_first, flow_last = flow["dateTime"].searchsorted([now - pd.Timedelta(days=1), now], side="right")
+        temp_first, temp_last = temp["dateTime"].searchsorted([now - pd.Timedelta(days=1), now], side="right")
+        with contextlib.redirect_stdout(io.StringIO()):  # the extraction steps print for every call
+            gauge_inputs = water_forecasts.summarize_zone_gauges(flow.iloc[flow_first:flow_last],
+                                                                 temp.iloc[temp_first:temp_last], now=now)
+            hourly_air_fx = hourly_weather.unpack_fx_data(weather_source(zone_info, now))
+        day_temps = temp["value"][(temp["dateTime"] >= day) & (temp["dateTime"] < day + pd.Timedelta(days=1))]
+        if hourly_air_fx is None or np.isnan(gauge_inputs["q_mean"]) or np.isnan(gauge_inputs["tw_min"]) \
+                or day_temps.count() == 0:
+            skipped += 1
+            continue
+        rows.append({"date": day.date(), "ta_max": np.nanmax(hourly_air_fx["temps"]), "tw_min": gauge_inputs["tw_min"],
+                     "q_mean": gauge_inputs["q_mean"], "doy": now.timetuple().tm_yday,
+                     "tw_max": usgs_calls.c_to_f(day_temps.max())})
+    print(f"{zone_info['zone']}: {len(rows)} training days, {skipped} days without complete data")
+    return pd.DataFrame(rows, columns=["date"] + FEATURES + ["tw_max"])
+
+
+def training_fingerprint(days):
+    """
+    Return a short hash of a training set, used to tell whether a reach's data changed since it was last fit.
+    """
+    values = np.ascontiguousarray(days[FEATURES + ["tw_max"]].to_numpy(dtype=float))
+    return hashlib.sha1(values.tobytes()).hexdigest()
+
+
+def fit_gam(x_data, y_data, lam_candidates):
+    """
+    Fit a LinearGAM with a spline on each input, choosing the shared smoothing lambda from the candidates
+    by pygam's grid search (GCV). pygam is imported here so the forecast program never needs it.
+    """
+    from pygam import LinearGAM, s
+    terms = s(0, n_splines=N_SPLINES) + s(1, n_splines=N_SPLINES) + s(2, n_splines=N_SPLINES) \
+        + s(3, n_splines=N_SPLINES)
+    lams = np.repeat(np.asarray(lam_candidates, dtype=float)[:, np.newaxis], len(FEATURES), axis=1)
+    return LinearGAM(terms).gridsearch(x_data, y_data, lam=lams, progress=False)
+
+
+def search_near(x_data, y_data, lam):
+    """
+    Fit a reach starting from the lambda chosen last time: search LAM_NEIGHBORHOOD multiples of it and,
+    while the best lambda is on the edge of the candidates, search again centred on the best lambda.
+    Returns the fitted model.
+    """
+    for shift in range(MAX_LAM_SHIFTS + 1):
+        lam_candidates = np.clip([lam * multiple for multiple in LAM_NEIGHBORHOOD], LAM_GRID[0], LAM_GRID[-1])
+        gam = fit_gam(x_data, y_data, np.unique(lam_candidates))
+        lam = gam.terms[0].lam[0]
+        on_edge = np.isclose(lam, lam_candidates.min()) or np.isclose(lam, lam_candidates.max())
+        at_limit = np.isclose(lam, LAM_GRID[0]) or np.isclose(lam, LAM_GRID[-1])
+        if not on_edge or at_limit:
+            break
+        print(f"Best lambda {lam:g} is on the edge of the search, searching around it")
+    return gam
+
+
+def train_reach(zone_info, start_date, end_date, cached=None):
+    """
+    Refit one reach's model (runs in a worker process). cached is the reach's entry from the training
+    cache, if any. Returns a dictionary describing the outcome ('trained', 'unchanged', or 'skipped')
+    and, for a new fit, its version file, chosen lambda, GCV score, and training fingerprint.
+    """
+    start = time.perf_counter()
+    model_name = zone_info["model_name"]
+    result = {"zone": zone_info["zone"], "model_name": model_name, "status": "skipped", "days": 0}
+    days = build_training_set(zone_info, start_date, end_date)
+    result["days"] = len(days)
+    if len(days) < MIN_TRAINING_DAYS:
+        print(f"{zone_info['zone']}: fewer than {MIN_TRAINING_DAYS} training days, not refit")
+        return result
+
+    fingerprint = training_fingerprint(days)
+    if cached is not None and cached.get("fingerprint") == fingerprint:
+        result["status"] = "unchanged"
+        return result
+
+    x_data = days[FEATURES].to_numpy(dtype=float)
+    y_data = days["tw_max"].to_numpy(dtype=float)
+    if cached is not None and cached.get("lam"):
+        gam = search_near(x_data, y_data, cached["lam"])
+    else:
+        gam = fit_gam(x_data, y_data, LAM_GRID)
+
+    # save the new version next to the other versions and export its arrays for forecasting
+    version = dt.now().strftime("%Y%m%dT%H%M%S")
+    version_name = f"{os.path.splitext(model_name)[0]}_{version}.obj"
+    version_folder = os.path.join(MODEL_FOLDER, VERSION_FOLDER)
+    os.makedirs(version_folder, exist_ok=True)
+    with open(os.path.join(version_folder, version_name), "wb") as model_file:
+        pickle.dump(gam, model_file)
+    gam_export.export_model(version_name, folder=version_folder)
+
+    result.update({"status": "trained", "file": f"{VERSION_FOLDER}/{version_name}",
+                   "lam": float(gam.terms[0].lam[0]), "gcv": float(gam.statistics_["GCV"]),
+                   "fingerprint": fingerprint, "training_start": str(start_date), "training_end": str(end_date),
+                   "trained_at": version, "seconds": time.perf_counter() - start})
+    return result
+
+
+def train_all(start_date, end_date, zones=None, max_workers=MAX_WORKERS, backfill=BACKFILL):
+    """
+    Refit every reach model in the site registry (or a given list of registry zones), one reach per
+    worker process, after downloading any gauge history missing from the local store (unless backfill
+    is False, e.g. when working offline from the store), then update the
+    training cache and point the model manifest at the new versions.
+    Zones sharing a model are fit once, from the first of them. Returns the list of train_reach results.
+    """
+    if zones is None:
+        zones = site_registry.forecast_zones()
+    zones = list({zone_info["model_name"]: zone_info for zone_info in reversed(zones)}.values())[::-1]
+    if len(zones) == 0:
+        return []
+    if backfill:
+        backtest.backfill_zones(zones, pd.Timestamp(start_date).tz_localize(usgs_calls.LOCAL_TZ) - pd.Timedelta(days=1),
+                                pd.Timestamp(end_date).tz_localize(usgs_calls.LOCAL_TZ) + pd.Timedelta(days=1))
+    training_cache = read_json(TRAINING_CACHE_FILE)
+    with ProcessPoolExecutor(max_workers=max_workers or len(zones)) as executor:
+        jobs = [executor.submit(train_reach, zone_info, start_date, end_date, training_cache.get(zone_info["model_name"]))
+                for zone_info in zones]
+        results = [job.result() for job in jobs]
+
+    manifest = read_json(MANIFEST_FILE)
+    for result in results:
+        if result["status"] == "trained":
+            training_cache[result["model_name"]] = {"lam": result["lam"], "fingerprint": result["fingerprint"]}
+            manifest[result["model_name"]] = {key: result[key] for key in
+                                              ("file", "lam", "gcv", "days", "training_start", "training_end",
+                                               "trained_at")}
+    write_json(TRAINING_CACHE_FILE, training_cache)
+    write_json(MANIFEST_FILE, manifest)
+    return results
+
+
+def report_training(results):
+    """
+    Print the outcome of each reach's refit.
+    """
+    for result in results:
+        if result["status"] == "trained":
+            print(f"{result['zone']:<40} trained on {result['days']} days, lambda {result['lam']:g}, "
+                  f"GCV {result['gcv']:.2f}, {result['seconds']:.1f} s -> {result['file']}")
+        else:
+            print(f"{result['zone']:<40} {result['status']} ({result['days']} days)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+    run_start = time.perf_counter()
+    report_training(train_all(sys.argv[1], sys.argv[2]))
+    print(f"Training finished in {time.perf_counter() - run_start:.1f} s.")
@@ -7,17 +7,100 @@ Bill Hoblitzell bill@lotichydrological.com 6/24/2021
 # REQUIREMENTS
 ###############################################################################
 
+import re
+import json
+import time
+from io import StringIO
+from urllib.parse import quote
 import requests
 from datetime import datetime as dt
-import dataretrieval.nwis as nwis
+from datetime import timezone
 import pandas as pd
 import numpy as np
 
+import http_cache
+import http_session
+import local_store
+
+###############################################################################
+# CONFIG
+###############################################################################
+
+# Rebuild whole-day IV windows from the local observation store and only request new values
+INCREMENTAL_IV = True
+
+# Sites whose high-water marks are within this many seconds of each other share an incremental request
+MARK_GROUP_SECONDS = 60 * 60
+
+# Cold (first) fills of at least this many days are parsed as they stream in instead of as one json document
+STREAM_MIN_DAYS = 3
+
+# Days of instantaneous values requested at a time when backfilling past seasons
+BACKFILL_CHUNK_DAYS = 31
+
+# Time zone of the gauges, used to convert USGS timestamps to local time
+LOCAL_TZ = "America/Denver"
+
+# Column names used for the USGS parameter codes in single-parameter dataframes
+PARAM_NAMES = {"00010": "temp_c", "00060": "q"}
+
+# Refresh the stored flow percentile tables after this many days
+PERCENTILE_TTL_DAYS = 90
+
+# Response format for IV requests: 'json' (WaterML-JSON) or 'rdb' (USGS tab-delimited, several times
+# smaller on the wire and quicker to parse). Both give the same series, see parse_iv_rdb().
+IV_FORMAT = 'json'
+
+# Value the IV service's json format reports for missing observations ('noDataValue'); RDB responses
+# report these as text (e.g. 'Ice', 'Eqp') or leave them blank
+NO_DATA_VALUE = -999999.0
+
+# UTC offsets for the time zone abbreviations used in USGS RDB files
+TZ_OFFSETS = {
+    "UTC": "+00:00", "EST": "-05:00", "EDT": "-04:00", "CST": "-06:00", "CDT": "-05:00",
+    "MST": "-07:00", "MDT": "-06:00", "PST": "-08:00", "PDT": "-07:00",
+}
+
+###############################################################################
+# RUN CACHE
+###############################################################################
+
+# Instantaneous value series already retrieved during this program run, keyed by
+# (site, parameter code, period). Each slot holds the list of 'timeSeries' entries
+# returned for that pair (an empty list means the call succeeded but had no data).
+_run_cache = {}
+run_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def clear_run_cache():
+    """
+    Empty the run cache and reset its hit/miss counters. Called at the start of each program
+    run (main.py) and of each forecast made for a time other than now (replays), so a series
+    is never served to a run it wasn't fetched for.
+    """
+    _run_cache.clear()
+    run_cache_stats['hits'] = 0
+    run_cache_stats['misses'] = 0
+
+
+def report_run_cache():
+    """
+    Print the number of site/parameter requests served from memory versus from the webservice.
+    """
+    print(f"USGS run cache: {run_cache_stats['hits']} hits, {run_cache_stats['misses']} misses, "
+          f"{len(_run_cache)} site/parameter series held in memory.")
+
+
+# Day-of-year flow percentiles loaded from the local store, keyed by (site, month, day)
+_percentile_table = {}
+_percentile_sites = set()
+
+
 ###############################################################################
 # FUNCTIONS
 ###############################################################################
 
-def get_site_data(site, param, period='P1D'):
+def get_site_data(site, param, period='P1D', fmt=IV_FORMAT):
 
     """
     Use a USGS numeric site code and a USGS parameter code to retrieve site data
@@ -25,18 +108,370 @@ def get_site_data(site, param, period='P1D'):
     (json object = python dictionary).
     """
 
-    url = f"https://waterservices.usgs.gov/nwis/iv/?format=json&sites={site}" \
-          f"&parameterCd={param}&siteStatus=all&period={period}"
+    return get_multi_site_data([site], params=[param], period=period, fmt=fmt)
+
+
+def get_multi_site_data(sites, params=("00060", "00010"), period='P1D', incremental=INCREMENTAL_IV,
+                        fmt=IV_FORMAT):
+
+    """
+    Retrieve the instantaneous values for several USGS sites and parameter codes with
+    a single webservice call (the IV service accepts comma-separated lists for both).
+    Return the webservice response as a json object, or None if the call failed.
+    Use split_timeseries() to break the combined response back out by site and parameter.
+
+    Series already retrieved during this run are served from the run cache, and only the
+    sites that still have missing series are requested from the webservice. In incremental
+    mode (whole-day periods only) the series are rebuilt from the local observation store
+    and only the values reported since the last stored observation are requested.
+    fmt is the transport the webservice is asked for, 'json' or 'rdb' (see request_iv()).
+    """
+
+    missing_sites = []
+    for site in sites:
+        for param in params:
+            if (site, param, period) in _run_cache:
+                run_cache_stats['hits'] += 1
+            else:
+                run_cache_stats['misses'] += 1
+                if site not in missing_sites:
+                    missing_sites.append(site)
+
+    if len(missing_sites) > 0:
+        try:
+            if incremental and re.fullmatch(r"P\d+D", period):
+                fetched = get_incremental_data(missing_sites, params, period, fmt=fmt)
+            else:
+                fetched = split_timeseries(request_iv(missing_sites, params, period=period, fmt=fmt))
+                for (site, param), timeseries in fetched.items():
+                    local_store.append_observations(site, param, timeseries[0]["values"][0]["value"])
+        except (requests.exceptions.RequestException, ValueError) as err:
+            print(err)
+            print("response unsuccessful, returning 'None'")
+            return None
+
+        # Hold every requested pair in the run cache, including pairs the service had no data for
+        for site in missing_sites:
+            for param in params:
+                _run_cache.setdefault((site, param, period), fetched.get((site, param), []))
+    else:
+        print(f"Serving {sites} {params} {period} from the run cache")
+
+    # Rebuild a response in the webservice's layout from the cached series
+    timeseries = []
+    for site in sites:
+        for param in params:
+            timeseries.extend(_run_cache[(site, param, period)])
+    return {"value": {"timeSeries": timeseries}}
+
+
+def build_iv_url(sites, params, period=None, start_epoch=None, end_epoch=None, fmt='json'):
+
+    """
+    Build an IV webservice url for a list of sites and parameter codes, covering either an
+    ISO-8601 period (e.g. 'P1D') or everything since start_epoch (seconds since 1970 UTC),
+    up to end_epoch if given. fmt is the response format, 'json' (WaterML-JSON) or 'rdb' (tab-delimited).
+    """
+
+    url = f"https://waterservices.usgs.gov/nwis/iv/?format={fmt}&sites={','.join(sites)}" \
+          f"&parameterCd={','.join(params)}&siteStatus=all"
+    if start_epoch is not None:
+        start_dt = dt.fromtimestamp(start_epoch, tz=timezone.utc).isoformat(timespec='minutes')
+        url = f"{url}&startDT={quote(start_dt, safe=':')}"
+        if end_epoch is not None:
+            end_dt = dt.fromtimestamp(end_epoch, tz=timezone.utc).isoformat(timespec='minutes')
+            url = f"{url}&endDT={quote(end_dt, safe=':')}"
+    else:
+        url = f"{url}&period={period}"
+    return url
+
+
+def request_iv(sites, params, period=None, start_epoch=None, fmt='json'):
+
+    """
+    Make the IV webservice call for a list of sites and parameter codes (see build_iv_url()).
+    Return the json response, raising requests/json errors to the caller. RDB responses
+    (fmt='rdb') are parsed with parse_iv_rdb() and returned in the json response's layout.
+    """
+
+    url = build_iv_url(sites, params, period=period, start_epoch=start_epoch, fmt=fmt)
     print(f"Querying USGS webservice at: {url}")
+    body = http_cache.cached_get(url, source='usgs_iv', timeout=30)
+    if fmt == 'rdb':
+        iv_data = series_frame_to_iv_data(parse_iv_rdb(body))
+    else:
+        iv_data = json.loads(body)
+    print("Response successful")
+    return iv_data
+
+
+def get_incremental_data(sites, params, period, fmt='json'):
+
+    """
+    Retrieve instantaneous values using the local observation store. Sites with a stored
+    observation inside the period are only asked for values since their high-water mark, with
+    sites whose marks are close together (see group_by_mark()) sharing a request so one stale
+    gauge doesn't drag the rest back with it; sites without one are asked for the full period.
+    Cold fetches of STREAM_MIN_DAYS or more are parsed as they stream in (see stream_iv_series()).
+    New values are appended to the store, observations older than the store's retention period
+    are dropped, and the period's window is rebuilt from the store. fmt is the transport for the
+    non-streamed requests (see request_iv()). Returns the same dictionary layout as split_timeseries().
+    """
+
+    window_start = int(time.time()) - int(period[1:-1]) * 24 * 60 * 60
+    site_marks = {}
+    cold_sites = []
+    for site in sites:
+        marks = [local_store.get_high_water_mark(site, param) for param in params]
+        marks = [mark for mark in marks if mark is not None and mark >= window_start]
+        if len(marks) > 0:
+            site_marks[site] = min(marks)
+        else:
+            cold_sites.append(site)
+
+    fetched = {}
+    if len(cold_sites) > 0 and int(period[1:-1]) >= STREAM_MIN_DAYS:
+        # long first fills go straight from the streamed response into the store
+        frame = stream_iv_series(cold_sites, params, period=period)
+        if frame is None:
+            raise ValueError(f"Streaming the {period} IV request for {cold_sites} was unsuccessful")
+        local_store.append_series_frame(frame)
+    elif len(cold_sites) > 0:
+        fetched.update(split_timeseries(request_iv(cold_sites, params, period=period, fmt=fmt)))
+    mark_groups = group_by_mark(site_marks)
+    for start_epoch, group_sites in mark_groups:
+        fetched.update(split_timeseries(request_iv(group_sites, params, start_epoch=start_epoch, fmt=fmt)))
+    for (site, param), timeseries in fetched.items():
+        local_store.append_observations(site, param, timeseries[0]["values"][0]["value"])
+    local_store.prune_observations(sites, params)
+
+    series = {}
+    for site in sites:
+        for param in params:
+            observations = local_store.read_observations(site, param, window_start)
+            if len(observations) > 0:
+                series[(site, param)] = [{
+                    "sourceInfo": {"siteCode": [{"value": site}]},
+                    "variable": {"variableCode": [{"value": param}]},
+                    "values": [{"value": observations}],
+                }]
+    print(f"Rebuilt {len(series)} series from the local store ({len(site_marks)} sites fetched incrementally "
+          f"in {len(mark_groups)} requests)")
+    return series
+
+
+def group_by_mark(site_marks, spread=MARK_GROUP_SECONDS):
+    """
+    Group sites by their high-water marks (a dictionary of {site: epoch seconds}) so each group can
+    be requested from its oldest mark. Sites join a group while their mark is within spread seconds
+    of the group's oldest. Return a list of (start epoch, [sites]) pairs, oldest first.
+    """
+    groups = []
+    for site, mark in sorted(site_marks.items(), key=lambda item: item[1]):
+        if len(groups) > 0 and mark - groups[-1][0] <= spread:
+            groups[-1][1].append(site)
+        else:
+            groups.append((mark, [site]))
+    return groups
+
+
+def split_timeseries(iv_data):
+    """
+    Demultiplex the combined 'timeSeries' array of a multi-site/multi-parameter IV response.
+    Return a dictionary keyed by (site, parameter code) where each value is a list of the
+    timeseries entries for that pair, i.e. the same shape as the 'timeSeries' subset of a
+    single-site response and ready to hand to extract_hourly_data().
+    """
+    series = {}
+    if iv_data is None:
+        return series
+    for ts in iv_data["value"]["timeSeries"]:
+        site = ts["sourceInfo"]["siteCode"][0]["value"]
+        param = ts["variable"]["variableCode"][0]["value"]
+        series.setdefault((site, param), []).append(ts)
+    return series
+
+
+# Patterns for picking the pieces we need out of a WaterML-JSON response as it streams in: the site and
+# parameter codes that open each timeSeries entry, and the flat {"value", "qualifiers", "dateTime"} objects
+_STREAM_PATTERN = re.compile(rb'"siteCode"\s*:\s*\[\s*\{[^{}]*"value"\s*:\s*"(?P<site>[^"]*)"[^{}]*\}'
+                             rb'|"variableCode"\s*:\s*\[\s*\{[^{}]*"value"\s*:\s*"(?P<param>[^"]*)"[^{}]*\}'
+                             rb'|(?P<obs>\{[^{}]*"dateTime"[^{}]*\})')
+_OBS_VALUE = re.compile(rb'"value"\s*:\s*"([^"]*)"')
+_OBS_DATETIME = re.compile(rb'"dateTime"\s*:\s*"([^"]*)"')
+_OBS_QUALIFIERS = re.compile(rb'"qualifiers"\s*:\s*\[([^\]]*)\]')
+_MAX_OBJECT_BYTES = 4096  # longer than any single site/variable code or observation object
+
+
+def stream_iv_series(sites, params, period='P7D', start_epoch=None, end_epoch=None, chunk_size=64 * 1024):
+
+    """
+    Retrieve instantaneous values for long periods and/or many sites without building the
+    nested WaterML-JSON document in memory. The request covers either a period or the window
+    from start_epoch to end_epoch (see build_iv_url()). The response body is read in chunks and
+    only the observations (value, dateTime, qualifiers) are copied into preallocated numpy arrays
+    for each site and parameter, so peak memory tracks the number of observations rather than the
+    size of the json document. Bypasses the run and http caches; used for long first fills of the
+    observation store and for historical backfills (see backfill_iv()).
+    Return a tidy dataframe in the same layout as extract_series_frame(), or None if the call failed.
+    """
+
+    url = build_iv_url(sites, params, period=period, start_epoch=start_epoch, end_epoch=end_epoch)
+    print(f"Streaming USGS webservice response from: {url}")
+
+    # Size the arrays for a full window of 15 minute values, they are doubled if a series runs over
+    if start_epoch is not None:
+        end = time.time() if end_epoch is None else end_epoch
+        days = max(int(np.ceil((end - start_epoch) / (24 * 60 * 60))), 1)
+    else:
+        days = int(period[1:-1]) if re.fullmatch(r"P\d+D", period) else 1
+    capacity = days * 24 * 4 + 8
+    arrays = {}
+    current_site = None
+    current_key = None
 
     try:
-        response = requests.get(url, timeout=30)
+        response = http_session.get(url, timeout=30, stream=True)
         response.raise_for_status()
+        buffer = b""
+        content_size = 0
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            content_size += len(chunk)
+            buffer += chunk
+            parsed_to = 0
+            for match in _STREAM_PATTERN.finditer(buffer):
+                parsed_to = match.end()
+                if match.group('site') is not None:
+                    current_site = match.group('site').decode()
+                elif match.group('param') is not None:
+                    current_key = (current_site, match.group('param').decode())
+                    if current_key not in arrays:
+                        arrays[current_key] = {
+                            'n': 0,
+                            'value': np.empty(capacity, dtype='f8'),
+                            'dateTime': np.empty(capacity, dtype='S29'),
+                            'qualifiers': np.empty(capacity, dtype='S16'),
+                        }
+                elif current_key is not None:
+                    obs = match.group('obs')
+                    series = arrays[current_key]
+                    n = series['n']
+                    if n == len(series['value']):
+                        for field in ('value', 'dateTime', 'qualifiers'):
+                            series[field] = np.resize(series[field], 2 * n)
+                    series['value'][n] = float(_OBS_VALUE.search(obs).group(1))
+                    series['dateTime'][n] = _OBS_DATETIME.search(obs).group(1)
+                    series['qualifiers'][n] = _OBS_QUALIFIERS.search(obs).group(1).replace(b'"', b'').replace(b' ', b'')
+                    series['n'] = n + 1
+            # keep only the unparsed tail, which can hold at most one incomplete object
+            buffer = buffer[max(parsed_to, len(buffer) - _MAX_OBJECT_BYTES):]
+        http_session.record_transfer(response, content_size=content_size)
         print("Response successful")
-        return response.json()
-    except requests.exceptions.RequestException as err:
+    except (requests.exceptions.RequestException, ValueError, AttributeError) as err:
         print(err)
         print("response unsuccessful, returning 'None'")
+        return None
+
+    frames = []
+    for (site, param), series in arrays.items():
+        n = series['n']
+        frames.append(pd.DataFrame({
+            'site': site,
+            'param': param,
+            'dateTime': pd.to_datetime(series['dateTime'][:n].astype(str), utc=True).tz_convert(LOCAL_TZ),
+            'value': series['value'][:n],
+            'qualifiers': series['qualifiers'][:n].astype(str),
+        }))
+    if len(frames) == 0:
+        return empty_series_frame()
+    return pd.concat(frames, ignore_index=True)
+
+
+def backfill_iv(sites, params, start, end, chunk_days=BACKFILL_CHUNK_DAYS):
+
+    """
+    Download the instantaneous values for a list of sites and parameter codes between two
+    timezone-aware datetimes into the local observation store, so past seasons can be replayed
+    (see backtest.py and train_models.py). The window is requested in chunks of chunk_days
+    through the streaming parser. Chunks already backfilled for every site and parameter are
+    skipped, and chunks are only recorded as backfilled once they are more than a day old.
+    Return the number of chunks requested.
+    """
+
+    start_epoch = int(start.timestamp())
+    end_epoch = int(end.timestamp())
+    settled = time.time() - 24 * 60 * 60
+    requested = 0
+    for chunk_start in range(start_epoch, end_epoch, chunk_days * 24 * 60 * 60):
+        chunk_end = min(chunk_start + chunk_days * 24 * 60 * 60, end_epoch)
+        if local_store.is_backfilled(sites, params, chunk_start, chunk_end):
+            continue
+        frame = stream_iv_series(sites, params, start_epoch=chunk_start, end_epoch=chunk_end)
+        requested += 1
+        if frame is None:
+            print(f"Backfill of {sites} {params} from {dt.fromtimestamp(chunk_start)} unsuccessful, skipping")
+            continue
+        local_store.append_series_frame(frame)
+        if chunk_end < settled:
+            local_store.record_backfill(sites, params, chunk_start, chunk_end)
+    print(f"Backfilled {sites} {params}: {requested} chunk requests")
+    return requested
+
+
+def empty_series_frame():
+    """
+    Return a tidy series dataframe with no rows (see extract_series_frame()).
+    """
+    return pd.DataFrame({
+        'site': pd.Series(dtype=str),
+        'param': pd.Series(dtype=str),
+        'dateTime': pd.Series(dtype=f"datetime64[ns, {LOCAL_TZ}]"),
+        'value': pd.Series(dtype=float),
+        'qualifiers': pd.Series(dtype=str),
+    })
+
+
+def extract_series_frame(timeseries):
+    """
+    Accept the 'timeseries' subset of a USGS json response (any number of sites and parameters)
+    and return every observation in one tidy dataframe with the columns:
+    site, param (USGS parameter code), dateTime (local time), value (float), qualifiers (comma separated).
+    Timestamps and values are converted for all series at once rather than one observation at a time.
+    """
+    frames = []
+    for ts in timeseries:
+        observations = ts["values"][0]["value"]
+        if len(observations) > 0:
+            frame = pd.DataFrame.from_records(observations, columns=["dateTime", "value", "qualifiers"])
+            frame.insert(0, "site", ts["sourceInfo"]["siteCode"][0]["value"])
+            frame.insert(1, "param", ts["variable"]["variableCode"][0]["value"])
+            frames.append(frame)
+    if len(frames) == 0:
+        return empty_series_frame()
+    data = pd.concat(frames, ignore_index=True)
+    data["dateTime"] = pd.to_datetime(data["dateTime"], utc=True).dt.tz_convert(LOCAL_TZ)
+    data["value"] = data["value"].astype(float)
+    data["qualifiers"] = data["qualifiers"].str.join(",").astype(str)
+    return data
+
+
+def series_frame_to_iv_data(frame):
+    """
+    Rebuild an IV json response (the 'value' > 'timeSeries' layout) from a tidy series dataframe
+    (see extract_series_frame()), so series parsed from RDB can go through the same run cache,
+    local store and extraction steps as json responses.
+    """
+    timeseries = []
+    for (site, param), series in frame.groupby(["site", "param"], sort=False):
+        timeseries.append({
+            "sourceInfo": {"siteCode": [{"value": site}]},
+            "variable": {"variableCode": [{"value": param}]},
+            "values": [{"value": [
+                {"value": repr(float(value)), "qualifiers": qualifiers.split(",") if qualifiers else [],
+                 "dateTime": date_time.isoformat(timespec='milliseconds')}
+                for date_time, value, qualifiers in zip(series["dateTime"], series["value"], series["qualifiers"])]}],
+        })
+    return {"value": {"timeSeries": timeseries}}
 
 
 def extract_hourly_data(timeseries):
@@ -45,119 +480,236 @@ def extract_hourly_data(timeseries):
     This part of the data contains the last 24 hours of instantaneous value  (iv) gauge data
     and extract the observations then return them as a time series dataframe
     with two columns:
-    col 1) datetime (dtype datetime)
-    col 2) [parameter name] ...(should be either 'temp_c' or 'q' (dtype int)
+    col 1) datetime (dtype datetime, local time)
+    col 2) [parameter name] ...(should be either 'temp_c' or 'q' (dtype float)
+    Only the first series is used, see extract_series_frame() for all of them.
     """
-    try:
-        print("\nExtracting USGS gauge timeseries data from json")
-        param = timeseries[0]["variable"]["variableCode"][0]["value"]
-        if param == "00010":
-            param = "temp_c"
-        if param == "00060":
-            param = "q"
-        print(f"Parameter is: {param}\n")
-        # Sometime a parameter was formerly collected at a station but no longer is,
-        # check to make sure there is data in the 'timeseries>values>value slot
-        if len(timeseries[0]["values"][0]["value"]) > 0:
-            var_ts = []
-            datetime_ts = []
-            observations = timeseries[0]["values"][0]["value"]
-            for obs in observations:
-                var_ts.append(float(obs["value"]))
-                datetime_formatted = dt.strptime(obs["dateTime"], '%Y-%m-%dT%H:%M:%S.%f%z')
-                datetime_ts.append(datetime_formatted)
-            df = pd.DataFrame(list(zip(datetime_ts, var_ts)), columns=["dateTime", param])
-            print(f"Returning timeseries dataframe for {param}\n")
-            return df
-        else:
-            return None
-    except Exception as err:
-        print(err)
-        raise
+    print("\nExtracting USGS gauge timeseries data from json")
+    param = timeseries[0]["variable"]["variableCode"][0]["value"]
+    param = PARAM_NAMES.get(param, param)
+    print(f"Parameter is: {param}\n")
+    # Sometime a parameter was formerly collected at a station but no longer is,
+    # check to make sure there is data in the 'timeseries>values>value slot
+    series = extract_series_frame(timeseries[:1])
+    if len(series) > 0:
+        df = series[["dateTime", "value"]].rename(columns={"value": param})
+        print(f"Returning timeseries dataframe for {param}\n")
+        return df
+    else:
+        return None
+
+
+def parse_rdb(text):
+    """
+    Split a USGS RDB (tab-delimited) response into its tables. Each table starts after a block
+    of '#' comment lines with a row of column names and a row of column formats (e.g. '15s').
+    Return a list of dataframes with every column read as text.
+    """
+    tables = []
+    block = []
+    for line in text.splitlines():
+        if line.startswith('#'):
+            if len(block) > 0:
+                tables.append(block)
+                block = []
+        elif line.strip():
+            block.append(line)
+    if len(block) > 0:
+        tables.append(block)
+    return [pd.read_csv(StringIO("\n".join(lines)), sep="\t", dtype=str, skiprows=[1], keep_default_na=False)
+            for lines in tables]
+
+
+def parse_iv_rdb(text):
+    """
+    Parse an IV webservice response in RDB format into the same tidy dataframe as
+    extract_series_frame(). Each site's table has 'datetime'/'tz_cd' columns (local time and
+    zone abbreviation) followed by a '<ts_id>_<parameter code>' value column and a matching
+    '_cd' qualifier column for every series at the site. Values RDB reports as text (e.g. 'Ice',
+    'Eqp') or leaves blank with a qualifier are returned as NO_DATA_VALUE, as the json format
+    reports them; rows blank in both columns are times the series has no observation at all.
+    Qualifiers are joined with ',' as in extract_series_frame().
+    """
+    frames = []
+    for table in parse_rdb(text):
+        if len(table) == 0:
+            continue
+        offsets = table["tz_cd"].map(TZ_OFFSETS)
+        date_times = pd.to_datetime(table["datetime"] + offsets, utc=True).dt.tz_convert(LOCAL_TZ)
+        for column in table.columns:
+            param_match = re.fullmatch(r"\d+_(\d{5})", column)
+            if param_match is None:
+                continue
+            observed = (table[column] != "") | (table[f"{column}_cd"] != "")
+            frames.append(pd.DataFrame({
+                'site': table["site_no"][observed],
+                'param': param_match.group(1),
+                'dateTime': date_times[observed],
+                'value': pd.to_numeric(table[column][observed], errors='coerce').fillna(NO_DATA_VALUE),
+                'qualifiers': table[f"{column}_cd"][observed].str.replace(":", ",", regex=False),
+            }))
+    if len(frames) == 0:
+        return empty_series_frame()
+    return pd.concat(frames, ignore_index=True)
+
+
+def get_daily_stats(sites, param='00060', stat_types=('p50',)):
+
+    """
+    Retrieve the day-of-year statistics table (e.g. p10...p90 percentiles) for a list of sites
+    from the USGS statistics webservice, which only serves the RDB format. Responses are held in
+    the local http cache under the long 'usgs_stats' time-to-live.
+    Return a dataframe with site_no, month_nu, day_nu and one '<stat>_va' column per statistic
+    (with no rows if none of the sites have statistics), raising requests errors to the caller.
+    """
+
+    url = f"https://waterservices.usgs.gov/nwis/stat/?format=rdb&sites={','.join(sites)}" \
+          f"&parameterCd={param}&statReportType=daily&statTypeCd={','.join(stat_types)}"
+    print(f"Querying USGS statistics webservice at: {url}")
+    body = http_cache.cached_get(url, source='usgs_stats', timeout=30)
+    tables = parse_rdb(body)
+    if len(tables) == 0:
+        return pd.DataFrame(columns=["site_no", "month_nu", "day_nu"] + [f"{stat}_va" for stat in stat_types])
+    stats = pd.concat(tables, ignore_index=True)
+    stats["month_nu"] = stats["month_nu"].astype(int)
+    stats["day_nu"] = stats["day_nu"].astype(int)
+    for stat in stat_types:
+        stats[f"{stat}_va"] = pd.to_numeric(stats[f"{stat}_va"], errors='coerce')
+    return stats
+
+
+def summarize_day(ts, now=None):
+    """
+    Summarize a site's timeseries dataframe (dateTime, value columns as returned by extract_hourly_data)
+    in one pass over its arrays. Local days start at midnight in LOCAL_TZ. Return a dictionary of:
+    count (valid observations), min, max, mean (over the whole series), latest_value/latest_time
+    (most recent valid observation today, or the most recent overall if nothing has reported since
+    midnight), morning_min (minimum since local midnight, or latest_value if nothing has reported yet),
+    and today_count (valid observations since midnight). Values are in the series' units and NaN if missing.
+    """
+    now = pd.Timestamp.now(tz=LOCAL_TZ) if now is None else pd.Timestamp(now).tz_convert(LOCAL_TZ)
+    midnight = now.normalize().tz_convert("UTC").tz_localize(None).to_datetime64()
+    times = ts.iloc[:, 0].dt.tz_convert("UTC").dt.tz_localize(None).to_numpy(dtype="datetime64[ns]")
+    values = ts.iloc[:, 1].to_numpy(dtype=float)
+
+    valid = ~np.isnan(values)
+    today = valid & (times >= midnight)
+    summary = {'count': int(valid.sum()), 'today_count': int(today.sum()),
+               'min': np.nan, 'max': np.nan, 'mean': np.nan,
+               'latest_value': np.nan, 'latest_time': None, 'morning_min': np.nan}
+    if summary['count'] == 0:
+        return summary
 
+    summary['min'] = values[valid].min()
+    summary['max'] = values[valid].max()
+    summary['mean'] = values[valid].mean()
+    latest_pool = today if summary['today_count'] > 0 else valid
+    latest_index = np.flatnonzero(latest_pool)[-1]
+    summary['latest_value'] = values[latest_index]
+    summary['latest_time'] = ts.iloc[latest_index, 0]
+    if summary['today_count'] > 0:
+        summary['morning_min'] = values[today].min()
+    else:
+        # right after midnight nothing has reported yet today, the latest reading is the best estimate
+        summary['morning_min'] = summary['latest_value']
+    return summary
 
-def get_morning_minimum(ts):
+
+def c_to_f(temp_c):
     """
-    Filter the timseries dataframe for just values since midnight then find the minimum value and convert
-    from C to F
+    Convert a temperature from C to F, rounded to the nearest degree (NaN stays NaN, e.g. for a gauge that is down)
     """
-    # Filter the dataframe for just the values since midnight
-    today = dt.now().date().today()
-    today_df = ts.loc[(ts["dateTime"].dt.date == today)]
-    print(today_df.head(n=5))
-    # Find the minimum temperature from this morning and convert from C to F)
-    tw_min_c = np.nanmin(today_df.iloc[:, 1])
-    min_row = today_df[today_df.iloc[:, 1] == tw_min_c]
-    print(f"Minimum temperature readings from this morning's data call:\n{min_row}")
-    tw_min = round(tw_min_c * (9 / 5) + 32)
-    print(f"The minimum temp value since midnight is {tw_min_c} C / {tw_min} F.\n")
-    return tw_min
+    return np.nan if pd.isna(temp_c) else round(temp_c * (9 / 5) + 32)
 
 
-def get_most_recent_value(ts):
+def load_percentile_table(sites):
+    """
+    Load the day-of-year flow percentile tables (p10/p25/p50/p75/p90) for a list of sites into memory.
+    Tables are read from the local store; sites with no stored table, or one older than
+    PERCENTILE_TTL_DAYS, are refreshed first with a single batched call to the USGS statistics webservice.
+    """
+    fetch_times = local_store.get_percentile_fetch_times(sites)
+    expired = time.time() - PERCENTILE_TTL_DAYS * 24 * 60 * 60
+    stale_sites = [site for site in sites if fetch_times.get(site, 0) < expired]
+    if len(stale_sites) > 0:
+        # if the batched call fails (e.g. one site without statistics), try the sites one at a time
+        if not refresh_percentile_table(stale_sites) and len(stale_sites) > 1:
+            for site in stale_sites:
+                refresh_percentile_table([site])
+
+    for row in local_store.read_flow_percentiles(sites):
+        site, month, day = row[:3]
+        _percentile_table[(site, month, day)] = {
+            p: np.nan if value is None else value for p, value in zip(local_store.PERCENTILES, row[3:])
+        }
+    for site in sites:
+        _percentile_sites.add(site)
 
+
+def refresh_percentile_table(sites):
     """
-    Return the most recent water temp value from the timeseries dataframe.
+    Download the flow percentile tables for a list of sites in one statistics webservice call and
+    write them to the local store. Sites the webservice has no statistics for are stored as empty
+    tables, so they are only asked for again once PERCENTILE_TTL_DAYS have passed.
+    Return True if the tables were refreshed.
     """
-    # print(ts.head())
-    # Find the current water temperature
+    print(f"Refreshing flow percentile tables for {sites}")
     try:
-        today = dt.now().date().today()
-        today_df = ts.loc[(ts["dateTime"].dt.date == today)]
-        # if the function calls right around midnight, there may not be any data,
-        # in which case, just take the last most recent data from yesterday.
-        print(today_df.tail())
-        most_recent_temp = today_df.iloc[len(today_df) - 1][1]
-        most_recent_time = today_df.iloc[len(today_df) - 1][0]
-    except:
-        most_recent_temp = ts.iloc[len(ts) - 1][1]
-        most_recent_time = ts.iloc[len(ts) - 1][0]
-
-    print(f"Most recent value is {most_recent_temp} at {most_recent_time}.\n")
-    tw_curr = round(most_recent_temp * (9 / 5) + 32)
-    return tw_curr
+        try:
+            stats = get_daily_stats(sites, param='00060', stat_types=local_store.PERCENTILES)
+        except requests.exceptions.HTTPError as err:
+            # the webservice answers 'not found' when none of the sites have statistics; for a batch
+            # that can also be one bad site code, so only a single site is taken as having none
+            if len(sites) > 1 or err.response is None or err.response.status_code != 404:
+                raise
+            stats = None
+        local_store.store_flow_percentiles(stats, fetched_at=time.time(), sites=sites)
+        return True
+    except (requests.exceptions.RequestException, ValueError, KeyError) as err:
+        print(err)
+        print("Percentile table refresh unsuccessful, using any stored tables")
+        return False
+
+
+def get_flow_percentiles(site, date=None):
+    """
+    Return a dictionary of the flow percentiles ('p10'...'p90') for a site on a date (default today),
+    or None if the site has no statistics for that day. Loads the site's table on first use.
+    """
+    if site not in _percentile_sites:
+        load_percentile_table([site])
+    date = dt.today() if date is None else date
+    return _percentile_table.get((site, date.month, date.day))
 
 
 def get_q_median(site):
     """
-    Use the USGS dataretrieval package to return the 50th percentile (median) flow for this date in the POR
+    Return the 50th percentile (median) flow for this date in the POR from the site's percentile table
     """
-    param = '00060'
     print(f"Getting median flows for {site}")
-    try:
-        q_stats, md = nwis.get_stats(sites=site, parameterCd=param, statReportType='daily', statTypeCd='p50')
-        print(q_stats)
-        # extract the median flow for today's date
-        current_month = dt.today().month
-        current_day = dt.today().day
-        median_flow = int(q_stats.loc[(q_stats['month_nu'] == current_month) & (q_stats['day_nu'] == current_day), 'p50_va'])
-        return median_flow
-    except Exception as err:
-        print(err)
+    percentiles = get_flow_percentiles(site)
+    if percentiles is None or np.isnan(percentiles['p50']):
+        print(f"No median flow available for {site} today")
         return None
+    return int(percentiles['p50'])
 
 
 def calc_historical_flow_stat(site_data_list):
     """
     Call the USGS gauge site to get the median flows for the recent POR and
     determine the current discharge values as a percentage of the historic median.
-    Appends this statistic directlhy to the site information dictionary.
+    Sets this statistic directly on each site's conditions record (NaN if it can't be calculated).
     """
+    load_percentile_table([site_info.site for site_info in site_data_list])
     for site_info in site_data_list:
-        # if there is discharge at the site, make the api call, otherwise fill the
-        # dictionary slot with 'no rating'
-        print(f"Evaluating discharge stats:\nyesterday mean q: {site_info['yesterday_mean_q']}")
-        print(f"type, yesterday_mean_q: {type(site_info['yesterday_mean_q'])}")
-        if np.isnan(site_info['yesterday_mean_q']):
-            site_info['percent_of_median'] = '---'
-        else:
-            q_median = get_q_median(site_info['site'])
+        # if there is discharge at the site, look up the median, otherwise leave the statistic missing
+        print(f"Evaluating discharge stats:\nyesterday mean q: {site_info.yesterday_mean_q}")
+        site_info.percent_of_median = np.nan
+        if not np.isnan(site_info.yesterday_mean_q):
+            q_median = get_q_median(site_info.site)
             print(f"q_median is: {q_median}")
             if q_median is not None:
-                q_perc_median = round((site_info['yesterday_mean_q'] / q_median) * 100)
-            else:
-                q_perc_median = '---'
-            print(f"Percent of median is: {q_perc_median}")
-            site_info['percent_of_median'] = q_perc_median
+                site_info.percent_of_median = round((site_info.yesterday_mean_q / q_median) * 100)
+            print(f"Percent of median is: {site_info.percent_of_median}")
 
 #
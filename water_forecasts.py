@@ -21,15 +21,174 @@
 ###############################################################################
 
 # Python system packages
+import os
+import json
+import threading
+from collections import OrderedDict
 import numpy as np
 import pandas as pd
-from datetime import datetime as dt
 import pickle
 
 # Local modules
+import gam_export
 import hourly_weather
+import risk_levels
+import site_registry
 import usgs_calls
 
+###############################################################################
+# CONFIG
+###############################################################################
+
+MODEL_FOLDER = "./gam_models/"
+
+# Current version of each retrained model, written by train_models.py
+MODEL_MANIFEST = "./gam_models/manifest.json"
+
+# Most models held in memory at once (least recently used are dropped first)
+MAX_CACHED_MODELS = 10
+
+# Width of the confidence interval reported around the predicted high water temperature
+INTERVAL_WIDTH = 0.95
+
+# Number of days after today in each zone's outlook (the Openweathermap daily forecast covers 7)
+OUTLOOK_DAYS = 5
+
+# Ensemble (Monte Carlo) exceedance probabilities: number of input scenarios per zone and the random seed,
+# so a run's probabilities can be reproduced
+ENSEMBLE_SIZE = 4000
+ENSEMBLE_SEED = 2022
+
+# Standard deviations of the errors in the model inputs, used to perturb them in the ensemble. These are
+# replaced by each zone's errors fitted from its replayed forecasts (INPUT_ERRORS_FILE, written by
+# backtest.py) where available, and any of them can be set for a zone with 'input_errors' in the site registry.
+#   ta_max: forecast high air temperature error (F); there is no observed air temperature to fit it from
+#   tw_min: morning minimum water temperature error (F)
+#   q_mean: flow error, as a fraction of the flow (log-normal)
+DEFAULT_INPUT_ERRORS = {'ta_max': 3.0, 'tw_min': 0.5, 'q_mean': 0.10}
+INPUT_ERRORS_FILE = "./gam_models/input_errors.json"
+
+# Predict with the exported NumPy models (gam_models/*.npz) instead of the pygam pickles when available
+USE_ARRAY_MODELS = True
+
+###############################################################################
+# MODEL CACHE
+###############################################################################
+
+# Loaded GAM models keyed by model name. Each slot holds the loaded file's (path, mtime, size) signature
+# when it was loaded, so a model rebuilt on disk is reloaded on its next use.
+_model_cache = OrderedDict()
+model_cache_stats = {'hits': 0, 'loads': 0}
+_model_lock = threading.Lock()  # models may be requested while the background preload is running
+
+# Parsed json files (model manifest, fitted input errors) keyed by file name, each with the (mtime, size)
+# signature of the file it was read from
+_json_cache = {}
+
+
+def read_json_file(file_name):
+    """
+    Return the contents of one of the json files written next to the models (the model manifest and the
+    fitted input errors), or an empty dictionary if there is none. The parsed file is kept with its
+    (mtime, size) signature and only read again when the file changes, like the models themselves.
+    """
+    try:
+        file_stat = os.stat(file_name)
+    except FileNotFoundError:
+        return {}
+    signature = (file_stat.st_mtime_ns, file_stat.st_size)
+    cached = _json_cache.get(file_name)
+    if cached is None or cached[0] != signature:
+        with open(file_name) as json_file:
+            cached = (signature, json.load(json_file))
+        _json_cache[file_name] = cached
+    return cached[1]
+
+
+def read_manifest():
+    """
+    Return the model manifest (see train_models.py) as a dictionary keyed by model name.
+    """
+    return read_json_file(MODEL_MANIFEST)
+
+
+def resolve_model_file(model_name):
+    """
+    Return the file (relative to ./gam_models/) to load for a zone's model: the current retrained
+    version listed in the model manifest if there is one, otherwise the model name itself.
+    """
+    entry = read_manifest().get(model_name)
+    if entry is not None and os.path.exists(os.path.join(MODEL_FOLDER, entry['file'])):
+        return entry['file']
+    return model_name
+
+
+def load_model(model_name):
+    """
+    Return the GAM model for a river reach, loading it from ./gam_models/ only the first time it is
+    needed or when the file has changed since it was loaded. A retrained version listed in the model
+    manifest replaces the original model (see train_models.py). The exported NumPy version of the model
+    (<model>.npz, see gam_export.py) is used when present, otherwise the pygam pickle is unpickled.
+    """
+    model_file = resolve_model_file(model_name)
+    file_name = gam_export.array_file_name(model_file, MODEL_FOLDER)
+    use_arrays = USE_ARRAY_MODELS and os.path.exists(file_name)
+    if not use_arrays:
+        file_name = os.path.join(MODEL_FOLDER, model_file)
+    file_stat = os.stat(file_name)
+    signature = (file_name, file_stat.st_mtime_ns, file_stat.st_size)
+    with _model_lock:
+        cached = _model_cache.get(model_name)
+        if cached is not None and cached[0] == signature:
+            _model_cache.move_to_end(model_name)
+            model_cache_stats['hits'] += 1
+            return cached[1]
+        if use_arrays:
+            gam = gam_export.ArrayGAM(file_name)
+        else:
+            with open(file_name, 'rb') as model_file:
+                gam = pickle.load(model_file)
+        _model_cache[model_name] = (signature, gam)
+        _model_cache.move_to_end(model_name)
+        model_cache_stats['loads'] += 1
+        while len(_model_cache) > MAX_CACHED_MODELS:
+            _model_cache.popitem(last=False)
+    return gam
+
+
+def preload_models(model_names=None, background=True):
+    """
+    Load the models for every forecast zone in the site registry (or a given list of model names)
+    into the model cache. With background=True the loading runs on a separate thread, so it overlaps
+    the program's web requests, and the thread is returned.
+    """
+    if model_names is None:
+        model_names = list(dict.fromkeys(zone["model_name"] for zone in site_registry.forecast_zones()))
+
+    def load_all():
+        for model_name in model_names:
+            try:
+                load_model(model_name)
+            except Exception as error:
+                print(f"Preloading model {model_name} was unsuccessful")
+                print(error)
+
+    if not background:
+        load_all()
+        return None
+    thread = threading.Thread(target=load_all, name="preload_models", daemon=True)
+    thread.start()
+    return thread
+
+
+def report_model_cache():
+    """
+    Print the number of model predictions served from memory versus loaded from file.
+    """
+    print(f"GAM model cache: {model_cache_stats['hits']} hits, {model_cache_stats['loads']} loads, "
+          f"{len(_model_cache)} models held in memory.")
+
+
 ###############################################################################
 # FORECAST FUNCTIONS
 ###############################################################################
@@ -37,126 +196,185 @@ import usgs_calls
 
 def build_prediction_dataset(params, air_fx):
     """
-    Package the parameters needed for the water temperature prediction model into.
-    Accepts a dictionary of parameters and returns a single row dataframe.    a
+    Package the parameters needed for the water temperature prediction model into a dataframe
+    with one row per forecast hour. Accepts a dictionary of the day's parameters (tw_min, q_mean, doy)
+    and the hourly air temperature forecast, and returns a dataframe in the model's column order.
     """
     print("building prediction dataset")
     data = pd.DataFrame({
-        'ta_f': air_fx["temps"],
-        'tw_min': params['tw_min_wolcott'],
-        'q_mean': params['q_gypsum'],
+        'ta_max': air_fx["temps"].values,
+        'tw_min': params['tw_min'],
+        'q_mean': params['q_mean'],
         'doy': params['doy']
     })
     return data
 
 
-def predict_temps(pred_data, model_name):
+def predict_intervals(pred_data, model_name, width=INTERVAL_WIDTH):
     """
-    Load a pre-built GAM model for a stream location and feed it the prediction data.
-    Requires a dataframe of prediction data and the appropriate GAM model name for
-    a given river reach.
-    Returns the predicted high stream temperature of the day for the site.
+    Return the lower and upper confidence interval bounds (F) of the model prediction for each row of
+    a prediction dataset, as an array with one (lower, upper) row per input row. The exported NumPy
+    models keep a precomputed factor of each model's coefficient covariance, so this is one matrix
+    product per call; the pygam pickles fall back to gam.confidence_intervals.
     """
-    print(f"Predicting temps with model {model_name}")
+    print(f"Predicting {width:.0%} confidence intervals with model {model_name}")
     try:
-        # load gam model
-        file_name = f"./gam_models/{model_name}"
-        with open(file_name, 'rb') as model_file:
-            gam = pickle.load(model_file)
-        # feed it the prediction dataset
-        x_data = pred_data.values
-        predicted_temp_f = gam.predict(x_data)
-        # ci_95 = gam.confidence_intervals(x_data)
-        # print(f"95% confidence interval is: {ci_95}")
-        # format the results and append to the prediction dataframe
-        # pred_data["tw_max_f.predicted"] = pred_temps_f
-        # pred_data["tw_max_f.predicted"] = pred_data["tw_max_f.predicted"].round()
-        # pred_data["tw_max_f.ci95_upper"] = ci_95[0][1].round(1)
-        # pred_data["tw_max_f.ci95_lower"] = ci_95[0][0].round(1)
-        # return a dictionary of prediction results
-        return predicted_temp_f[0].round()
+        gam = load_model(model_name)
+        return gam.confidence_intervals(pred_data.values, width=width)
     except Exception as error:
-        print("Model prediction was unsuccessful")
+        print("Confidence interval prediction was unsuccessful")
         print(error)
         raise
 
 
-# THIS FUNCTION IS FROM THE ORIGINAL TEXT EMAILS AND IS DEPRECATED FOR THE TIME BEING UNTIL
-# THE CREATION/FORMATTING FUNCTIONS FOR THOSE EMAILS ARE UPDATED BH 8/26/2021
-# def identify_daily_concerns(temp_pred):
-#     """
-#     Review water temperature forecast data to determine when and if temperatures will reach either 'Concern' risk
-#     levels or 'High' risk levels for fishing and report the time of day and a narrative outreach message.
-#     """
-#
-#     danger_level_time = None
-#     concern_level_time = None
-#     for index, row in temp_pred.iterrows():
-#         print(row["tw_max_f.predicted"])
-#         if row["tw_max_f.predicted"] > 70:
-#             print(f"temp at {row['time']}  is {row['tw_max_f.predicted']}")
-#             danger_level_time = row["time"]
-#             break
-#             # return {'concern_time': concern_level_time, 'danger_time': danger_level_time}
-#         if row["tw_max_f.predicted"] > 65:
-#             print(f"Concern: temp at {row['time']}  is {row['tw_max_f.predicted']}")
-#             if concern_level_time is not None:
-#                 concern_level_time = min(row["time"], concern_level_time)
-#             else:
-#                 concern_level_time = row["time"]
-#
-#     print(concern_level_time)
-#     print(danger_level_time)
-#
-#     if (concern_level_time is None) & (danger_level_time is not None):
-#         warning_message = f"Water temperatures are expected to exceed 'High' risk levels (> 70 F) for fish by around {danger_level_time}."
-#     if (concern_level_time is None) & (danger_level_time is None):
-#         warning_message = f"Water temperatures are not expected to meet 'Concern' or 'High' risk levels today. " \
-#                           f"Monitor your local venue for unexpectedly warm conditions."
-#     if (concern_level_time is not None) & (danger_level_time is None):
-#         warning_message = f"Water temperatures are expected to reach 'Concern' risk levels (65-70 F) by around {concern_level_time}."
-#     if (concern_level_time is not None) & (danger_level_time is not None):
-#         warning_message = f"Water temperatures are expected to reach 'Concern' risk levels (65-70 F) by around {concern_level_time} " \
-#                           f"and exceed 'High' risk levels (> 70 F) for fish around {danger_level_time}."
-#
-#     return warning_message
+def predict_hourly_temps(pred_data, model_name):
+    """
+    Feed every row of an hourly prediction dataset (see build_prediction_dataset) to the GAM model
+    for a river reach in a single prediction call.
+    Returns an array of predicted water temperatures (F), one per forecast hour.
+    """
+    print(f"Predicting hourly temps with model {model_name}")
+    try:
+        gam = load_model(model_name)
+        return gam.predict(pred_data.values).round(1)
+    except Exception as error:
+        print("Hourly model prediction was unsuccessful")
+        print(error)
+        raise
 
 
-def get_risk_level(temp):
+def select_outlook_days(daily_air_fx, today, days=OUTLOOK_DAYS):
     """
-    Return a narrative risk level rating based on an integer temperature value input.
+    Return the rows of the daily weather forecast for the next few days after today (a local date). Rows
+    are picked by date rather than position, since a forecast fetched (or cached) before local midnight
+    still starts with the day before.
     """
-    if temp >= 71:
-        risk = "High"
-    if (temp > 65) & (temp < 71):
-        risk = "Concern"
-    if temp <= 65:
-        risk = "Low"
-    print(f"The assessed water temp risk for {temp} F is: {risk}")
-    return risk
+    return daily_air_fx[daily_air_fx["date"] > today].iloc[:days]
 
 
-def load_site_config_file():
+def forecast_outlook(params, high_temp, daily_air_fx, model_name, today, reach=None, days=OUTLOOK_DAYS):
     """
-    Load the site configuration file. This .csv file contains various data
-    about each temperature prediction reach including the usgs gauge name for getting streamflow
-    and current water temperature data.
+    Predict the high water temperature for each of the next few days, one day at a time. Accepts today's
+    prediction parameters (tw_min, q_mean, doy), today's predicted high water temperature, the daily
+    weather forecast, and today's local date. Each day's morning minimum water temperature is carried
+    forward from the day before: the previous day's predicted high less today's daily range (high minus
+    morning minimum). The air temperature is each day's forecast high, the day of year follows the
+    forecast date, and the flow is held at today's, since it has no forecast to follow.
+    Returns a list of dictionaries (date, doy, ta_max, tw_min, max_temp, risk, weather), one per day.
     """
-    return pd.read_csv("./program_files/weather_fx_sites.csv",
-                       header=1, dtype={'flow_gauge': str, 'temp_gauge': str,})
+    outlook_days = select_outlook_days(daily_air_fx, today, days=days)
+    if len(outlook_days) == 0:
+        return []
+    print(f"Predicting a {len(outlook_days)} day outlook with model {model_name}")
+    gam = load_model(model_name)
+    daily_range = high_temp - params['tw_min']
+    previous_high = high_temp
+    outlook = []
+    for date, ta_max, weather in zip(outlook_days["date"], outlook_days["temp_max"], outlook_days["weather"]):
+        tw_min = previous_high - daily_range
+        doy = date.timetuple().tm_yday
+        high = gam.predict(np.array([[ta_max, tw_min, params['q_mean'], doy]], dtype=float)).round()[0]
+        outlook.append({"date": date, "doy": doy, "ta_max": ta_max, "tw_min": round(float(tw_min), 1),
+                        "max_temp": int(high), "risk": get_risk_level(high, reach=reach), "weather": weather})
+        previous_high = float(high)
+    return outlook
+
+
+def zone_input_errors(zone_info):
+    """
+    Return the input error standard deviations for a zone's ensemble: DEFAULT_INPUT_ERRORS, replaced by
+    the zone's fitted errors (INPUT_ERRORS_FILE) and then by any 'input_errors' set in the site registry.
+    """
+    fitted = read_json_file(INPUT_ERRORS_FILE).get(zone_info["zone"], {})
+    errors = dict(DEFAULT_INPUT_ERRORS)
+    errors.update({key: fitted[key] for key in DEFAULT_INPUT_ERRORS if key in fitted})
+    errors.update(zone_info.get("input_errors", {}))
+    return errors
 
 
-def fix_site_id(site_no):
+def simulate_exceedance(params, model_name, input_errors=None, reach=None, n_scenarios=ENSEMBLE_SIZE, seed=ENSEMBLE_SEED):
+    """
+    Estimate the probability that the day's high water temperature reaches each risk level above 'Low'.
+    The model inputs (ta_max, tw_min, q_mean, doy) are perturbed with the zone's input error
+    distributions (DEFAULT_INPUT_ERRORS, overridden by input_errors, see zone_input_errors) and every scenario is run through
+    the model in one batched prediction. Returns a dictionary of {risk level: probability}, e.g.
+    {'Concern': 0.42, 'High': 0.08}, where each probability counts scenarios whose rounded high is at
+    that level or above.
     """
-    Read in a USGS site number, convert it to a string, and re-append the '0' in front of
-    any of the sites in our area (Upper Colorado River Basin) that are prefixed with '09....'
-    If .csv files are viewed or manipulated in Excel, USGS site names are often interpreted
-    as numbers the preceeding '0' is removed, causing errors later when trying to call the site.
+    errors = dict(DEFAULT_INPUT_ERRORS, **(input_errors or {}))
+    rng = np.random.default_rng(seed)
+    scenarios = np.column_stack([
+        params['ta_max'] + rng.normal(0, errors['ta_max'], n_scenarios),
+        params['tw_min'] + rng.normal(0, errors['tw_min'], n_scenarios),
+        params['q_mean'] * np.exp(rng.normal(0, errors['q_mean'], n_scenarios)),
+        np.full(n_scenarios, params['doy']),
+    ])
+    # rounded to whole degrees like the forecast high, so the probabilities agree with its risk level
+    high_temps = np.round(load_model(model_name).predict(scenarios))
+    table = risk_levels.get_temp_table(reach=reach)
+    levels = risk_levels.level_index(high_temps, table)
+    return {label: float(np.mean(levels >= level)) for level, label in enumerate(table['labels'][1:], start=1)}
+
+
+def identify_daily_concerns(times, temps, reach=None):
     """
-    site_str = str(site_no)
-    if site_str[0] == '9':  # fix local Colorado/Eagle basin USGS site names that get truncated by excel
-        site_str = f"0{site_str}"
-    return site_str
+    Review an hourly water temperature forecast curve to determine when and if temperatures will reach
+    either 'Concern' risk levels or 'High' risk levels for fishing. Returns a dictionary with the
+    first forecast time at each level ('concern_time', 'high_time', None if not reached) and a
+    narrative outreach message.
+    """
+    table = risk_levels.get_temp_table(reach=reach)
+    levels = risk_levels.level_index(temps, table)
+    times = list(times)
+    crossing_times = {}
+    for level, label in enumerate(table['labels'][1:], start=1):
+        reached = np.flatnonzero(levels >= level)
+        crossing_times[label] = times[reached[0]] if len(reached) > 0 else None
+    concern_time = crossing_times.get('Concern')
+    high_time = crossing_times.get('High')
+    # Concern is the first level above Low, so it is never reached later than High
+    concern_limit, high_limit = table['edges'][0][0], table['edges'][1][0]
+
+    if high_time is not None and concern_time == high_time:
+        message = f"Water temperatures are expected to exceed 'High' risk levels (>= {high_limit} F) " \
+                  f"for fish by around {high_time:%I %p}."
+    elif concern_time is None:
+        message = "Water temperatures are not expected to meet 'Concern' or 'High' risk levels today. " \
+                  "Monitor your local venue for unexpectedly warm conditions."
+    elif high_time is None:
+        message = f"Water temperatures are expected to reach 'Concern' risk levels " \
+                  f"({concern_limit}-{high_limit - 1} F) by around {concern_time:%I %p}."
+    else:
+        message = f"Water temperatures are expected to reach 'Concern' risk levels " \
+                  f"({concern_limit}-{high_limit - 1} F) by around {concern_time:%I %p} and exceed 'High' risk " \
+                  f"levels (>= {high_limit} F) for fish around {high_time:%I %p}."
+    return {'concern_time': concern_time, 'high_time': high_time, 'message': message}
+
+
+def assess_hourly_curve(times, hourly_temps, reach=None):
+    """
+    Read the day's predicted high, its risk level, and the Concern/High crossing times off an hourly
+    water temperature forecast curve. The curve is rounded to whole degrees before anything is read
+    off it, so the high, its risk level, and the crossing times always agree (a 64.6 F peak is a
+    65 F 'Concern' high with a Concern time). Returns the identify_daily_concerns dictionary plus
+    'hottest_hour' (index of the predicted high), 'high_temp', and 'pm_risk'.
+    """
+    rounded_temps = np.round(np.asarray(hourly_temps, dtype=float))
+    hottest_hour = int(np.nanargmax(rounded_temps))
+    assessment = identify_daily_concerns(times, rounded_temps, reach=reach)
+    assessment['hottest_hour'] = hottest_hour
+    assessment['high_temp'] = rounded_temps[hottest_hour]
+    assessment['pm_risk'] = get_risk_level(assessment['high_temp'], reach=reach)
+    return assessment
+
+
+def get_risk_level(temp, reach=None):
+    """
+    Return a narrative risk level rating based on an integer temperature value input.
+    """
+    risk = risk_levels.classify_temperature(temp, reach=reach)
+    print(f"The assessed water temp risk for {temp} F is: {risk}")
+    return risk
 
 
 #################################################################################################
@@ -164,60 +382,109 @@ def fix_site_id(site_no):
 ###############################################################################
 
 
-def forecast_stream_temperature():
+def summarize_zone_gauges(flow_ts, temp_ts, now=None):
+    """
+    Get the prediction model's gauge inputs for a zone from its flow and water temperature series
+    (dataframes from usgs_calls.extract_hourly_data, either may be None) as of the forecast time
+    (default: the current time). Returns a dictionary of the current flow (q_mean, cfs), this morning's
+    minimum water temperature (tw_min, F; minimum since midnight up until now), and the current water
+    temperature (current_temp, F), with NaN for anything missing.
+    """
+    gauge_inputs = {"q_mean": np.nan, "tw_min": np.nan, "current_temp": np.nan}
+
+    # Get most recent streamflow (cfs)
+    if flow_ts is not None:
+        flow_summary = usgs_calls.summarize_day(flow_ts, now=now)
+        if flow_summary['count'] > 0:
+            gauge_inputs["q_mean"] = round(flow_summary['latest_value'])
+            print(f"Current flow is {gauge_inputs['q_mean']}")
+
+    # Get this morning's minimum temperature and the current temperature
+    if temp_ts is not None:
+        temp_summary = usgs_calls.summarize_day(temp_ts, now=now)
+        if temp_summary['count'] > 0:
+            gauge_inputs["tw_min"] = usgs_calls.c_to_f(temp_summary['morning_min'])
+            gauge_inputs["current_temp"] = usgs_calls.c_to_f(temp_summary['latest_value'])
+            print(f"Morning minimum is {gauge_inputs['tw_min']} F, current temp is {gauge_inputs['current_temp']} F "
+                  f"at {temp_summary['latest_time']}")
+    return gauge_inputs
+
+
+def extract_gauge_series(gauge_data):
+    """
+    Return the series dataframe (see usgs_calls.extract_hourly_data) from a gauge data source's USGS json
+    response, or None if the response is missing or holds no series.
+    """
+    if gauge_data is None or len(gauge_data["value"]["timeSeries"]) == 0:
+        return None
+    return usgs_calls.extract_hourly_data(gauge_data["value"]["timeSeries"])
+
+
+def live_gauge_data(site, param, now):
+    """
+    Default gauge data source for forecast_stream_temperature: the last day of instantaneous values
+    for a site and parameter from the USGS webservice (through the run cache and local store), as a
+    USGS json response. The webservice always returns the day up to the current time, so now is unused.
+    """
+    return usgs_calls.get_site_data(site=site, param=param)
+
+
+def live_weather_forecast(zone_info, now):
+    """
+    Default weather source for forecast_stream_temperature: the Openweathermap forecast for a zone's
+    coordinates as of the current time (now is unused), as the json response.
+    """
+    return hourly_weather.get_ow_fx(lat=zone_info["lat"], lon=zone_info["lon"])
+
+
+def forecast_stream_temperature(clock=None, gauge_source=live_gauge_data, weather_source=live_weather_forecast,
+                                zones=None):
     """
     Create a list of dictionaries for each stream temperature forecasting reach. Return the
     list to be used in creating an HTML table in email alerts.
+    The forecast time and the data it is made from can be swapped out to replay past days (see backtest.py):
+    clock is a function returning the forecast time as a timezone-aware datetime (default: the current
+    time in usgs_calls.LOCAL_TZ), gauge_source(site, param, now) returns the day of gauge data up to the
+    forecast time as a USGS json response, weather_source(zone, now) returns the Openweathermap forecast
+    made at that time as a json response, and zones is the list of registry zones to forecast (default: all).
     """
-    prediction_sites = load_site_config_file()
+    if clock is not None:
+        # series cached during this run are for the current time, not the replayed one
+        usgs_calls.clear_run_cache()
+    now = clock() if clock is not None else pd.Timestamp.now(tz=usgs_calls.LOCAL_TZ)
     zone_forecasts = []
-    proceed = True
-    for index, site_data in prediction_sites.iterrows():
+    for site_data in (site_registry.forecast_zones() if zones is None else zones):
+        proceed = True  # reset for each zone so one zone's missing data doesn't stop the rest
         print("************************************************************************")
         print(f"\nAssessing {site_data['zone']}\n")
         # get the flow and temperature data since midnight
         print('getting flow data')
-        flow_data = usgs_calls.get_site_data(site=fix_site_id(site_data["flow_gauge"]), param='00060')
+        flow_data = gauge_source(site_data["flow_gauge"], '00060', now)
         print('getting temperature data')
-        temp_data = usgs_calls.get_site_data(site=fix_site_id(site_data["temp_gauge"]), param='00010')
+        temp_data = gauge_source(site_data["temp_gauge"], '00010', now)
 
         # If both temperature and flow data is available, unpack it and get the relevant values
         # for the prediction model, otherwise go to next site in the loop.
         if (flow_data is not None) and (temp_data is not None):
-            
-            # # TODO: These functions break for timeseries around midnight, (which is okay, the program isn't called at those times), but could use some work
-
-            # Get most recent streamflow
-            timeseries = flow_data["value"]["timeSeries"]
-            if len(timeseries) > 0:
-                flow_ts = usgs_calls.extract_hourly_data(timeseries)
-                print(flow_ts.tail())
-                current_flow = usgs_calls.get_most_recent_value(flow_ts)
-                print(f"Current flow at {site_data['flow_gauge']} is {current_flow}")
-            else:
-                current_flow = np.nan
+            gauge_inputs = summarize_zone_gauges(extract_gauge_series(flow_data), extract_gauge_series(temp_data),
+                                                 now=now)
+            current_flow = gauge_inputs["q_mean"]
+            am_tw_min_temp = gauge_inputs["tw_min"]
+            current_temp = gauge_inputs["current_temp"]
+            if np.isnan(current_flow) or np.isnan(am_tw_min_temp):
                 proceed = False
-
-            # Get this morning's minimum temperature (Minimum since midnight up until now)
-            timeseries = temp_data["value"]["timeSeries"]
-            if len(timeseries) > 0:
-                temp_ts = usgs_calls.extract_hourly_data(timeseries)
-                am_tw_min_temp = usgs_calls.get_morning_minimum(temp_ts)
-                current_temp = usgs_calls.get_most_recent_value(temp_ts)
-            else:
-                am_tw_min_temp = np.nan
-                current_temp = np.nan
-                proceed = False
-
         else:
             print("Flow and temperature retrieval unsuccessful, site will not be assessed.")
             proceed = False
             # continue
 
-        # get the next day of hourly weather forecasts, including air temperature and sky cover
+        # get the next day of hourly weather forecasts, including air temperature and sky cover, and the
+        # daily forecasts for the outlook (both come from the same Openweathermap response)
         print(f"-------------------------------------------------")
-        print(f"Getting hourly weather for {site_data['zone']}...")
-        hourly_air_fx = hourly_weather.get_hourly_fx(lat=site_data["lat"], lon=site_data["lon"])
+        print(f"Getting hourly and daily weather for {site_data['zone']}...")
+        weather_fx = weather_source(site_data, now)
+        hourly_air_fx = hourly_weather.unpack_fx_data(weather_fx)
+        daily_air_fx = hourly_weather.unpack_daily_fx(weather_fx)
 
         # If weather data is successfully returned from the api, unpack it and get the predicted temperature
         # at noon and the predicted maximum temperature for the day
@@ -247,36 +514,78 @@ def forecast_stream_temperature():
         # TODO: this function has gotten way too long, consider breaking up into 3(?) parts as well as moving the try/except blocks to inside of their respective function calls
 
         if proceed:
-            prediction_data = {
-                "ta_max": [max_air_temp],
-                "tw_min": [am_tw_min_temp],
-                "q_mean": [current_flow],
-                "doy": [dt.now().timetuple().tm_yday]
+            prediction_params = {
+                "tw_min": am_tw_min_temp,
+                "q_mean": current_flow,
+                "doy": now.timetuple().tm_yday
             }
-            print(f"Prediction dataset:   {prediction_data}")
+            print(f"Prediction parameters:   {prediction_params}")
 
-            # cast it to a dataframe for feeding to the pygam model
-            pred_data_max = pd.DataFrame(prediction_data)
-
-            # send to pygam model to get a water temperature prediction
+            # build one row per forecast hour and send them all to the pygam model in one call, then read the
+            # predicted high, its risk level, and when the curve first reaches Concern and High off the curve
+            pred_data_hourly = build_prediction_dataset(prediction_params, hourly_air_fx)
             try:
-                high_temp = predict_temps(pred_data=pred_data_max, model_name=site_data["model_name"])
+                hourly_temps = predict_hourly_temps(pred_data=pred_data_hourly, model_name=site_data["model_name"])
+                assessment = assess_hourly_curve(hourly_air_fx["dateTime"], hourly_temps, reach=site_data["zone"])
+                hottest_hour = assessment["hottest_hour"]
+                high_temp = assessment["high_temp"]
+                pm_risk = assessment["pm_risk"]
                 print(f"Predicted high water temp is {high_temp}")
+                print(assessment["message"])
             except Exception as error:
                 print(error)
                 raise
 
-            # assign the predicted risk level
-            pm_risk = get_risk_level(high_temp)
+            # get the confidence interval around the predicted high, the forecast goes out without it if it fails
+            try:
+                high_temp_lower, high_temp_upper = predict_intervals(
+                    pred_data_hourly.iloc[[hottest_hour]], model_name=site_data["model_name"])[0].round()
+                print(f"{INTERVAL_WIDTH:.0%} confidence interval is {high_temp_lower} - {high_temp_upper}")
+            except Exception:
+                high_temp_lower, high_temp_upper = np.nan, np.nan
+
+            # run an ensemble of perturbed inputs through the model for the chance of reaching Concern and High
+            try:
+                exceedance = simulate_exceedance(
+                    {"ta_max": max_air_temp, "tw_min": am_tw_min_temp, "q_mean": current_flow,
+                     "doy": prediction_params["doy"]},
+                    site_data["model_name"], input_errors=zone_input_errors(site_data), reach=site_data["zone"])
+                print(f"Chance of reaching Concern: {exceedance['Concern']:.0%}, High: {exceedance['High']:.0%}")
+            except Exception as error:
+                print("Ensemble prediction was unsuccessful")
+                print(error)
+                exceedance = {}
+
+            # predict the high water temps for the next few days, the forecast goes out without them if it fails
+            outlook = []
+            if daily_air_fx is not None:
+                try:
+                    outlook = forecast_outlook(prediction_params, high_temp, daily_air_fx, site_data["model_name"],
+                                               now.date(), reach=site_data["zone"])
+                except Exception as error:
+                    print("Outlook prediction was unsuccessful")
+                    print(error)
 
             # Pack everything into a dictionary then append it to the list of prediction dictionaries
             zone_info = {
                 "zone": site_data["zone"],
                 "current_temp": current_temp,
                 "max_temp": int(high_temp),
+                "max_temp_lower": high_temp_lower,
+                "max_temp_upper": high_temp_upper,
                 "pm_risk": pm_risk,
                 "pm_air_temp": int(max_air_temp),
-                "pm_weather": afternoon_sky
+                "pm_weather": afternoon_sky,
+                "concern_time": assessment["concern_time"],
+                "high_time": assessment["high_time"],
+                "concern_message": assessment["message"],
+                "p_concern": exceedance.get("Concern", np.nan),
+                "p_high": exceedance.get("High", np.nan),
+                "outlook": outlook,
+                "ta_max": max_air_temp,
+                "tw_min": am_tw_min_temp,
+                "q_mean": current_flow,
+                "doy": prediction_params["doy"]
             }
             print("------------------------------------------------------------------------")
             print("Returning zone data:")